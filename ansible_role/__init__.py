@@ -9,17 +9,20 @@
 
 import os
 import sys
-import shutil
-import tempfile
-import argparse
-from tempfile import NamedTemporaryFile
-
-import shellescape
-from fabric import api
-from fabric.colors import red, cyan
 
+# everything else is imported where it's used, so that `ansible-role
+# --help` and `import ansible_role` stay fast.  see tests/test_startup.py
 from ansible_role.version import __version__
-from ansible_role.console import report as base_report
+from ansible_role import console
+from ansible_role.console import INFO, WARNING, ERROR
+from ansible_role.console import red, cyan, report as base_report
+from ansible_role.util import ensure_dir, read_list_file, split_role_spec
+from ansible_role import deps, fleet, metrics, proc
+
+try:
+    string_types = basestring
+except NameError:  # python 3
+    string_types = str
 
 FAIL = red('✖ ')
 SUCCESS = cyan('✓ ')
@@ -27,157 +30,1344 @@ SUCCESS = cyan('✓ ')
 report = lambda *args, **kargs: base_report(
     'ansible-role', *args, **kargs)
 
+# multi-host runs share one playbook, targeted per host with an extra-var
+TARGET_HOST_VAR = 'ansible_role_target'
+TARGET_HOST_PATTERN = '{{ ' + TARGET_HOST_VAR + ' }}'
+
+# --inventory-stream runs target this group of a per-batch inventory
+BATCH_GROUP = 'ansible_role_batch'
+
+# how plays are executed: by forking ansible-playbook on a generated
+# playbook file, or inside this process through ansible's python API
+ENGINES = ('subprocess', 'inprocess')
+
+# what --connections can do with persistent ssh connections
+CONNECTION_COMMANDS = ('status', 'close')
+
 USAGE = (
-    'Usage: ansible-role rolename.username [hostname]'
-    ' [ansible-playbook args]\n\nThis command applies the given ansible '
-    'role to the specified host.\nWhen hostname is not given, '
-    '`localhost` will be used.\n\nIf --module-path is not given, '
-    'the role will be downloaded to a temporary directory using '
-    'ansible-galaxy.\n\nIf --module-path is given, then the role will '
+    'Usage: ansible-role rolename.username [hostname[,hostname..]]'
+    ' [ansible-playbook args]\n'
+    '       ansible-role role.one role.two [..] hostname'
+    ' [ansible-playbook args]\n\n'
+    'This command applies the given ansible role to the specified host.\n'
+    'When hostname is not given, `localhost` will be used.\n\n'
+    'Several roles (and/or --roles-file FILE, one role per line) are '
+    'applied\nin order by a single ansible-playbook run.  The last '
+    'positional argument is\nthe host whenever more than one is '
+    'given.\n\n'
+    'Several comma-separated hosts (and/or --hosts-file FILE, one host '
+    'per line)\nare handled by a pool of --workers N (default: 5) '
+    'parallel ansible-playbook runs.\n\n'
+    'If --module-path is not given, the role will be downloaded to a '
+    'temporary directory using ansible-galaxy.\n\n'
+    'If --module-path is given, then the role will '
     'be downloaded only if "$module_path/roles/rolename.username" does '
-    'not already exist.  Nothing will be cleaned afterwards.\n\n\n'
+    'not already exist.  Nothing will be cleaned afterwards.\n\n'
+    'Roles downloaded without --module-path are kept in a persistent '
+    'cache\n(default: $XDG_CACHE_HOME/ansible-role, see --cache-dir) '
+    'and reused by\nlater runs.  Use --no-cache to always download.\n\n'
+    'Missing roles and their dependencies are downloaded by '
+    '--galaxy-workers N\n(default: 4) concurrent ansible-galaxy '
+    'processes.\n\n'
+    'With --engine=inprocess the play is built in memory and run through '
+    'ansible\'s\npython API inside this process, instead of forking '
+    'ansible-playbook.\n\n'
+    'ansible-role bundle role.name [..] -o roles.tar.gz packs roles and '
+    'their\ndependencies into one archive; --bundle FILE applies them '
+    'without galaxy.\n\n'
+    '--fact-cache keeps gathered facts for --fact-cache-ttl SECONDS '
+    '(default: 3600)\nbetween runs; ansible-role facts host[,host..] '
+    'gathers them ahead of time.\n\n'
+    '--ssh-persist keeps ssh connections open for --ssh-persist-time '
+    'SECONDS (default:\n600) between runs, with pipelining.  '
+    '--connections status|close manages them.\n\n'
+    '--plan shows which roles would be downloaded, the playbook and the '
+    'commands,\nwithout creating, downloading or running anything.\n\n'
+    '--skip-unchanged skips hosts already converged with the same roles '
+    'and\narguments within --skip-unchanged-ttl SECONDS (default: 86400).'
+    '\n\n'
+    '--changed-only starts each host\'s run at the first task affected by '
+    'role changes\nsince its last successful run.\n\n'
+    '--inventory-stream FILE|- reads hosts lazily and applies the role to '
+    'them in\nbatches of --batch-size N (default: 200), each with a '
+    'small generated inventory.\n\n'
+    'Rollouts: --wave-size N|N% splits the hosts into waves, of which '
+    '--wave-concurrency\nN (default: 1) run at once; no new waves start '
+    'once more than --max-failures\nN|N% (default: 0) hosts failed.\n\n'
+    '--profile times every task and handler per host, reports the '
+    '--profile-top N\n(default: 10) slowest and writes folded stacks '
+    'for flamegraphs to\n--profile-output PATH (default: '
+    'ansible-role.folded).\n\n'
+    'Play options: --play-become, --play-gather-facts yes|no, '
+    '--play-serial N|N% and\n--play-var KEY=VALUE (repeatable) set '
+    'become, gather_facts, serial and vars\nof the generated play.  '
+    'Playbooks are kept in $cache_dir/playbooks and reused.\n\n'
+    '--log-level LEVEL (debug, info, warning, error) and --log-format '
+    'json control\nansible-role\'s own messages.  Output from parallel '
+    'hosts is tagged per line.\n\n'
+    '--report-json PATH and --report-metrics PATH write per-phase timings, '
+    'cache hits\nand download sizes as JSON or OpenMetrics text.\n\n'
+    'Every run is recorded in $cache_dir/history.sqlite (--no-history '
+    'to skip);\nansible-role stats [--role NAME] [--host HOST] '
+    '[--days 7] [--json] reports\npercentiles and regressions per '
+    'role and host.\n\n'
+    'ansible-role mirror [--port N] [--config FILE] runs a local caching '
+    'proxy for\ngalaxy; point ansible-galaxy at it with '
+    '$ANSIBLE_GALAXY_SERVER or the config.\n\n'
+    'ansible-role --serve [--socket PATH] starts a daemon that keeps '
+    'ansible warm;\nansible-role --daemon ... (or $ANSIBLE_ROLE_DAEMON=1) '
+    'hands the command to it.\n\n\n'
     'ALL OTHER OPTIONS will be passed on to ansible-playbook!\n\n')
 
 
-class HelpFormatter(argparse.HelpFormatter):
-    usage = USAGE
+def get_help_formatter():
+    """ formatter class that always shows USAGE, created on demand
+        so that argparse is only imported when parsing
+    """
+    import argparse
+
+    class HelpFormatter(argparse.HelpFormatter):
+        usage = USAGE
 
-    def format_help(self):
-        return self.usage
+        def format_help(self):
+            return self.usage
+    return HelpFormatter
 
 
 def get_parser():
     """ creates the parser for the ansible-role command line utility """
+    import argparse
     parser = argparse.ArgumentParser(
         prog=os.path.split(sys.argv[0])[-1],
-        formatter_class=HelpFormatter,)
-    parser.add_argument('rolename', type=str, nargs=1,)
-    parser.add_argument('host', type=str, nargs='?', default='localhost',)
+        formatter_class=get_help_formatter(),)
+    parser.add_argument('rolename', type=str, nargs='*',)
+    parser.add_argument('--roles-file',)
+    parser.add_argument('--hosts-file',)
+    parser.add_argument(
+        '--workers', type=int, default=fleet.DEFAULT_WORKERS,)
     parser.add_argument('--module-path', '-M',)
+    parser.add_argument('--cache-dir',)
+    parser.add_argument('--no-cache', action='store_true', default=False,)
+    parser.add_argument(
+        '--engine', choices=ENGINES, default=ENGINES[0],)
+    parser.add_argument(
+        '--galaxy-workers', type=int, default=deps.DEFAULT_WORKERS,)
+    parser.add_argument('--bundle',)
+    parser.add_argument('--report-json',)
+    parser.add_argument('--report-metrics',)
+    parser.add_argument('--log-level', choices=sorted(console.LEVELS),)
+    parser.add_argument('--log-format', choices=console.FORMATS,)
+    parser.add_argument('--fact-cache', action='store_true', default=False,)
+    parser.add_argument('--fact-cache-ttl', type=int,)
+    parser.add_argument('--ssh-persist', action='store_true', default=False,)
+    parser.add_argument('--ssh-persist-time', type=int,)
+    parser.add_argument('--connections', choices=CONNECTION_COMMANDS,)
+    parser.add_argument('--plan', action='store_true', default=False,)
+    parser.add_argument(
+        '--skip-unchanged', action='store_true', default=False,)
+    parser.add_argument('--skip-unchanged-ttl', type=int,)
+    parser.add_argument(
+        '--changed-only', action='store_true', default=False,)
+    parser.add_argument('--inventory-stream',)
+    parser.add_argument(
+        '--batch-size', type=int, default=fleet.DEFAULT_BATCH_SIZE,)
+    parser.add_argument('--profile', action='store_true', default=False,)
+    parser.add_argument('--profile-top', type=int,)
+    parser.add_argument('--profile-output',)
+    parser.add_argument('--wave-size',)
+    parser.add_argument('--wave-concurrency', type=int, default=1,)
+    parser.add_argument('--max-failures', default='0',)
+    parser.add_argument('--play-become', action='store_true', default=None,)
+    parser.add_argument('--play-gather-facts', choices=('yes', 'no'),)
+    parser.add_argument('--play-serial',)
+    parser.add_argument(
+        '--play-var', action='append', default=[], metavar='KEY=VALUE',)
+    parser.add_argument('--no-history', action='store_true', default=False,)
+    return parser
+
+
+def get_play_options(prog_args):
+    """ the play options given on the command line; raises ValueError
+        for malformed --play-var arguments
+    """
+    play_vars = {}
+    for spec in prog_args.play_var:
+        key, sep, value = spec.partition('=')
+        if not sep or not key:
+            raise ValueError('--play-var wants KEY=VALUE, got: ' + spec)
+        play_vars[key] = value
+    serial = prog_args.play_serial
+    if serial and serial.isdigit():
+        serial = int(serial)
+    gather_facts = None
+    if prog_args.play_gather_facts:
+        gather_facts = prog_args.play_gather_facts == 'yes'
+    return dict(
+        become=prog_args.play_become, gather_facts=gather_facts,
+        serial=serial, vars=play_vars or None)
+
+
+def get_bundle_parser():
+    """ parser for `ansible-role bundle` """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog=os.path.split(sys.argv[0])[-1] + ' bundle',)
+    parser.add_argument('rolename', type=str, nargs='*',)
+    parser.add_argument('--output', '-o', required=True,)
+    parser.add_argument('--roles-file',)
+    parser.add_argument(
+        '--galaxy-workers', type=int, default=deps.DEFAULT_WORKERS,)
+    return parser
+
+
+def get_facts_parser():
+    """ parser for `ansible-role facts` """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog=os.path.split(sys.argv[0])[-1] + ' facts',)
+    parser.add_argument('hosts', type=str, nargs='?',)
+    parser.add_argument('--hosts-file',)
+    parser.add_argument(
+        '--workers', type=int, default=fleet.DEFAULT_WORKERS,)
+    parser.add_argument('--cache-dir',)
+    parser.add_argument('--fact-cache-ttl', type=int,)
+    return parser
+
+
+def get_mirror_parser():
+    """ parser for `ansible-role mirror` """
+    import argparse
+    from ansible_role import mirror
+    parser = argparse.ArgumentParser(
+        prog=os.path.split(sys.argv[0])[-1] + ' mirror',)
+    parser.add_argument('--bind', default=mirror.DEFAULT_BIND,)
+    parser.add_argument('--port', type=int, default=mirror.DEFAULT_PORT,)
+    parser.add_argument('--upstream', default=mirror.DEFAULT_UPSTREAM,)
+    parser.add_argument('--cache-dir',)
+    parser.add_argument(
+        '--max-age', type=int, default=mirror.DEFAULT_MAX_AGE,)
+    parser.add_argument('--config',)
+    return parser
+
+
+def get_stats_parser():
+    """ parser for `ansible-role stats` """
+    import argparse
+    from ansible_role import history
+    parser = argparse.ArgumentParser(
+        prog=os.path.split(sys.argv[0])[-1] + ' stats',)
+    parser.add_argument('--cache-dir',)
+    parser.add_argument('--role',)
+    parser.add_argument('--host',)
+    parser.add_argument('--days', type=float, default=history.DEFAULT_DAYS,)
+    parser.add_argument(
+        '--tolerance', type=float, default=history.DEFAULT_TOLERANCE,)
+    parser.add_argument('--json', action='store_true', default=False,)
     return parser
 
 
+def split_positionals(positionals, roles_file=None):
+    """ splits the positional arguments into (roles, host).  the last
+        positional is the host when there are several of them, or when
+        the roles come from a roles-file.  host is None when not given.
+    """
+    roles = list(positionals)
+    host = None
+    if roles_file and roles:
+        host = roles.pop()
+    elif len(roles) > 1:
+        host = roles.pop()
+    if roles_file:
+        roles = read_list_file(roles_file) + roles
+    return roles, host
+
+
+def role_list(role_name):
+    """ role_name is either one role or a list of roles """
+    return list(role_name) if isinstance(role_name, (list, tuple)) \
+        else [role_name]
+
+
+@metrics.timed('role_dir')
 def get_or_create_role_dir(module_path):
     role_dir = os.path.join(module_path, 'roles')
     if not os.path.exists(role_dir):
         msg = "ansible role-dir does not exist at '{0}', creating it"
         report(msg.format(role_dir))
-        api.local('mkdir -p "{0}"'.format(role_dir))
+        ensure_dir(role_dir)
     return role_dir
 
 
 def escape_args(extra_ansible_args):
-    """ """
-    return [
-        shellescape.quote(x) if ' ' in x else x
-        for x in extra_ansible_args
-    ]
+    """ shell-quotes arguments for display.  commands are executed
+        from argv lists, so the arguments themselves are never quoted.
+    """
+    import shellescape
+    return [shellescape.quote(x) for x in extra_ansible_args]
 
 
 def role_apply(role_name='role.name',
                hosts='localhost',
                module_path=None,
-               extra_ansible_args=[]):
-    """ """
+               extra_ansible_args=[],
+               use_cache=True,
+               cache_dir=None,
+               workers=fleet.DEFAULT_WORKERS,
+               galaxy_workers=deps.DEFAULT_WORKERS,
+               engine=ENGINES[0],
+               bundle=None,
+               env=None,
+               state=None,
+               snapshots=None,
+               host_stream=None,
+               batch_size=fleet.DEFAULT_BATCH_SIZE,
+               rollout=None,
+               play_options=None):
+    """ applies `role_name` (a role, or a list of roles applied in order)
+        to `hosts`, which is either a host pattern or a list of hosts.
+        a list is handled by `workers` parallel ansible-playbook runs
+        sharing the same resolved role.  missing roles are downloaded by
+        `galaxy_workers` concurrent ansible-galaxy processes, unless they
+        come from the role bundle at `bundle`.  `engine` is one of ENGINES.
+        `env` holds extra ANSIBLE_* settings for the ansible run.  with a
+        `state` store (see ansible_role.state), hosts that were already
+        converged with the same roles and arguments are skipped.  with a
+        `snapshots` store, only what changed since a host's last
+        successful run is applied (see ansible_role.changes).  hosts can
+        also come from `host_stream`, an iterable that is consumed lazily
+        in batches of `batch_size`, instead of `hosts`.  with a `rollout`
+        (see ansible_role.rollout), hosts are updated in waves.
+        `play_options` are the become, gather_facts, serial and vars of
+        the play (see ansible_role.playbooks).
+    """
+    import shutil
+    import tempfile
+    from ansible_role import playbooks
+    playbook_store = playbooks.get_store(cache_dir)
     module_path_created = False
     if not module_path:
         module_path = tempfile.mkdtemp()
         module_path_created = True
         report("ansible module-path not given, using {0}".format(module_path))
+        # the play names roles in this directory, so no later run could
+        # reuse its playbook: it goes away with the directory instead
+        playbook_store = playbooks.PlaybookStore(module_path)
     else:
         extra_ansible_args += ['--module-path', module_path]
-    extra_ansible_args = escape_args(extra_ansible_args)
     role_dir = get_or_create_role_dir(module_path)
     try:
-        success, exit_code = apply_ansible_role(
-            role_name, role_dir,
-            hosts=hosts,
-            ansible_args=extra_ansible_args,
-            report=report)
-        if not success and module_path_created:
+        if bundle:
+            from ansible_role.bundle import extract_bundle
+            with metrics.phase('bundle'):
+                extract_bundle(bundle, role_dir, report=report)
+        elif module_path_created and use_cache:
+            import functools
+            from ansible_role.cache import RoleCache
+            cache = RoleCache(cache_dir=cache_dir, report=report)
+            install = functools.partial(
+                install_ansible_role, workers=galaxy_workers)
+            for name in role_list(role_name):
+                with metrics.phase('cache'):
+                    hit = cache.fetch(name, role_dir, install=install)
+                metrics.add('cache_hits' if hit else 'cache_misses')
+        if host_stream is not None:
+            success, exit_code = apply_ansible_role_to_stream(
+                role_name, role_dir, host_stream,
+                ansible_args=extra_ansible_args,
+                batch_size=batch_size,
+                galaxy_workers=galaxy_workers,
+                engine=engine,
+                env=env,
+                play_options=play_options,
+                playbook_store=playbook_store,
+                report=report)
+        elif rollout is not None:
+            success, exit_code = apply_ansible_role_in_waves(
+                role_name, role_dir,
+                hosts if isinstance(hosts, (list, tuple)) else [hosts],
+                rollout,
+                ansible_args=extra_ansible_args,
+                galaxy_workers=galaxy_workers,
+                engine=engine,
+                env=env,
+                play_options=play_options,
+                playbook_store=playbook_store,
+                report=report)
+        elif isinstance(hosts, (list, tuple)):
+            success, exit_code = apply_ansible_role_to_hosts(
+                role_name, role_dir, hosts,
+                ansible_args=extra_ansible_args,
+                workers=workers,
+                galaxy_workers=galaxy_workers,
+                engine=engine,
+                env=env,
+                state=state,
+                snapshots=snapshots,
+                play_options=play_options,
+                playbook_store=playbook_store,
+                report=report)
+        else:
+            success, exit_code = apply_ansible_role(
+                role_name, role_dir,
+                hosts=hosts,
+                ansible_args=extra_ansible_args,
+                galaxy_workers=galaxy_workers,
+                engine=engine,
+                env=env,
+                state=state,
+                snapshots=snapshots,
+                play_options=play_options,
+                playbook_store=playbook_store,
+                report=report)
+        metrics.current.set(
+            'role_versions', get_role_versions(role_name, role_dir))
+        if not success and module_path_created and not use_cache:
             report("next time pass --module-path if you "
-                   "want to avoid redownloading the role")
+                   "want to avoid redownloading the role", level=WARNING)
     finally:
         if module_path_created:
             shutil.rmtree(module_path)
     return success, exit_code
 
 
-def require_ansible_role(role_name, role_dir, report=base_report):
+def role_plan(role_name='role.name',
+              hosts='localhost',
+              module_path=None,
+              extra_ansible_args=[],
+              use_cache=True,
+              cache_dir=None,
+              bundle=None,
+              env=None,
+              play_options=None):
+    """ what role_apply would do with the same arguments, as a dict for
+        plan.format_plan.  nothing is created, downloaded or run.
+    """
+    from ansible_role import plan
+    ansible_args = list(extra_ansible_args)
+    cache = None
+    if module_path:
+        ansible_args += ['--module-path', module_path]
+    else:
+        module_path = plan.TEMP_MODULE_PATH
+        if use_cache and not bundle:
+            from ansible_role.cache import RoleCache
+            cache = RoleCache(cache_dir=cache_dir)
+    role_dir = os.path.join(module_path, 'roles')
+    bundled = {}
+    if bundle:
+        from ansible_role.bundle import read_manifest
+        bundled = read_manifest(bundle)['roles']
+    multi_host = isinstance(hosts, (list, tuple))
+    playbook = get_playbook_for_role(
+        role_name, role_dir,
+        hosts=TARGET_HOST_PATTERN if multi_host else hosts,
+        options=play_options)
+    cmd = ['ansible-playbook', plan.TEMP_PLAYBOOK] + ansible_args
+    commands = [cmd]
+    if multi_host:
+        commands = [
+            cmd + ['-e', '{0}={1}'.format(TARGET_HOST_VAR, host)]
+            for host in hosts]
+    quoted = [escape_args(x) for x in commands]
+    return dict(
+        role_dir=role_dir,
+        role_dir_exists=os.path.isdir(role_dir),
+        roles=plan.resolve(role_list(role_name), role_dir, cache, bundled),
+        playbook=playbook,
+        env=dict(env or {}),
+        commands=commands,
+        quoted=quoted,
+        quoting_ok=all(
+            plan.check_quoting(x, y) for x, y in zip(commands, quoted)))
+
+
+def galaxy_install(role_name, role_dir):
+    """ downloads `role_name`, without its dependencies, into `role_dir`.
+        the role is downloaded into a staging directory and renamed into
+        place under the role's lock, so processes sharing a role-dir
+        never see a partial role, and only one of them downloads it.
+    """
+    import shutil
+    import tempfile
+    from ansible_role import index
+    from ansible_role.locks import role_lock
+    from ansible_role.util import STAGING_PREFIX, move_into_place, tree_size
+    name, version = split_role_spec(role_name)
+    role_path = os.path.join(role_dir, name)
+    role_index = index.RoleIndex(role_dir)
+    with role_lock(role_dir, name):
+        # another process may have installed it while we waited
+        if role_index.check(name) == index.INSTALLED:
+            return
+        staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=role_dir)
+        try:
+            cmd = ['ansible-galaxy', 'install', '--no-deps',
+                   '-p', staging, role_name]
+            result = proc.run(cmd)
+            if not result.succeeded:
+                err = "missing role {0} could not be installed"
+                raise RuntimeError(err.format(role_name))
+            staged = os.path.join(staging, name)
+            if not os.path.isdir(staged):
+                err = "ansible-galaxy succeeded, but didn't install {0}"
+                raise RuntimeError(err.format(role_name))
+            move_into_place(staged, role_path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        role_index.record(name, source='galaxy')
+    metrics.add('roles_downloaded')
+    metrics.add('download_bytes', tree_size(role_path))
+
+
+def install_ansible_role(role_name, role_dir,
+                         workers=deps.DEFAULT_WORKERS, report=report):
+    """ downloads `role_name` and its dependencies into `role_dir`,
+        fetching up to `workers` roles concurrently
+    """
+    import functools
+    resolver = deps.DependencyResolver(
+        role_dir, galaxy_install, workers=workers, report=report,
+        is_installed=functools.partial(is_role_installed, role_dir))
+    return resolver.resolve([role_name])
+
+
+def is_role_installed(role_dir, name, report=None):
+    """ checks the role-dir's index for `name`.  roles that are on disk
+        but not indexed (e.g. written by hand, or installed by an older
+        ansible-role) are adopted into the index, unless they don't look
+        like a role at all (e.g. partly extracted), in which case they get
+        installed over.  roles that changed since they were installed are
+        reported and re-indexed, but never removed: they may be local
+        edits.
+    """
+    from ansible_role import index
+    role_index = index.RoleIndex(role_dir)
+    status = role_index.check(name)
+    if status == index.CORRUPT:
+        if report:
+            msg = "role '{0}' in {1} changed since it was installed, " \
+                "using it as it is"
+            report(msg.format(name, role_dir), level=WARNING)
+        role_index.record(
+            name, source=role_index.get(name).get('source', 'local'))
+    elif status == index.UNINDEXED:
+        role_index.record(name)
+    elif status == index.INCOMPLETE and report:
+        msg = "role '{0}' in {1} is incomplete, installing it again"
+        report(FAIL + msg.format(name, role_dir), level=WARNING)
+    return status in (index.INSTALLED, index.UNINDEXED, index.CORRUPT)
+
+
+@metrics.timed('require')
+def require_ansible_role(role_name, role_dir, report=base_report,
+                         workers=deps.DEFAULT_WORKERS):
     """ """
-    if role_name not in os.listdir(role_dir):
-        galaxy_cmd = 'ansible-galaxy install -p {role_dir} {role_name}'
+    name, version = split_role_spec(role_name)
+    if not is_role_installed(role_dir, name, report=report):
         msg = "role '{0}' not found in {1}"
-        report(FAIL + msg.format(role_name, role_dir))
-        cmd = galaxy_cmd.format(role_dir=role_dir, role_name=role_name)
-        result = api.local(cmd)
-        if not result.succeeded:
-            err = "missing role {0} could not be installed"
-            raise RuntimeError(err.format(role_name))
+        report(FAIL + msg.format(role_name, role_dir), level=WARNING)
+        install_ansible_role(
+            role_name, role_dir, workers=workers, report=report)
     msg = "ansible role '{0}' installed to '{1}'"
     msg = msg.format(role_name, role_dir)
     report(SUCCESS + msg)
 
 
+def get_role_paths(role_name, role_dir):
+    """ where each of the roles in `role_name` lives """
+    return [
+        os.path.join(role_dir, split_role_spec(name)[0])
+        for name in role_list(role_name)]
+
+
+def get_role_versions(role_name, role_dir):
+    """ {role: installed version, or None} for the roles in `role_name` """
+    from ansible_role.index import get_installed_version
+    return dict(
+        (split_role_spec(name)[0], get_installed_version(path))
+        for name, path in zip(
+            role_list(role_name), get_role_paths(role_name, role_dir)))
+
+
+def yaml_scalar(value):
+    """ `value` as a YAML scalar, quoted only when it has to be """
+    if value and value == value.strip() and \
+            not any(char in value for char in '{}[]#&*!|>\'"%@`'):
+        return value
+    import json
+    return json.dumps(value)
+
+
+@metrics.timed('render')
+def get_play_for_role(role_name, role_dir, hosts='localhost', options=None):
+    """ the play from get_playbook_for_role, as a dict, for engines
+        that don't need a playbook file
+    """
+    from ansible_role.playbooks import check_options
+    play = dict(hosts=hosts)
+    play.update(check_options(options))
+    play.update(roles=[dict(role=path) for path in get_role_paths(
+        role_name, role_dir)])
+    return play
+
+
+@metrics.timed('render')
 def get_playbook_for_role(
-        role_name, role_dir, hosts='localhost', report=base_report):
+        role_name, role_dir, hosts='localhost', report=base_report,
+        options=None):
     """ this provisioner applies a single ansible role.  this is more
         complicated than it sounds because there's no way to do this
-        without a playbook, and so a temporary playbook is created just
-        for this purpose.
+        without a playbook, and so a playbook is created just for this
+        purpose.  `role_name` may also be a list of roles, which are
+        applied in order by the same play.  `options` are the play
+        options of ansible_role.playbooks.  renderings are memoized.
+    """
+    from ansible_role import playbooks
+    return playbooks.render(
+        get_role_paths(role_name, role_dir), hosts, options)
+
+
+def get_play_runner(role_name, role_dir, hosts='localhost',
+                    engine=ENGINES[0], report=base_report, env=None,
+                    play_options=None, playbook_store=None):
+    """ context manager giving a function that runs the play for
+        `role_name` on `hosts` with the given `engine`, the ANSIBLE_*
+        settings in `env` and the given `play_options`.  the function
+        takes ansible-playbook arguments and returns (success, exit_code).
+        it may be called many times, e.g. with different extra-vars.
+        playbook files come from `playbook_store` (a
+        playbooks.PlaybookStore, default: the one in the cache dir).
+    """
+    import contextlib
+    import functools
+
+    @contextlib.contextmanager
+    def inprocess_runner():
+        from ansible_role import inprocess
+        play = get_play_for_role(
+            role_name, role_dir, hosts=hosts, options=play_options)
+        yield record_recap(
+            functools.partial(inprocess.run_play, play, env=env))
+
+    @contextlib.contextmanager
+    def subprocess_runner():
+        from ansible_role import playbooks
+        playbook_content = get_playbook_for_role(
+            role_name, role_dir, hosts=hosts, report=report,
+            options=play_options)
+        store = playbook_store or playbooks.get_store()
+        path = store.path(playbook_content)
+        msg = "using playbook {0} for applying role: {1}"
+        report(SUCCESS + msg.format(
+            path, ', '.join(role_list(role_name))))
+        yield record_recap(
+            functools.partial(run_ansible_playbook, path, env=env))
+    assert engine in ENGINES, "unknown engine: " + engine
+    if engine == 'inprocess':
+        return inprocess_runner()
+    return subprocess_runner()
+
+
+def record_recap(run_play):
+    """ wraps the `run_play` function of a play runner, so that the
+        per-host counters from the recap of every run end up in the
+        run's metrics, and from there in the run history
     """
-    def make_playbook_string(role_path):
-        return '\n'.join([
-            "- hosts: " + hosts,
-            "  roles:",
-            "  - {role: " + role_path + "}",
-        ])
-    role_path = os.path.join(role_dir, role_name)
-    playbook_content = make_playbook_string(role_path)
-    return playbook_content
+    def run(ansible_args, stream=None, **kargs):
+        from ansible_role.recap import RecapTee
+        tee = RecapTee(stream)
+        start = metrics.clock()
+        try:
+            return run_play(ansible_args, stream=tee, **kargs)
+        finally:
+            metrics.current.add_recap(tee.hosts, metrics.clock() - start)
+    return run
+
+
+def skip_if_unchanged(run_play, state, role_names, role_dir, host,
+                      report=base_report, play_options=None):
+    """ wraps the `run_play` function of a play runner for `host`.  with
+        a `state` store, the play is skipped when `host` was converged
+        with the same fingerprint (which covers the `play_options`)
+        before, and successful runs are recorded.  without one,
+        `run_play` is returned as is.
+    """
+    if state is None:
+        return run_play
+
+    def run(ansible_args, **kargs):
+        import time
+        from ansible_role.state import changes_nothing
+        fingerprint = state.fingerprint(
+            role_dir, role_names, host, ansible_args, play_options)
+        applied = state.unchanged(host, fingerprint)
+        if applied is not None:
+            msg = "{0}: unchanged since {1}, skipping"
+            report(SUCCESS + msg.format(host, time.strftime(
+                '%Y-%m-%d %H:%M:%S', time.localtime(applied))))
+            metrics.add('hosts_skipped')
+            return True, 0
+        success, code = run_play(ansible_args, **kargs)
+        if changes_nothing(ansible_args):
+            pass
+        elif success:
+            state.record(host, fingerprint)
+        else:
+            state.forget(host)
+        return success, code
+    return run
+
+
+def run_changed_only(run_play, snapshots, role_names, role_dir, host,
+                     report=base_report, play_options=None):
+    """ wraps the `run_play` function of a play runner for `host`.  with
+        a `snapshots` store, the play starts at the first task affected
+        by the role changes since the last successful run on `host`, and
+        is skipped when nothing changed.  runs with other arguments or
+        `play_options` than the last one run all tasks.  without a store,
+        `run_play` is returned as is.
+    """
+    if snapshots is None:
+        return run_play
+
+    def run(ansible_args, **kargs):
+        from ansible_role import changes
+        from ansible_role.state import changes_nothing, options_list
+        files = snapshots.role_files(role_dir, role_names)
+        last = snapshots.snapshot(host)
+        run_args = list(ansible_args)
+        if last is None or last.get('args') != list(ansible_args) or \
+                last.get('options', []) != options_list(play_options):
+            msg = "{0}: not applied with these arguments yet, running all tasks"
+            report(msg.format(host))
+        else:
+            changed = changes.diff(last.get('files', {}), files)
+            start = changes.start_task(changed, role_dir, role_names)
+            if not changed:
+                msg = "{0}: no role changes since the last run, skipping"
+                report(SUCCESS + msg.format(host))
+                metrics.add('hosts_skipped')
+                return True, 0
+            elif start:
+                msg = "{0}: {1} files changed, starting at task '{2}'"
+                report(msg.format(host, len(changed), start))
+                run_args += ['--start-at-task', start]
+            else:
+                msg = "{0}: {1} files changed, running all tasks"
+                report(msg.format(host, len(changed)))
+        success, code = run_play(run_args, **kargs)
+        if success and not changes_nothing(ansible_args):
+            snapshots.record_snapshot(
+                host, files, ansible_args, play_options)
+        return success, code
+    return run
+
+
+def run_ansible_playbook(playbook, ansible_args=[], stream=None, env=None):
+    """ runs ansible-playbook on the given playbook file, with the extra
+        environment variables in `env`.  returns (success, exit_code)
+    """
+    ansible_args = ansible_args if isinstance(ansible_args, (list,)) \
+        else ansible_args.split()
+    cmd = ['ansible-playbook', playbook] + ansible_args
+    result = proc.run(cmd, stream=stream, env=env)
+    return result.succeeded, result.return_code
 
 
 def apply_ansible_role(
-        role_name, role_dir, hosts='localhost', ansible_args='', report=None):
+        role_name, role_dir, hosts='localhost', ansible_args='', report=None,
+        galaxy_workers=deps.DEFAULT_WORKERS, engine=ENGINES[0], env=None,
+        state=None, snapshots=None, play_options=None, playbook_store=None):
     """ """
     report = report or base_report
     err = " should be a string!"
-    assert isinstance(role_name, (basestring,)), "role_name" + err
-    assert isinstance(role_dir, (basestring,)), "role_dir" + err
-    playbook_content = get_playbook_for_role(
-        role_name, role_dir, hosts=hosts, report=report)
-    require_ansible_role(role_name, role_dir, report=report)
-    with NamedTemporaryFile() as tmpf:
-        tmpf.write(playbook_content)
-        tmpf.seek(0)
-        msg = "created playbook {0} for applying role: {1}"
-        report(SUCCESS + msg.format(tmpf.name, role_name))
+    assert isinstance(role_name, (string_types, list)), "role_name" + err
+    assert isinstance(role_dir, (string_types,)), "role_dir" + err
+    for name in role_list(role_name):
+        require_ansible_role(
+            name, role_dir, report=report, workers=galaxy_workers)
+    ansible_args = ansible_args if isinstance(ansible_args, (list,)) \
+        else ansible_args.split()
+    runner = get_play_runner(
+        role_name, role_dir, hosts=hosts, engine=engine, report=report,
+        env=env, play_options=play_options, playbook_store=playbook_store)
+    role_names = role_list(role_name)
+    role_name = ', '.join(role_names)
+    with runner as run_play:
+        run_play = skip_if_unchanged(
+            run_changed_only(
+                run_play, snapshots, role_names, role_dir, hosts,
+                report=report, play_options=play_options),
+            state, role_names, role_dir, hosts, report=report,
+            play_options=play_options)
         report("applying ansible role '{0}'".format(role_name))
-        ansible_args = ansible_args if isinstance(ansible_args, (list,)) \
-            else ansible_args.split()
-        cmd = ['ansible-playbook', tmpf.name] + ansible_args
-        cmd = " ".join(cmd)
-        with api.settings(warn_only=True):
-            result = api.local(cmd)
-    success = result.succeeded
-    code = result.return_code
+        with metrics.phase('apply'):
+            success, code = run_play(ansible_args)
     icon = SUCCESS if success else FAIL
     msg = 'succeeded' if success else 'failed'
     report(icon + msg +
-           " applying ansible role: {0}".format(role_name))
+           " applying ansible role: {0}".format(role_name),
+           level=INFO if success else ERROR)
     return success, code
 
 
+def apply_ansible_role_to_hosts(
+        role_name, role_dir, hosts, ansible_args=[],
+        workers=fleet.DEFAULT_WORKERS, report=None,
+        galaxy_workers=deps.DEFAULT_WORKERS, engine=ENGINES[0], env=None,
+        state=None, snapshots=None, play_options=None, playbook_store=None):
+    """ applies the role to each of `hosts` with a pool of `workers`
+        ansible-playbook processes.  the role is resolved once, and every
+        worker shares one playbook whose target comes in as an extra-var.
+        returns (success, exit_code) for the run as a whole.  the
+        inprocess engine runs one host at a time.
+    """
+    report = report or base_report
+    for name in role_list(role_name):
+        require_ansible_role(
+            name, role_dir, report=report, workers=galaxy_workers)
+    runner = get_play_runner(
+        role_name, role_dir, hosts=TARGET_HOST_PATTERN, engine=engine,
+        report=report, env=env, play_options=play_options,
+        playbook_store=playbook_store)
+    role_names = role_list(role_name)
+    role_name = ', '.join(role_names)
+    ansible_args = ansible_args if isinstance(ansible_args, (list,)) \
+        else ansible_args.split()
+    if engine == 'inprocess' and workers > 1 and len(hosts) > 1:
+        # ansible's signal handlers only work in the main thread
+        report("the inprocess engine applies one host at a time, use "
+               "--engine=subprocess for {0} workers".format(workers),
+               level=WARNING)
+        workers = 1
+    msg = "applying ansible role '{0}' to {1} hosts with {2} workers"
+    report(msg.format(role_name, len(hosts), workers))
+    with runner as run_play:
+
+        def apply_to_host(host):
+            target = ['-e', '{0}={1}'.format(TARGET_HOST_VAR, host)]
+            run_host = skip_if_unchanged(
+                run_changed_only(
+                    run_play, snapshots, role_names, role_dir, host,
+                    report=report, play_options=play_options),
+                state, role_names, role_dir, host, report=report,
+                play_options=play_options)
+            if workers == 1:
+                with metrics.phase('apply'):
+                    return run_host(ansible_args + target)
+            # keeps concurrent hosts' output apart, line by line
+            stream = console.TaggedWriter(host)
+            try:
+                with metrics.phase('apply'):
+                    return run_host(ansible_args + target, stream=stream)
+            finally:
+                stream.close()
+        results = fleet.run_parallel(apply_to_host, hosts, workers=workers)
+    for result in results:
+        icon = SUCCESS if result.success else FAIL
+        msg = "{0}: exit code {1} after {2:.2f}s"
+        msg = msg.format(result.item, result.exit_code, result.duration)
+        if result.error:
+            msg += " ({0})".format(result.error)
+        report(icon + msg, level=INFO if result.success else ERROR)
+    exit_code = fleet.aggregate_exit_code(results)
+    success = exit_code == 0
+    failed = len([x for x in results if not x.success])
+    msg = "{0} applying ansible role: {1} ({2}/{3} hosts failed)"
+    report((SUCCESS if success else FAIL) + msg.format(
+        'succeeded' if success else 'failed',
+        role_name, failed, len(results)),
+        level=INFO if success else ERROR)
+    return success, exit_code
+
+
+def apply_ansible_role_in_waves(
+        role_name, role_dir, hosts, rollout, ansible_args=[], report=None,
+        galaxy_workers=deps.DEFAULT_WORKERS, engine=ENGINES[0], env=None,
+        play_options=None, playbook_store=None):
+    """ applies the role to `hosts` in the waves of `rollout` (a
+        rollout.Rollout).  each wave is one ansible-playbook run on all
+        of its hosts, whose per-host results come from the PLAY RECAP.
+        returns (success, exit_code) for the rollout as a whole.
+    """
+    from ansible_role.recap import RecapTee
+    report = report or base_report
+    for name in role_list(role_name):
+        require_ansible_role(
+            name, role_dir, report=report, workers=galaxy_workers)
+    ansible_args = ansible_args if isinstance(ansible_args, (list,)) \
+        else ansible_args.split()
+    user_forks = [x for x in ansible_args
+                  if x in ('-f', '--forks') or x.startswith('--forks=')]
+    if engine == 'inprocess' and rollout.concurrency > 1:
+        # ansible's signal handlers only work in the main thread
+        report("the inprocess engine runs one wave at a time, use "
+               "--engine=subprocess for {0} concurrent waves".format(
+                   rollout.concurrency), level=WARNING)
+        rollout.concurrency = 1
+    runner = get_play_runner(
+        role_name, role_dir, hosts=TARGET_HOST_PATTERN, engine=engine,
+        report=report, env=env, play_options=play_options,
+        playbook_store=playbook_store)
+    role_name = ', '.join(role_list(role_name))
+    with runner as run_play:
+
+        def apply_wave(number, wave):
+            args = ansible_args + [
+                '-e', '{0}={1}'.format(TARGET_HOST_VAR, ','.join(wave))]
+            if not user_forks:
+                forks = min(len(wave), fleet.MAX_BATCH_FORKS)
+                args += ['--forks', str(forks)]
+            msg = "wave {0}: applying ansible role '{1}' to {2} hosts"
+            report(msg.format(number, role_name, len(wave)))
+            writer = None
+            if rollout.concurrency > 1:
+                writer = console.TaggedWriter('wave {0}'.format(number))
+            tee = RecapTee(writer)
+            try:
+                with metrics.phase('apply'):
+                    success, exit_code = run_play(args, stream=tee)
+            finally:
+                if writer is not None:
+                    writer.close()
+            failed = tee.failed_hosts()
+            if not success and not failed:
+                # no recap to go by, e.g. the play didn't start
+                failed = list(wave)
+            icon = SUCCESS if success else FAIL
+            msg = "wave {0}: exit code {1}, {2}/{3} hosts failed"
+            report(icon + msg.format(
+                number, exit_code, len(failed), len(wave)),
+                level=INFO if success else ERROR)
+            return success, exit_code, failed
+        results = rollout.run(hosts, apply_wave)
+    metrics.current.set('waves', [x.as_dict() for x in results])
+    return report_waves(results, role_name, hosts, report)
+
+
+def report_waves(results, role_name, hosts, report):
+    """ reports the outcome of a rollout's waves, and returns
+        (success, exit_code) for the rollout as a whole
+    """
+    from ansible_role import rollout as rollouts
+    for result in results:
+        if result.skipped:
+            msg = "wave {0}: skipped ({1} hosts)"
+            report(FAIL + msg.format(result.number, len(result.hosts)),
+                   level=ERROR)
+        elif result.error:
+            msg = "wave {0}: {1}"
+            report(FAIL + msg.format(result.number, result.error),
+                   level=ERROR)
+    exit_code = rollouts.aggregate_exit_code(results)
+    success = exit_code == 0
+    failed = sum(len(x.failed_hosts) for x in results)
+    skipped = sum(len(x.hosts) for x in results if x.skipped)
+    msg = "{0} applying ansible role: {1} ({2} waves, {3}/{4} hosts " \
+        "failed, {5} skipped)"
+    report((SUCCESS if success else FAIL) + msg.format(
+        'succeeded' if success else 'failed', role_name, len(results),
+        failed, len(hosts), skipped), level=INFO if success else ERROR)
+    return success, exit_code
+
+
+def get_batch_inventory(hosts):
+    """ ini inventory putting `hosts` in BATCH_GROUP """
+    return '\n'.join(['[{0}]'.format(BATCH_GROUP)] + list(hosts)) + '\n'
+
+
+def apply_ansible_role_to_stream(
+        role_name, role_dir, host_stream, ansible_args=[],
+        batch_size=fleet.DEFAULT_BATCH_SIZE, report=None,
+        galaxy_workers=deps.DEFAULT_WORKERS, engine=ENGINES[0], env=None,
+        play_options=None, playbook_store=None):
+    """ applies the role to the hosts from `host_stream`, which is read
+        lazily, in batches of `batch_size` hosts.  every batch is one
+        ansible-playbook run of the same playbook, against a generated
+        inventory holding just that batch, so neither memory use nor
+        the playbook grow with the number of hosts.  results are
+        reported as each batch finishes.  returns (success, exit_code).
+    """
+    import time
+    import tempfile
+    report = report or base_report
+    for name in role_list(role_name):
+        require_ansible_role(
+            name, role_dir, report=report, workers=galaxy_workers)
+    ansible_args = ansible_args if isinstance(ansible_args, (list,)) \
+        else ansible_args.split()
+    user_forks = [x for x in ansible_args
+                  if x in ('-f', '--forks') or x.startswith('--forks=')]
+    runner = get_play_runner(
+        role_name, role_dir, hosts=BATCH_GROUP, engine=engine,
+        report=report, env=env, play_options=play_options,
+        playbook_store=playbook_store)
+    role_name = ', '.join(role_list(role_name))
+    results = []
+    done = 0
+    with runner as run_play:
+        for number, batch in enumerate(
+                fleet.batches(host_stream, batch_size), 1):
+            with tempfile.NamedTemporaryFile(
+                    mode='w', suffix='.ini') as inventory:
+                inventory.write(get_batch_inventory(batch))
+                inventory.flush()
+                batch_args = ansible_args + ['-i', inventory.name]
+                if not user_forks:
+                    forks = min(len(batch), fleet.MAX_BATCH_FORKS)
+                    batch_args += ['--forks', str(forks)]
+                with metrics.phase('apply'):
+                    start = time.time()
+                    success, exit_code = run_play(batch_args)
+            result = fleet.JobResult(
+                number, success, exit_code, time.time() - start)
+            results.append(result)
+            done += len(batch)
+            msg = "batch {0} ({1}..{2}, {3} hosts): exit code {4} after " \
+                "{5:.2f}s, {6} hosts done"
+            report((SUCCESS if success else FAIL) + msg.format(
+                number, batch[0], batch[-1], len(batch), exit_code,
+                result.duration, done), level=INFO if success else ERROR)
+    exit_code = fleet.aggregate_exit_code(results)
+    success = exit_code == 0
+    failed = len([x for x in results if not x.success])
+    msg = "{0} applying ansible role: {1} ({2}/{3} batches failed, " \
+        "{4} hosts)"
+    report((SUCCESS if success else FAIL) + msg.format(
+        'succeeded' if success else 'failed',
+        role_name, failed, len(results), done),
+        level=INFO if success else ERROR)
+    return success, exit_code
+
+
+def bundle_entry(args):
+    """ `ansible-role bundle`: packs roles into an offline bundle """
+    import functools
+    from ansible_role import bundle
+    parser = get_bundle_parser()
+    prog_args = parser.parse_args(args)
+    roles = prog_args.rolename
+    if prog_args.roles_file:
+        roles = read_list_file(prog_args.roles_file) + roles
+    if not roles:
+        parser.error('no role given')
+    install = functools.partial(
+        install_ansible_role, workers=prog_args.galaxy_workers)
+    try:
+        manifest = bundle.create_bundle(
+            roles, prog_args.output, install=install, report=report)
+    except (bundle.BundleError, RuntimeError) as exc:
+        report(FAIL + str(exc), level=ERROR)
+        return 1
+    msg = "bundled {0} roles into {1}"
+    report(SUCCESS + msg.format(len(manifest['roles']), prog_args.output))
+    return 0
+
+
+def facts_entry(args):
+    """ `ansible-role facts`: fills the fact cache for some hosts """
+    from ansible_role import facts
+    parser = get_facts_parser()
+    prog_args, extra_ansible_args = parser.parse_known_args(args)
+    hosts = fleet.parse_hosts(prog_args.hosts, prog_args.hosts_file)
+    if not hosts:
+        parser.error('no host given')
+    env = facts.get_fact_cache_env(
+        prog_args.cache_dir, prog_args.fact_cache_ttl or facts.DEFAULT_TTL)
+    msg = "gathering facts for {0} hosts into {1}"
+    report(msg.format(len(hosts), env['ANSIBLE_CACHE_PLUGIN_CONNECTION']))
+    result = facts.gather_facts(
+        hosts, env, ansible_args=extra_ansible_args,
+        forks=prog_args.workers)
+    return result.return_code
+
+
+def mirror_entry(args):
+    """ `ansible-role mirror`: serves a caching galaxy proxy """
+    from ansible_role import mirror
+    prog_args = get_mirror_parser().parse_args(args)
+    return mirror.serve(
+        cache_dir=prog_args.cache_dir,
+        upstream=prog_args.upstream,
+        bind=prog_args.bind,
+        port=prog_args.port,
+        max_age=prog_args.max_age,
+        config=prog_args.config)
+
+
+def stats_entry(args):
+    """ `ansible-role stats`: percentiles and regressions from the
+        run history
+    """
+    from ansible_role import history
+    prog_args = get_stats_parser().parse_args(args)
+    path = history.get_history_path(prog_args.cache_dir)
+    if not os.path.exists(path):
+        report("no run history in {0}".format(path), level=WARNING)
+        return 1
+    store = history.History(path)
+    try:
+        stats = history.get_stats(
+            store, days=prog_args.days, role=prog_args.role,
+            host=prog_args.host, tolerance=prog_args.tolerance)
+    finally:
+        store.close()
+    if prog_args.json:
+        import json
+        sys.stdout.write(json.dumps(stats, indent=1, sort_keys=True) + '\n')
+    else:
+        sys.stdout.write(history.format_stats(stats))
+    return 0
+
+
+def record_history(cache_dir, roles, run_metrics, exit_code):
+    """ appends this run to the run history; failing to is reported,
+        but doesn't fail the run
+    """
+    import sqlite3
+    from ansible_role import history
+    store = history.History(cache_dir=cache_dir)
+    try:
+        store.record(roles, run_metrics.as_dict(), exit_code,
+                     ansible_role_version=str(__version__))
+    except (sqlite3.Error, IOError, OSError) as exc:
+        report("could not record the run history: {0}".format(exc),
+               level=WARNING)
+    finally:
+        store.close()
+
+
+def get_targets(parser, prog_args):
+    """ (roles, hosts) from the positionals, --roles-file, --hosts-file
+        and --bundle
+    """
+    roles, host = split_positionals(
+        prog_args.rolename, prog_args.roles_file)
+    if prog_args.inventory_stream and host is not None:
+        # every positional is a role, the hosts come from the stream
+        roles.append(host)
+        host = None
+    elif prog_args.bundle and roles and host is None:
+        # like with --roles-file, a lone positional is the host
+        host = roles.pop()
+    if prog_args.bundle and not roles:
+        from ansible_role import bundle
+        try:
+            roles = bundle.requested_roles(
+                bundle.read_manifest(prog_args.bundle))
+        except (bundle.BundleError, IOError) as exc:
+            parser.error(str(exc))
+    if not roles:
+        parser.error('no role given')
+    hosts = fleet.parse_hosts(host, prog_args.hosts_file)
+    return roles, hosts or ['localhost']
+
+
+def get_run_env(prog_args):
+    """ (env, profile_path): the environment that --fact-cache,
+        --ssh-persist and --profile need for ansible-playbook, and the
+        file the profile records go to.  with --plan, nothing is created.
+    """
+    env = {}
+    if prog_args.fact_cache:
+        from ansible_role import facts
+        env.update(facts.get_fact_cache_env(
+            prog_args.cache_dir,
+            prog_args.fact_cache_ttl or facts.DEFAULT_TTL,
+            create=not prog_args.plan))
+    if prog_args.ssh_persist:
+        from ansible_role import ssh
+        env.update(ssh.get_ssh_env(
+            prog_args.cache_dir,
+            prog_args.ssh_persist_time or ssh.DEFAULT_PERSIST,
+            create=not prog_args.plan))
+    profile_path = None
+    if prog_args.profile:
+        from ansible_role import profile
+        if prog_args.plan:
+            profile_path = '<profile-records>'
+        else:
+            import tempfile
+            fd, profile_path = tempfile.mkstemp(
+                prefix='ansible-role-profile-', suffix='.jsonl')
+            os.close(fd)
+        env.update(profile.get_profile_env(profile_path))
+    return env, profile_path
+
+
+def get_state_stores(prog_args):
+    """ (state, snapshots): the stores behind --skip-unchanged and
+        --changed-only, or None for the ones not asked for
+    """
+    state = snapshots = None
+    if prog_args.skip_unchanged:
+        from ansible_role.state import StateStore, DEFAULT_TTL
+        state = StateStore(
+            prog_args.cache_dir, prog_args.skip_unchanged_ttl or DEFAULT_TTL)
+    if prog_args.changed_only:
+        from ansible_role.state import StateStore
+        snapshots = StateStore(prog_args.cache_dir)
+    return state, snapshots
+
+
+def warn_not_per_host(option):
+    report("--skip-unchanged and --changed-only work per host, "
+           "and are ignored with " + option, level=WARNING)
+
+
+def get_rollout(parser, prog_args, per_host=False):
+    """ the Rollout for --wave-size, or None.  `per_host` tells whether
+        per-host options, which rollouts ignore, were given
+    """
+    if not prog_args.wave_size:
+        return None
+    from ansible_role.rollout import Rollout, parse_count
+    for spec in (prog_args.wave_size, prog_args.max_failures):
+        try:
+            parse_count(spec, 1)
+        except ValueError as exc:
+            parser.error(str(exc))
+    if per_host:
+        warn_not_per_host('--wave-size')
+    return Rollout(
+        prog_args.wave_size,
+        concurrency=prog_args.wave_concurrency,
+        max_failures=prog_args.max_failures,
+        report=report)
+
+
+def get_host_stream(prog_args, per_host=False):
+    """ the hosts read from --inventory-stream, or None """
+    if not prog_args.inventory_stream:
+        return None
+    if per_host:
+        warn_not_per_host('--inventory-stream')
+    return fleet.stream_hosts(prog_args.inventory_stream)
+
+
+def plan_entry(prog_args, roles, hosts, extra_ansible_args, env,
+               play_options):
+    """ --plan: prints what the run would do, returns the exit code """
+    from ansible_role.plan import format_plan
+    if prog_args.inventory_stream:
+        hosts = [BATCH_GROUP]
+        extra_ansible_args = extra_ansible_args + [
+            '-i', '<batch-inventory.ini>']
+    plan = role_plan(
+        role_name=roles[0] if len(roles) == 1 else roles,
+        hosts=hosts[0] if len(hosts) == 1 else hosts,
+        module_path=prog_args.module_path,
+        extra_ansible_args=extra_ansible_args,
+        use_cache=not prog_args.no_cache,
+        cache_dir=prog_args.cache_dir,
+        bundle=prog_args.bundle,
+        env=env,
+        play_options=play_options)
+    sys.stdout.write(format_plan(plan))
+    if not plan['quoting_ok']:
+        report(FAIL + "the commands above don't survive shell "
+               "quoting", level=ERROR)
+        return 1
+    return 0
+
+
+def finish_run(prog_args, roles, hosts, run_metrics, code, profile_path):
+    """ writes the reports, history and profile of a finished run """
+    if prog_args.report_json:
+        run_metrics.write_json(
+            prog_args.report_json, version=__version__,
+            roles=roles, hosts=hosts, exit_code=code)
+    if prog_args.report_metrics:
+        run_metrics.write_openmetrics(prog_args.report_metrics)
+    if not prog_args.no_history:
+        from ansible_role import history
+        if history.enabled():
+            record_history(prog_args.cache_dir, roles, run_metrics, code)
+    if profile_path:
+        from ansible_role import profile
+        profile.report_profile(
+            profile_path,
+            top=prog_args.profile_top or profile.DEFAULT_TOP,
+            output=prog_args.profile_output or profile.DEFAULT_OUTPUT,
+            report=report)
+
+
+def run_entry(args):
+    """ `ansible-role role.name [host]`: applies roles, returns the
+        exit code
+    """
+    parser = get_parser()
+    prog_args, extra_ansible_args = parser.parse_known_args(args)
+    console.configure(level=prog_args.log_level, fmt=prog_args.log_format)
+    report('version {0}'.format(__version__))
+    if prog_args.connections:
+        from ansible_role import ssh
+        return ssh.manage_connections(
+            prog_args.connections, prog_args.cache_dir, report=report)
+    roles, hosts = get_targets(parser, prog_args)
+    try:
+        play_options = get_play_options(prog_args)
+    except ValueError as exc:
+        parser.error(str(exc))
+    env, profile_path = get_run_env(prog_args)
+    state, snapshots = get_state_stores(prog_args)
+    per_host = bool(state or snapshots)
+    rollout = get_rollout(parser, prog_args, per_host)
+    if prog_args.plan:
+        if prog_args.inventory_stream and per_host:
+            warn_not_per_host('--inventory-stream')
+        return plan_entry(prog_args, roles, hosts, extra_ansible_args,
+                          env, play_options)
+    host_stream = get_host_stream(prog_args, per_host)
+    run_metrics = metrics.reset()
+    code = 1
+    try:
+        with run_metrics.phase('total'):
+            succes, code = role_apply(
+                role_name=roles[0] if len(roles) == 1 else roles,
+                hosts=hosts[0] if len(hosts) == 1 else hosts,
+                workers=prog_args.workers,
+                galaxy_workers=prog_args.galaxy_workers,
+                engine=prog_args.engine,
+                module_path=prog_args.module_path,
+                extra_ansible_args=extra_ansible_args,
+                use_cache=not prog_args.no_cache,
+                cache_dir=prog_args.cache_dir,
+                bundle=prog_args.bundle,
+                env=env,
+                state=state,
+                snapshots=snapshots,
+                host_stream=host_stream,
+                batch_size=prog_args.batch_size,
+                rollout=rollout,
+                play_options=play_options)
+    except RuntimeError as exc:
+        # roles that could not be installed
+        report(FAIL + str(exc), level=ERROR)
+        code = 1
+    finally:
+        finish_run(prog_args, roles, hosts, run_metrics, code, profile_path)
+    return code
+
+
 def entry(args=[]):
     """ Command-line entry point """
+    from ansible_role import daemon
     args = args or sys.argv[1:]
-    report('version {0}'.format(__version__))
-    parser = get_parser()
-    prog_args, extra_ansible_args = parser.parse_known_args(args)
-    role_name = prog_args.rolename.pop()
-    succes, code = role_apply(
-        role_name=role_name,
-        hosts=prog_args.host,
-        module_path=prog_args.module_path,
-        extra_ansible_args=extra_ansible_args)
-    raise SystemExit(code)
+    mode, socket_path, args = daemon.split_args(args)
+    if mode == 'serve':
+        raise SystemExit(daemon.serve(socket_path, entry))
+    if mode == 'client':
+        code = daemon.forward(socket_path, args)
+        if code is not None:
+            raise SystemExit(code)
+        msg = "no daemon listening on {0}, running locally"
+        report(msg.format(socket_path), level=WARNING)
+    # reset per invocation, since the daemon serves many
+    console.configure()
+    subcommands = dict(bundle=bundle_entry, facts=facts_entry,
+                       mirror=mirror_entry, stats=stats_entry)
+    if args and args[0] in subcommands:
+        report('version {0}'.format(__version__))
+        raise SystemExit(subcommands[args[0]](args[1:]))
+    raise SystemExit(run_entry(args))
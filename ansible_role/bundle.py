@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.bundle
+
+    offline role bundles: a single archive holding roles, their resolved
+    dependencies and a manifest, for air-gapped machines and for runs
+    that should start without talking to galaxy.
+
+      ansible-role bundle role.name [role.name..] -o roles.tar.zst
+      ansible-role --bundle roles.tar.zst [hostname] [ansible-playbook args]
+
+    the archive format follows the output file's extension: .tar, .tar.gz
+    (.tgz), .tar.bz2, .tar.xz, or .tar.zst (which needs the optional
+    `zstandard` package).  MANIFEST.json is always the first member, so
+    reading the manifest never decompresses the roles.
+"""
+import os
+import io
+import json
+import time
+import tarfile
+
+from ansible_role.version import __version__
+from ansible_role.util import split_role_spec
+
+MANIFEST = 'MANIFEST.json'
+ROLES_PREFIX = 'roles/'
+
+# extension -> tarfile compression
+COMPRESSIONS = [
+    ('.tar.gz', 'gz'), ('.tgz', 'gz'), ('.tar.bz2', 'bz2'),
+    ('.tar.xz', 'xz'), ('.tar.zst', 'zst'), ('.tar', ''),
+]
+
+
+class BundleError(Exception):
+    pass
+
+
+def get_compression(path):
+    for extension, compression in COMPRESSIONS:
+        if path.endswith(extension):
+            return compression
+    err = "unknown bundle format for {0}, expected one of: {1}"
+    raise BundleError(err.format(
+        path, ', '.join(ext for ext, _ in COMPRESSIONS)))
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise BundleError(
+            ".tar.zst bundles need the zstandard package "
+            "(pip install zstandard)")
+    return zstandard
+
+
+class _open_archive(object):
+    """ opens `path` as a tarfile stream for reading ('r') or
+        writing ('w'), in the compression its extension names
+    """
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self._closers = []
+
+    def __enter__(self):
+        compression = get_compression(self.path)
+        fhandle = open(self.path, self.mode + 'b')
+        self._closers.append(fhandle)
+        if compression == 'zst':
+            zstd = _zstandard()
+            if self.mode == 'r':
+                fhandle = zstd.ZstdDecompressor().stream_reader(fhandle)
+            else:
+                fhandle = zstd.ZstdCompressor().stream_writer(fhandle)
+            self._closers.insert(0, fhandle)
+            compression = ''
+        archive = tarfile.open(
+            fileobj=fhandle, mode='{0}|{1}'.format(self.mode, compression))
+        self._closers.insert(0, archive)
+        return archive
+
+    def __exit__(self, exc, value, tb):
+        for closer in self._closers:
+            closer.close()
+
+
+def create_bundle(role_specs, output, install, report=None):
+    """ installs `role_specs` and their dependencies with
+        `install(role_spec, role_dir)` (which must return the dependency
+        graph) into a scratch directory, and packs them into `output`.
+        returns the manifest.
+    """
+    import shutil
+    import tempfile
+    from ansible_role.index import RoleIndex
+    report = report or (lambda msg: None)
+    get_compression(output)
+    scratch = tempfile.mkdtemp()
+    try:
+        role_dir = os.path.join(scratch, 'roles')
+        os.makedirs(role_dir)
+        graph = {}
+        for role_spec in role_specs:
+            graph.update(install(role_spec, role_dir) or {})
+        role_index = RoleIndex(role_dir)
+        roles = {}
+        for name in sorted(os.listdir(role_dir)):
+            if name.startswith('.'):
+                continue
+            entry = role_index.get(name) or role_index.record(name)
+            roles[name] = dict(
+                version=entry.get('version'), hash=entry['hash'],
+                dependencies=graph.get(name, []))
+        manifest = dict(
+            format=1,
+            created=time.time(),
+            ansible_role_version=__version__,
+            requested=list(role_specs),
+            roles=roles)
+        report("writing {0} roles to {1}".format(len(roles), output))
+        with _open_archive(output, 'w') as archive:
+            data = json.dumps(manifest, indent=1, sort_keys=True)
+            data = data.encode('utf-8')
+            info = tarfile.TarInfo(MANIFEST)
+            info.size = len(data)
+            info.mtime = int(manifest['created'])
+            archive.addfile(info, io.BytesIO(data))
+            for name in sorted(roles):
+                archive.add(
+                    os.path.join(role_dir, name),
+                    arcname=ROLES_PREFIX + name)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return manifest
+
+
+def read_manifest(path):
+    """ the manifest of the bundle at `path` """
+    with _open_archive(path, 'r') as archive:
+        member = archive.next()
+        if member is None or member.name != MANIFEST:
+            raise BundleError("{0} is not a role bundle".format(path))
+        return json.loads(archive.extractfile(member).read().decode('utf-8'))
+
+
+def _safe_member(member, dest):
+    """ refuses archive members that would land outside `dest` """
+    dest = os.path.realpath(dest)
+    target = os.path.realpath(os.path.join(dest, member.name))
+    if not target.startswith(dest + os.sep):
+        return False
+    if member.isdev() or member.islnk():
+        return False
+    if member.issym():
+        link = os.path.realpath(
+            os.path.join(os.path.dirname(target), member.linkname))
+        return link.startswith(dest + os.sep)
+    return True
+
+
+def _extract_archive(path, staging, skip=()):
+    """ extracts the roles in the bundle at `path`, except the ones in
+        `skip`, into `staging`.  returns the manifest.
+    """
+    # python >= 3.12 wants an extraction filter; members are checked
+    # by _safe_member either way
+    extract_args = dict(filter='tar') if hasattr(tarfile, 'tar_filter') \
+        else {}
+    manifest = None
+    with _open_archive(path, 'r') as archive:
+        for member in archive:
+            if member.name == MANIFEST:
+                manifest = json.loads(
+                    archive.extractfile(member).read().decode('utf-8'))
+                continue
+            if not member.name.startswith(ROLES_PREFIX):
+                continue
+            member.name = member.name[len(ROLES_PREFIX):]
+            if member.name.split('/')[0] in skip:
+                continue
+            if not _safe_member(member, staging):
+                err = "refusing to extract {0} from {1}"
+                raise BundleError(err.format(member.name, path))
+            archive.extract(member, staging, **extract_args)
+    if manifest is None:
+        raise BundleError("{0} is not a role bundle".format(path))
+    return manifest
+
+
+def _move_staged_roles(manifest, staging, role_dir):
+    """ moves the roles extracted into `staging` into `role_dir` and
+        indexes them.  returns how many were moved.
+    """
+    from ansible_role.index import RoleIndex, get_stamp
+    from ansible_role.locks import role_lock
+    from ansible_role.util import move_into_place
+    # the manifest already has the content hashes, so indexing the
+    # new roles doesn't need to read them back
+    role_index = RoleIndex(role_dir)
+    moved = 0
+    for name, role in manifest['roles'].items():
+        staged = os.path.join(staging, name)
+        role_path = os.path.join(role_dir, name)
+        if not os.path.isdir(staged):
+            continue
+        with role_lock(role_dir, name):
+            if os.path.lexists(role_path):
+                # another process got there first
+                continue
+            move_into_place(staged, role_path)
+            role_index.update({name: dict(
+                source='galaxy', version=role.get('version'),
+                installed=time.time(), hash=role['hash'],
+                stamp=get_stamp(role_path))})
+        moved += 1
+    return moved
+
+
+def extract_bundle(path, role_dir, report=None):
+    """ unpacks the roles from the bundle at `path` into `role_dir`
+        (roles already present there are left alone), indexes them,
+        and returns the manifest.  the archive is read exactly once,
+        into a staging directory, and each role is renamed into place
+        under its lock, since `role_dir` may be shared.
+    """
+    import shutil
+    import tempfile
+    from ansible_role.util import STAGING_PREFIX
+    report = report or (lambda msg: None)
+    existing = set(os.listdir(role_dir))
+    staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=role_dir)
+    try:
+        manifest = _extract_archive(path, staging, skip=existing)
+        extracted = _move_staged_roles(manifest, staging, role_dir)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    report("extracted {0} roles from {1}".format(extracted, path))
+    return manifest
+
+
+def requested_roles(manifest):
+    """ the role names a bundle was created for, in order """
+    return [split_role_spec(spec)[0] for spec in manifest['requested']]
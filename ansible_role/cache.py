@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.cache
+
+    persistent role cache shared by every ansible-role run on a machine.
+
+    entries are keyed by role name + requested version and live under
+    $ANSIBLE_ROLE_CACHE_DIR (default: $XDG_CACHE_HOME/ansible-role).
+    each entry holds the roles directory that ansible-galaxy produced for
+    the role (i.e. the role and its dependencies), and is materialized
+    into the run's temporary role-dir with hardlinks or symlinks, so a
+    warm run never touches the network.
+
+    entries for roles without a pinned version go stale `max_age` after
+    they were installed, however often they are used, so that new
+    releases get picked up.  pinned entries stay valid; every entry is
+    evicted once it hasn't been used for `max_age`, or when the cache
+    outgrows `max_size`, least recently used first.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+from ansible_role.locks import LOCKS_DIR, FileLock, role_lock
+from ansible_role.index import RoleIndex, get_installed_version
+from ansible_role.console import report as base_report
+from ansible_role.util import (
+    STAGING_PREFIX, ensure_dir, tree_size, link_tree, move_into_place,
+    split_role_spec)
+
+CACHE_DIR_ENV = 'ANSIBLE_ROLE_CACHE_DIR'
+MAX_SIZE_ENV = 'ANSIBLE_ROLE_CACHE_MAX_SIZE'
+MAX_AGE_ENV = 'ANSIBLE_ROLE_CACHE_MAX_AGE'
+
+# 1GB of roles, nothing that hasn't been used for a week, and unpinned
+# roles are installed again once they are a week old
+DEFAULT_MAX_SIZE = 1024 ** 3
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+report = lambda *args, **kargs: base_report(
+    'ansible-role', *args, **kargs)
+
+ENTRY_FILE = 'entry.json'
+
+
+def get_cache_dir():
+    """ root directory for everything ansible-role keeps between runs """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if not cache_dir:
+        xdg_cache = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(xdg_cache, 'ansible-role')
+    return cache_dir
+
+
+def cache_subdir(cache_dir, name):
+    """ the path of `name` in `cache_dir`, or in the default cache dir """
+    return os.path.join(cache_dir or get_cache_dir(), name)
+
+
+class RoleCache(object):
+    """ on-disk cache of galaxy roles, safe to share between processes.
+
+        readers hold a shared lock on the cache while materializing an
+        entry.  installs of the same entry are serialized by a lock of
+        their own, and only take the cache lock exclusively to rename
+        the finished install into place and to evict.
+    """
+
+    def __init__(self, cache_dir=None, max_size=None, max_age=None,
+                 link='hardlink', report=report):
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.entries_dir = os.path.join(self.cache_dir, 'roles')
+        self.lock_path = os.path.join(self.cache_dir, '.lock')
+        self.max_size = int(
+            max_size or os.environ.get(MAX_SIZE_ENV, DEFAULT_MAX_SIZE))
+        self.max_age = int(
+            max_age or os.environ.get(MAX_AGE_ENV, DEFAULT_MAX_AGE))
+        assert link in ('hardlink', 'symlink'), "bad link mode: " + link
+        self.link = link
+        self.report = report
+
+    def key(self, role_spec):
+        """ directory name for the entry holding `role_spec` """
+        name, version = split_role_spec(role_spec)
+        key = '{0},{1}'.format(name, version or '')
+        src = role_spec.split(',')[0].strip()
+        if src != name:
+            # a url, or a role installed under another name
+            key += ',' + src
+        digest = hashlib.sha256(key.encode('utf-8'))
+        return '{0}-{1}'.format(name, digest.hexdigest()[:16])
+
+    def entry_path(self, role_spec):
+        return os.path.join(self.entries_dir, self.key(role_spec))
+
+    def lookup(self, role_spec):
+        """ returns the entry directory for `role_spec`, or None when
+            the role is not cached (or the entry has expired)
+        """
+        entry = self.entry_path(role_spec)
+        entry_file = os.path.join(entry, ENTRY_FILE)
+        try:
+            with open(entry_file) as fhandle:
+                metadata = json.load(fhandle)
+            last_used = os.path.getmtime(entry_file)
+        except (OSError, IOError, ValueError):
+            return None
+        now = time.time()
+        if now - last_used > self.max_age:
+            return None
+        if not metadata.get('version') and \
+                now - metadata.get('created', 0) > self.max_age:
+            # unpinned, so there may be a newer release by now
+            return None
+        return entry
+
+    def fetch(self, role_spec, role_dir, install):
+        """ makes `role_spec` available in `role_dir`, calling
+            `install(role_spec, path)` to populate the cache on a miss.
+            returns True for a cache hit.
+        """
+        if self._hit(role_spec, role_dir):
+            return True
+        with role_lock(self.entries_dir, self.key(role_spec)):
+            # another process may have installed it while we waited
+            if self._hit(role_spec, role_dir):
+                return True
+            self.report("role cache miss for '{0}'".format(role_spec))
+            staging = self._install(role_spec, install)
+            with FileLock(self.lock_path):
+                entry = self._store(role_spec, staging)
+        with FileLock(self.lock_path, shared=True):
+            self._use(entry, role_dir)
+        with FileLock(self.lock_path):
+            self.evict(keep=entry)
+        return False
+
+    def _hit(self, role_spec, role_dir):
+        """ materializes the entry for `role_spec`, if there's one """
+        with FileLock(self.lock_path, shared=True):
+            entry = self.lookup(role_spec)
+            if entry:
+                self._use(entry, role_dir)
+                self.report("role cache hit for '{0}'".format(role_spec))
+        return entry is not None
+
+    def _use(self, entry, role_dir):
+        os.utime(os.path.join(entry, ENTRY_FILE), None)
+        self.materialize(entry, role_dir)
+
+    def materialize(self, entry, role_dir):
+        """ links every role in the cache entry into `role_dir`, and
+            copies their entries in the role index along.  each role is
+            linked into a staging directory and renamed into place under
+            its lock, since `role_dir` may be shared with other processes.
+        """
+        ensure_dir(role_dir)
+        entry_roles = os.path.join(entry, 'roles')
+        indexed = RoleIndex(entry_roles).load()
+        role_index = RoleIndex(role_dir)
+        for name in os.listdir(entry_roles):
+            src = os.path.join(entry_roles, name)
+            dst = os.path.join(role_dir, name)
+            if name.startswith('.') or os.path.lexists(dst):
+                continue
+            with role_lock(role_dir, name):
+                if os.path.lexists(dst):
+                    continue
+                staging = tempfile.mkdtemp(
+                    prefix=STAGING_PREFIX, dir=role_dir)
+                try:
+                    staged = os.path.join(staging, name)
+                    if self.link == 'symlink':
+                        os.symlink(src, staged)
+                    else:
+                        link_tree(src, staged)
+                    move_into_place(staged, dst)
+                finally:
+                    shutil.rmtree(staging, ignore_errors=True)
+                if name in indexed:
+                    role_index.update({name: indexed[name]})
+
+    def _install(self, role_spec, install):
+        """ installs `role_spec` into a staging directory next to the
+            entries, and returns it
+        """
+        ensure_dir(self.entries_dir)
+        staging = tempfile.mkdtemp(
+            prefix=STAGING_PREFIX, dir=self.entries_dir)
+        try:
+            roles = os.path.join(staging, 'roles')
+            ensure_dir(roles)
+            install(role_spec, roles)
+            name, version = split_role_spec(role_spec)
+            metadata = dict(
+                spec=role_spec, name=name, version=version,
+                installed_version=get_installed_version(
+                    os.path.join(roles, name)),
+                created=time.time(),
+                size=tree_size(roles))
+            with open(os.path.join(staging, ENTRY_FILE), 'w') as fhandle:
+                json.dump(metadata, fhandle)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return staging
+
+    def _store(self, role_spec, staging):
+        """ renames an install from _install into place.  caller must
+            hold the lock.
+        """
+        entry = self.entry_path(role_spec)
+        if os.path.exists(entry):
+            # expired entry, replaced by the fresh install
+            shutil.rmtree(entry)
+        os.rename(staging, entry)
+        return entry
+
+    def entries(self):
+        """ yields (entry_dir, last_used, size) for every cache entry """
+        if not os.path.isdir(self.entries_dir):
+            return
+        for name in os.listdir(self.entries_dir):
+            entry = os.path.join(self.entries_dir, name)
+            entry_file = os.path.join(entry, ENTRY_FILE)
+            if name == LOCKS_DIR:
+                continue
+            if name.startswith(STAGING_PREFIX):
+                # leftovers from a crashed install
+                if time.time() - os.path.getmtime(entry) > self.max_age:
+                    shutil.rmtree(entry, ignore_errors=True)
+                continue
+            try:
+                with open(entry_file) as fhandle:
+                    size = json.load(fhandle).get('size', 0)
+                last_used = os.path.getmtime(entry_file)
+            except (OSError, IOError, ValueError):
+                size, last_used = 0, 0
+            yield entry, last_used, size
+
+    def evict(self, keep=None):
+        """ drops expired entries, then least-recently used entries until
+            the cache fits in `max_size`.  caller must hold the lock.
+        """
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda x: x[1])
+        total = sum(size for _, _, size in entries)
+        for entry, last_used, size in entries:
+            if entry == keep:
+                continue
+            expired = now - last_used > self.max_age
+            if expired or total > self.max_size:
+                self.report("evicting role cache entry {0}".format(entry))
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.callback_plugins
+
+    ansible callback plugins shipped with ansible-role.  ansible loads
+    them by path (see ansible_role.profile), not as python imports.
+"""
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+""" ansible_role_profile
+
+    callback plugin for `ansible-role --profile`: times every task and
+    handler on every host, and appends the timings as JSON lines to the
+    file named by $ANSIBLE_ROLE_PROFILE_FILE when the playbook ends.
+"""
+import os
+import json
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+PROFILE_ENV = 'ANSIBLE_ROLE_PROFILE_FILE'
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'ansible_role_profile'
+    CALLBACK_NEEDS_ENABLED = True
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self, *args, **kargs):
+        super(CallbackModule, self).__init__(*args, **kargs)
+        self.play = ''
+        self.handlers = set()
+        # (host, task-uuid) -> start time
+        self.started = {}
+        self.records = []
+
+    def v2_playbook_on_play_start(self, play):
+        self.play = play.get_name()
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self.handlers.add(task._uuid)
+
+    def v2_runner_on_start(self, host, task):
+        self.started[(host.get_name(), task._uuid)] = time.time()
+
+    def _record(self, result, status):
+        task = result._task
+        host = result._host.get_name()
+        start = self.started.pop((host, task._uuid), None)
+        if start is None:
+            return
+        # ansible-role plays refer to roles by path
+        role = os.path.basename(task._role.get_name().rstrip('/')) \
+            if task._role else ''
+        self.records.append(dict(
+            host=host, play=self.play, role=role,
+            task=task.name or task.get_name(),
+            kind='handler' if task._uuid in self.handlers else 'task',
+            status=status, duration=time.time() - start))
+
+    def v2_runner_on_ok(self, result):
+        self._record(result, 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result, 'failed')
+
+    def v2_runner_on_skipped(self, result):
+        self._record(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self._record(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        path = os.environ.get(PROFILE_ENV)
+        if not path or not self.records:
+            return
+        # one write per run, so runs in parallel processes don't
+        # interleave their lines
+        lines = ''.join(json.dumps(x) + '\n' for x in self.records)
+        with open(path, 'a') as fhandle:
+            fhandle.write(lines)
+        self.records = []
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.changes
+
+    --changed-only: after a successful run, a snapshot of the roles
+    applied and their dependencies (the content hash of every file) is
+    kept per host.  the next run diffs the roles against it and starts
+    the play at the first task affected by the change, with
+    --start-at-task, instead of running every task again.
+
+    a changed task file starts the play at its first task, and a
+    changed template or file at the first task that mentions it.
+    anything else (defaults, vars, handlers, meta, modules, or a task
+    the play can't be started at) means a full run.
+"""
+import os
+
+from ansible_role.util import split_role_spec
+
+# role sub-directories whose changes can be traced to tasks
+TASKS_DIR = 'tasks'
+ASSET_DIRS = ('templates', 'files')
+MAIN_FILES = ('main.yml', 'main.yaml')
+
+# task keywords that pull in another task file, and whether ansible
+# knows the tasks in it before the play starts
+STATIC_INCLUDES = ('import_tasks', 'ansible.builtin.import_tasks')
+DYNAMIC_INCLUDES = ('include_tasks', 'ansible.builtin.include_tasks',
+                    'include')
+
+
+def file_hashes(role_dir, role_names):
+    """ {role/relative/path: sha256} for every file of the roles in
+        `role_names` and their dependencies
+    """
+    import hashlib
+    from ansible_role.deps import role_closure
+    hashes = {}
+    for name in role_closure(role_dir, role_names):
+        role_path = os.path.join(role_dir, name)
+        for root, dirs, files in os.walk(role_path):
+            for fname in files:
+                fpath = os.path.join(root, fname)
+                if os.path.islink(fpath) and not os.path.exists(fpath):
+                    continue
+                digest = hashlib.sha256()
+                with open(fpath, 'rb') as fhandle:
+                    for chunk in iter(lambda: fhandle.read(65536), b''):
+                        digest.update(chunk)
+                rel_path = os.path.relpath(fpath, role_dir)
+                hashes[rel_path.replace(os.sep, '/')] = digest.hexdigest()
+    return hashes
+
+
+def diff(old, new):
+    """ paths added, removed or changed between two file_hashes """
+    return sorted(
+        path for path in set(old) | set(new)
+        if old.get(path) != new.get(path))
+
+
+def _load_tasks(path):
+    import yaml
+    try:
+        with open(path) as fhandle:
+            tasks = yaml.safe_load(fhandle)
+    except (IOError, OSError, yaml.YAMLError):
+        return None
+    return tasks if isinstance(tasks, list) else None
+
+
+def _include_target(task):
+    """ (kind, file) for a task that includes a task file """
+    for keys, kind in ((STATIC_INCLUDES, 'static'),
+                       (DYNAMIC_INCLUDES, 'dynamic')):
+        for key in keys:
+            if key in task:
+                target = task[key]
+                if isinstance(target, dict):
+                    target = target.get('file')
+                return kind, target
+    return None, None
+
+
+def _first_named(task):
+    """ the name --start-at-task can use to start at `task` """
+    if not isinstance(task, dict):
+        return None
+    if 'block' in task:
+        for inner in task.get('block') or []:
+            return _first_named(inner)
+        return None
+    name = task.get('name')
+    if not name or '{{' in name:
+        return None
+    return name
+
+
+def task_order(role_path):
+    """ [(task-file, index, task)] for the role's tasks in the order the
+        play sees them: main.yml, with statically imported files in
+        place of their import.  dynamically included files contribute
+        only their include task.  returns None when there's no main.yml.
+    """
+    tasks_dir = os.path.join(role_path, TASKS_DIR)
+    for main in MAIN_FILES:
+        tasks = _load_tasks(os.path.join(tasks_dir, main))
+        if tasks is not None:
+            break
+    else:
+        return None
+    order = []
+    for index, task in enumerate(tasks):
+        kind, target = _include_target(task) if isinstance(task, dict) \
+            else (None, None)
+        imported = _load_tasks(os.path.join(tasks_dir, target)) \
+            if kind == 'static' and target and '{{' not in target else None
+        if imported is not None:
+            order += [(target, inner_index, inner)
+                      for inner_index, inner in enumerate(imported)]
+        else:
+            order.append((main, index, task))
+            if kind == 'dynamic' and target:
+                # the included tasks run at this point
+                order.append((target, None, task))
+    return order
+
+
+def _first_changed_role(changed, names):
+    """ (name, changed paths relative to the role) for the first of the
+        roles called `names` with changes, or None when there are none,
+        or when something else changed
+    """
+    by_role = dict((name, []) for name in names)
+    for path in changed:
+        role, _, rest = path.partition('/')
+        if role not in by_role:
+            # a dependency (or another role in the role-dir) changed,
+            # and where its tasks run in the play isn't known here
+            return None
+        by_role[role].append(rest)
+    for name in names:
+        if by_role[name]:
+            return name, by_role[name]
+    return None
+
+
+def _first_affected_task(role_path, paths):
+    """ the first task of the role that uses one of the changed `paths`,
+        or None
+    """
+    import json
+    task_files = set()
+    assets = set()
+    for path in paths:
+        top, _, rest = path.partition('/')
+        if top == TASKS_DIR:
+            task_files.add(rest)
+        elif top in ASSET_DIRS:
+            assets.add(os.path.basename(rest))
+        else:
+            return None
+    for task_file, _, task in task_order(role_path) or []:
+        affected = task_file in task_files
+        if not affected and assets:
+            text = json.dumps(task, default=str)
+            affected = any(asset in text for asset in assets)
+        if affected:
+            return task
+    return None
+
+
+def start_task(changed, role_dir, role_names):
+    """ the name of the task to start the play at, for a change to the
+        `changed` files.  None means the whole play must run.
+    """
+    names = [split_role_spec(spec)[0] for spec in role_names]
+    # the first role in the play with changes decides
+    first = _first_changed_role(changed, names)
+    if first is None:
+        return None
+    name, paths = first
+    task = _first_affected_task(os.path.join(role_dir, name), paths)
+    if task is None:
+        # no task of the role refers to the change
+        return None
+    return _first_named(task)
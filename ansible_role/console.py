@@ -1,30 +1,158 @@
 # -*- coding: utf-8 -*-
 """ ansible_role.console
 
-    helpers for pretty-printing console status messages
+    helpers for pretty-printing console status messages.
+
+    messages go through a reporter per title (see get_reporter), are
+    dropped before any formatting when below the configured level, and
+    are written by the configured sink: colored text on stderr, or one
+    JSON object per line.  level and format come from configure(), or
+    from $ANSIBLE_ROLE_LOG_LEVEL and $ANSIBLE_ROLE_LOG_FORMAT.
 """
 from __future__ import print_function
+import os
 import sys
+import time
+import threading
+
+LEVEL_ENV = 'ANSIBLE_ROLE_LOG_LEVEL'
+FORMAT_ENV = 'ANSIBLE_ROLE_LOG_FORMAT'
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = dict(debug=DEBUG, info=INFO, warning=WARNING, error=ERROR)
+FORMATS = ('text', 'json')
+
+# one lock for everything written to the console, so that lines from
+# concurrent workers never interleave
+_write_lock = threading.Lock()
+_reporters = {}
+_config = {}
+
+
+def red(text):
+    return '\x1b[31m{0}\x1b[0m'.format(text)
+
+
+def cyan(text):
+    return '\x1b[36m{0}\x1b[0m'.format(text)
 
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
+def configure(level=None, fmt=None):
+    """ sets the level (a name from LEVELS) and format (one of FORMATS)
+        of all reporters; None means the environment's value, or the
+        default
+    """
+    level = level or os.environ.get(LEVEL_ENV) or 'info'
+    fmt = fmt or os.environ.get(FORMAT_ENV) or 'text'
+    if level.lower() not in LEVELS:
+        raise ValueError("unknown log level: {0}".format(level))
+    if fmt not in FORMATS:
+        raise ValueError("unknown log format: {0}".format(fmt))
+    _config.update(level=LEVELS[level.lower()],
+                   sink=json_sink if fmt == 'json' else text_sink)
+
+
+def _get_config():
+    if not _config:
+        configure()
+    return _config
+
+
+def text_sink(title, level, msg, args):
+    template = '\x1b[31;01m{0}:\x1b[39;49;00m {1} {2}\n'
+    line = template.format(title.replace('_', ''), msg, args or '')
+    with _write_lock:
+        # looked up on every write, since the daemon swaps stderr
+        sys.stderr.write(line)
+        sys.stderr.flush()
+
+
+def json_sink(title, level, msg, args):
+    import re
+    import json
+    names = dict((val, key) for key, val in LEVELS.items())
+    msg = msg if not args else ' '.join([msg] + [str(x) for x in args])
+    line = json.dumps(dict(
+        time=time.time(), title=title, level=names.get(level, level),
+        # without the colors
+        msg=re.sub('\x1b\\[[0-9;]*m', '', msg)))
+    with _write_lock:
+        sys.stderr.write(line + '\n')
+        sys.stderr.flush()
+
+
 class Reporter(object):
+    """ reports messages under one title """
+
+    def __init__(self, title=None):
+        self.title = title or self.__class__.__name__
 
     def _report_name(self):
-        return self.__class__.__name__
+        return self.title
 
     def report(self, msg, *args, **kargs):
         """ 'print' replacement that includes some color and formatting """
-        template = '\x1b[31;01m{0}:\x1b[39;49;00m {1} {2}'
-        name = self._report_name()
-        name = name.replace('_', '')
-        eprint(template.format(
-            name, msg, args or ''))
+        level = kargs.get('level', INFO)
+        config = _get_config()
+        if level < config['level']:
+            return
+        config['sink'](self._report_name(), level, msg, args)
+
+
+def get_reporter(title):
+    """ the (cached) reporter for `title` """
+    try:
+        return _reporters[title]
+    except KeyError:
+        return _reporters.setdefault(title, Reporter(title))
 
 
 def report(title, msg, *args, **kargs):
-    _reporter = type(title, (Reporter,), dict())()
-    _reporter.report(msg)
+    get_reporter(title).report(msg, *args, **kargs)
+
+
+class TaggedWriter(object):
+    """ file-like object for one worker's output (e.g. one host's
+        ansible-playbook run).  it buffers partial lines, and writes
+        complete ones prefixed with `tag` under the console lock, so
+        many workers can share a stream without garbling each other.
+    """
+
+    def __init__(self, tag, stream=None):
+        self.prefix = '[{0}] '.format(tag)
+        self.stream = stream
+        self._buffer = ''
+
+    def _stream(self):
+        return self.stream or sys.stdout
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        self._buffer += data
+        if '\n' in self._buffer:
+            complete, _, self._buffer = self._buffer.rpartition('\n')
+            self._write(complete.split('\n'))
+
+    def _write(self, lines):
+        text = ''.join(self.prefix + line + '\n' for line in lines)
+        stream = self._stream()
+        with _write_lock:
+            stream.write(text)
+            stream.flush()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """ writes out a trailing partial line, if any """
+        if self._buffer:
+            self._write([self._buffer])
+            self._buffer = ''
+
+    def isatty(self):
+        return getattr(self._stream(), 'isatty', lambda: False)()
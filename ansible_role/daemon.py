@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.daemon
+
+    `ansible-role --serve` keeps a long-running ansible-role process
+    listening on a unix socket, and `ansible-role --daemon ...` (or any
+    invocation with $ANSIBLE_ROLE_DAEMON set) forwards its command line
+    there instead of doing the work itself.  the daemon keeps imports,
+    parsed role metadata and (with the inprocess engine, which is its
+    default) ansible's loaded plugins warm between invocations, and
+    streams output and the exit code back to the client.
+
+    the protocol is one JSON object per line: the client sends
+    {argv, cwd, env}, the server answers with any number of
+    {stream, data} objects followed by a single {exit}.
+"""
+import os
+import sys
+
+from ansible_role.console import WARNING, ERROR, report as base_report
+
+SOCKET_ENV = 'ANSIBLE_ROLE_SOCKET'
+DAEMON_ENV = 'ANSIBLE_ROLE_DAEMON'
+SOCKET_NAME = 'daemon.sock'
+
+# environment variables forwarded from the client to the daemon,
+# except for the ones that would make the daemon forward to itself
+FORWARDED_ENV_PREFIXES = ('ANSIBLE_',)
+LOCAL_ENV = (DAEMON_ENV, SOCKET_ENV)
+
+# commands that aren't role applications, and take no --engine
+SUBCOMMANDS = ('bundle', 'facts', 'mirror', 'stats')
+
+report = lambda *args, **kargs: base_report(
+    'ansible-role-daemon', *args, **kargs)
+
+
+def get_socket_path():
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    from ansible_role.cache import cache_subdir
+    return cache_subdir(None, SOCKET_NAME)
+
+
+def split_args(args):
+    """ pulls the daemon options out of the command line.
+        returns (mode, socket_path, remaining_args), where mode is
+        'serve', 'client' or None
+    """
+    mode = 'client' if os.environ.get(DAEMON_ENV) else None
+    socket_path = None
+    remaining = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == '--serve':
+            mode = 'serve'
+        elif arg == '--daemon':
+            mode = mode or 'client'
+        elif arg == '--socket' and args:
+            socket_path = args.pop(0)
+        elif arg.startswith('--socket='):
+            socket_path = arg.split('=', 1)[1]
+        else:
+            remaining.append(arg)
+    return mode, socket_path or get_socket_path(), remaining
+
+
+def _send(sock, **msg):
+    import json
+    sock.sendall((json.dumps(msg) + '\n').encode('utf-8'))
+
+
+class SocketStream(object):
+    """ file-like object that forwards writes to the client """
+
+    encoding = 'utf-8'
+
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.name = name
+        self.closed = False
+        # writes take bytes as well, so this is its own binary buffer
+        self.buffer = self
+
+    def write(self, data):
+        if self.closed or not data:
+            return
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        try:
+            _send(self.sock, stream=self.name, data=data)
+        except (IOError, OSError):
+            # client went away, keep going so the run can clean up
+            self.closed = True
+
+    def flush(self):
+        pass
+
+    def reconfigure(self, **kargs):
+        # text is always sent as utf-8, with undecodable bytes replaced
+        pass
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        raise IOError("socket stream has no file descriptor")
+
+
+def default_engine(argv):
+    """ the engine for requests that don't pick one: inprocess, unless
+        they target several hosts (which the inprocess engine would run
+        one at a time) or run waves concurrently.  requests the parser
+        rejects get inprocess, the entry point reports the error.
+    """
+    from ansible_role import get_parser
+
+    def fail(message):
+        raise ValueError(message)
+    parser = get_parser()
+    parser.error = fail
+    try:
+        prog_args, _ = parser.parse_known_args(
+            [x for x in argv if x not in ('-h', '--help')])
+    except ValueError:
+        return 'inprocess'
+    if prog_args.wave_concurrency > 1:
+        return 'subprocess'
+    # like split_positionals, without reading the roles-file
+    positionals = prog_args.rolename
+    host_given = len(positionals) > 1 or bool(
+        positionals and (prog_args.roles_file or prog_args.bundle))
+    host = positionals[-1] if host_given else ''
+    several_hosts = ',' in host or any((
+        prog_args.hosts_file, prog_args.inventory_stream,
+        prog_args.wave_size))
+    if several_hosts and prog_args.workers > 1:
+        return 'subprocess'
+    return 'inprocess'
+
+
+def handle_request(sock, request, entry):
+    """ runs `entry(argv)` for one request, with stdout/stderr, cwd and
+        ANSIBLE_* variables switched to the client's for the duration
+    """
+    argv = list(request.get('argv', []))
+    engine_given = [x for x in argv if x.startswith('--engine')]
+    if not engine_given and not (argv and argv[0] in SUBCOMMANDS):
+        argv.append('--engine=' + default_engine(argv))
+    old_cwd = os.getcwd()
+    old_env = dict(os.environ)
+    old_streams = sys.stdout, sys.stderr
+    exit_code = 1
+    try:
+        for key, val in request.get('env', {}).items():
+            if key.startswith(FORWARDED_ENV_PREFIXES):
+                os.environ[key] = val
+        for key in LOCAL_ENV:
+            os.environ.pop(key, None)
+        os.chdir(request.get('cwd') or old_cwd)
+        sys.stdout = SocketStream(sock, 'stdout')
+        sys.stderr = SocketStream(sock, 'stderr')
+        try:
+            entry(argv)
+            exit_code = 0
+        except SystemExit as exc:
+            exit_code = exc.code if isinstance(exc.code, int) \
+                else (0 if exc.code is None else 1)
+        except Exception as exc:
+            sys.stderr.write("ansible-role daemon: {0!r}\n".format(exc))
+    finally:
+        sys.stdout, sys.stderr = old_streams
+        os.chdir(old_cwd)
+        os.environ.clear()
+        os.environ.update(old_env)
+    return exit_code
+
+
+def warm_up():
+    """ imports what role applications will need, so the first request
+        doesn't pay for it
+    """
+    import argparse  # noqa: F401
+    import tempfile  # noqa: F401
+    import shellescape  # noqa: F401
+    from ansible_role import cache, deps, fleet, proc  # noqa: F401
+    try:
+        import ansible.cli.playbook  # noqa: F401
+        import ansible.executor.task_queue_manager  # noqa: F401
+    except ImportError:
+        report("ansible is not importable, the inprocess engine won't work",
+               level=WARNING)
+
+
+def serve(socket_path, entry):
+    """ answers requests on `socket_path` until interrupted.  requests
+        are handled one at a time, in the main thread (which is where
+        ansible wants to run).
+    """
+    import socket
+    from ansible_role.util import ensure_dir
+    ensure_dir(os.path.dirname(os.path.abspath(socket_path)))
+    if os.path.exists(socket_path):
+        if _is_alive(socket_path):
+            raise SystemExit(
+                "daemon already listening on {0}".format(socket_path))
+        os.unlink(socket_path)
+    warm_up()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    report("listening on {0}".format(socket_path))
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                answer(conn, entry)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        report("shutting down")
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    return 0
+
+
+def answer(conn, entry):
+    """ reads one request from `conn`, and answers it """
+    import json
+    line = conn.makefile('rb').readline()
+    if not line:
+        return
+    try:
+        request = json.loads(line.decode('utf-8'))
+    except ValueError as exc:
+        report("bad request: {0}".format(exc), level=ERROR)
+        return
+    exit_code = handle_request(conn, request, entry)
+    try:
+        _send(conn, exit=exit_code)
+    except (IOError, OSError):
+        pass
+
+
+def _is_alive(socket_path):
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (IOError, OSError):
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def forward(socket_path, argv):
+    """ sends `argv` to the daemon, copies its output to our
+        stdout/stderr, and returns its exit code.  returns None when
+        no daemon is listening.
+    """
+    import json
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (IOError, OSError):
+        sock.close()
+        return None
+    try:
+        env = dict((key, val) for key, val in os.environ.items()
+                   if key.startswith(FORWARDED_ENV_PREFIXES))
+        for key in LOCAL_ENV:
+            env.pop(key, None)
+        _send(sock, argv=list(argv), cwd=os.getcwd(), env=env)
+        for line in sock.makefile('rb'):
+            msg = json.loads(line.decode('utf-8'))
+            if 'exit' in msg:
+                return msg['exit']
+            stream = sys.stderr if msg.get('stream') == 'stderr' \
+                else sys.stdout
+            stream.write(msg.get('data', ''))
+            stream.flush()
+    finally:
+        sock.close()
+    report("daemon closed the connection without an exit code",
+           level=ERROR)
+    return 1
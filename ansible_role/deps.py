@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.deps
+
+    concurrent resolution of role dependencies.
+
+    rather than letting ansible-galaxy walk the dependency tree one role
+    at a time, every role is installed with --no-deps, its meta/main.yml
+    is read, and each missing dependency is fetched by a bounded pool of
+    workers as soon as it is discovered.  a deep role tree then installs
+    in roughly the time of its slowest branch.
+"""
+import os
+
+from ansible_role.util import is_scm_source, split_role_spec
+
+DEFAULT_WORKERS = 4
+
+# (meta-file, mtime) -> dependency list, so repeated resolutions
+# in the same process don't parse the same metadata again
+_meta_cache = {}
+
+
+def dependency_spec(dep):
+    """ turns one entry of `dependencies:` in meta/main.yml into a galaxy
+        role spec, or None when it doesn't name a role that galaxy can
+        install (e.g. a role referenced by path, or one living next to
+        the parent role).  urls and scm sources are passed on as they
+        are, in ansible-galaxy's 'src,version,name' form.
+    """
+    if isinstance(dep, dict):
+        src = dep.get('src') or dep.get('role') or dep.get('name')
+        version = dep.get('version')
+        name = dep.get('name') if dep.get('src') else None
+    else:
+        src, version, name = str(dep), None, None
+    if src and is_scm_source(src):
+        parts = [src, version or '', name or '']
+        return ','.join(parts).rstrip(',')
+    if not isinstance(dep, dict):
+        src, version = split_role_spec(src)
+    if not src or '/' in src or '.' not in src:
+        return None
+    return src if not version else '{0},{1}'.format(src, version)
+
+
+def read_dependencies(role_path):
+    """ galaxy role specs listed in the role's meta/main.yml """
+    for fname in ('main.yml', 'main.yaml'):
+        meta_file = os.path.join(role_path, 'meta', fname)
+        if os.path.exists(meta_file):
+            break
+    else:
+        return []
+    key = (meta_file, os.path.getmtime(meta_file))
+    if key not in _meta_cache:
+        import yaml
+        with open(meta_file) as fhandle:
+            meta = yaml.safe_load(fhandle) or {}
+        deps = meta.get('dependencies') if isinstance(meta, dict) else None
+        deps = deps or []
+        specs = [dependency_spec(dep) for dep in deps]
+        _meta_cache[key] = [spec for spec in specs if spec]
+    return list(_meta_cache[key])
+
+
+def role_closure(role_dir, role_names):
+    """ the names of the roles in `role_names` and the dependencies
+        they pull in, sorted.  roles without a directory in `role_dir`
+        are left out.
+    """
+    pending = [split_role_spec(x)[0] for x in role_names]
+    found = set()
+    while pending:
+        name = pending.pop()
+        role_path = os.path.join(role_dir, name)
+        if name in found or not os.path.isdir(role_path):
+            continue
+        found.add(name)
+        pending += [split_role_spec(x)[0]
+                    for x in read_dependencies(role_path)]
+    return sorted(found)
+
+
+class DependencyResolver(object):
+    """ installs roles and their dependencies into `role_dir`,
+        with at most `workers` calls to `install(role_spec, role_dir)`
+        in flight.  `install` must not resolve dependencies itself.
+        `is_installed(role_name)` decides which roles need installing
+        (default: those without a directory in `role_dir`).
+    """
+
+    def __init__(self, role_dir, install, workers=DEFAULT_WORKERS,
+                 report=None, is_installed=None):
+        self.role_dir = role_dir
+        self.install = install
+        self.is_installed = is_installed or (
+            lambda name: os.path.isdir(os.path.join(role_dir, name)))
+        self.workers = max(1, workers)
+        self.report = report or (lambda msg: None)
+        self.graph = {}
+        self.errors = []
+        self._pending = 0
+        self._cond = None
+
+    def resolve(self, role_specs):
+        """ returns the dependency graph, {role-name: [dependency-names]}.
+            raises RuntimeError if any role could not be installed.
+        """
+        import threading
+        from multiprocessing.pool import ThreadPool
+        self._cond = threading.Condition()
+        self._pool = ThreadPool(self.workers)
+        try:
+            for role_spec in role_specs:
+                self._schedule(role_spec)
+            with self._cond:
+                while self._pending:
+                    self._cond.wait()
+        finally:
+            self._pool.close()
+            self._pool.join()
+        if self.errors:
+            err = "could not install roles: {0}"
+            raise RuntimeError(err.format(', '.join(
+                '{0} ({1})'.format(spec, exc) for spec, exc in self.errors)))
+        return self.graph
+
+    def _schedule(self, role_spec):
+        name, version = split_role_spec(role_spec)
+        with self._cond:
+            if name in self.graph:
+                return
+            self.graph[name] = []
+            self._pending += 1
+        self._pool.apply_async(self._visit, (role_spec,))
+
+    def _visit(self, role_spec):
+        try:
+            name, version = split_role_spec(role_spec)
+            role_path = os.path.join(self.role_dir, name)
+            if not self.is_installed(name):
+                self.report("installing role '{0}'".format(role_spec))
+                self.install(role_spec, self.role_dir)
+            deps = read_dependencies(role_path)
+            self.graph[name] = [split_role_spec(dep)[0] for dep in deps]
+            for dep in deps:
+                self._schedule(dep)
+        except Exception as exc:
+            with self._cond:
+                self.errors.append((role_spec, exc))
+        finally:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.facts
+
+    fact caching across ansible-role invocations.  with --fact-cache,
+    runs use ansible's jsonfile fact cache below the ansible-role cache
+    dir and "smart" gathering, so applying several roles to a host one
+    after another only gathers its facts once per TTL.
+
+      ansible-role --fact-cache role.name hostname
+      ansible-role facts host1,host2 [--hosts-file FILE] [--workers N]
+
+    the `facts` command warms the cache for many hosts at once, with a
+    single `ansible -m setup` run using --workers forks.
+"""
+import sys
+
+from ansible_role import proc
+from ansible_role.util import ensure_dir
+
+FACTS_DIR = 'facts'
+
+# seconds before cached facts are gathered again
+DEFAULT_TTL = 3600
+
+
+def get_fact_cache_dir(cache_dir=None):
+    from ansible_role.cache import cache_subdir
+    return cache_subdir(cache_dir, FACTS_DIR)
+
+
+def get_fact_cache_env(cache_dir=None, ttl=DEFAULT_TTL, create=True):
+    """ the ansible settings for a fact-cached run.  facts are only
+        gathered for hosts without fresh facts in the cache.  the cache
+        directory is created unless `create` is False (e.g. for --plan).
+    """
+    fact_cache_dir = get_fact_cache_dir(cache_dir)
+    if create:
+        ensure_dir(fact_cache_dir)
+    return dict(
+        ANSIBLE_CACHE_PLUGIN='jsonfile',
+        ANSIBLE_CACHE_PLUGIN_CONNECTION=fact_cache_dir,
+        ANSIBLE_CACHE_PLUGIN_TIMEOUT=str(int(ttl)),
+        ANSIBLE_GATHERING='smart')
+
+
+class SummaryStream(object):
+    """ shows the `host | STATUS` line of each host's result,
+        without the facts that follow it
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.in_result = False
+
+    def write(self, line):
+        if self.in_result:
+            self.in_result = line.rstrip() != '}'
+            return
+        if line.rstrip().endswith(' => {'):
+            self.in_result = True
+            line = line.rstrip()[:-len(' => {')] + '\n'
+        (self.stream or sys.stdout).write(line)
+
+    def flush(self):
+        (self.stream or sys.stdout).flush()
+
+
+def gather_facts(hosts, env, ansible_args=[], forks=5, stream=None):
+    """ gathers and caches the facts of `hosts` with one `ansible`
+        run, `forks` hosts at a time.  returns a ProcessResult.
+    """
+    cmd = ['ansible', ','.join(hosts), '-m', 'setup',
+           '--forks', str(forks)] + list(ansible_args)
+    env = dict(env, ANSIBLE_STDOUT_CALLBACK='minimal')
+    return proc.run(cmd, env=env, stream=SummaryStream(stream))
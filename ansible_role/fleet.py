@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.fleet
+
+    helpers for applying a role to many hosts: host-list parsing,
+    a bounded worker pool that times each job, and lazy host streams
+    split into batches for --inventory-stream
+"""
+import sys
+import time
+
+from ansible_role.util import read_list_file
+
+DEFAULT_WORKERS = 5
+
+# hosts per batch with --inventory-stream, and the most forks
+# ansible-playbook gets for one batch
+DEFAULT_BATCH_SIZE = 200
+MAX_BATCH_FORKS = 50
+
+
+def parse_hosts(hosts=None, hosts_file=None):
+    """ builds the target host list from a comma-separated string
+        and/or a file with one host per line ('#' starts a comment).
+        duplicates are dropped, order is preserved.
+    """
+    found = []
+    if hosts:
+        found += [x.strip() for x in hosts.split(',')]
+    if hosts_file:
+        found += read_list_file(hosts_file)
+    result = []
+    for host in found:
+        if host and host not in result:
+            result.append(host)
+    return result
+
+
+def stream_hosts(source):
+    """ yields hosts from the file at `source` ('-' for stdin) as they
+        are read.  hosts are one per line or comma-separated, and '#'
+        starts a comment.  duplicates are not dropped, since that would
+        need to keep every host in memory.
+    """
+    fhandle = sys.stdin if source == '-' else open(source)
+    try:
+        for line in fhandle:
+            for host in line.split('#')[0].split(','):
+                host = host.strip()
+                if host:
+                    yield host
+    finally:
+        if fhandle is not sys.stdin:
+            fhandle.close()
+
+
+def batches(items, size):
+    """ yields lists of up to `size` items, consuming `items` lazily """
+    import itertools
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+class JobResult(object):
+    """ outcome of running one job in the pool """
+
+    def __init__(self, item, success, exit_code, duration, error=None):
+        self.item = item
+        self.error = error
+        self.success = success
+        self.exit_code = exit_code
+        self.duration = duration
+
+    def __repr__(self):
+        return "<JobResult {0!r} code={1} {2:.2f}s>".format(
+            self.item, self.exit_code, self.duration)
+
+
+def run_parallel(func, items, workers=DEFAULT_WORKERS):
+    """ calls `func(item)` for every item, with at most `workers` calls
+        in flight.  `func` returns (success, exit_code).  results are
+        returned as JobResults, in the same order as `items`.  with a
+        single worker, jobs run one by one in the calling thread.
+    """
+    def timed(item):
+        start = time.time()
+        error = None
+        try:
+            success, exit_code = func(item)
+        except Exception as exc:
+            success, exit_code, error = False, 1, exc
+        return JobResult(
+            item, success, exit_code, time.time() - start, error=error)
+    workers = max(1, min(workers, len(items)))
+    if workers == 1:
+        return [timed(item) for item in items]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(timed, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def aggregate_exit_code(results):
+    """ exit code for a whole run: 0 when every job succeeded,
+        otherwise the highest exit code of any job
+    """
+    codes = [x.exit_code for x in results if not x.success]
+    return max(codes or [0]) or (1 if codes else 0)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.history
+
+    every ansible-role run appends a compact record to a SQLite database,
+    $cache_dir/history.sqlite: the roles and their versions, the exit
+    code, the time of each phase and the cache hits, plus one row per
+    host with the counters from the PLAY RECAP (ok, changed, failed, ..)
+    and the time of the play run that covered it.  runs of several
+    roles at once count towards each of them.
+
+      ansible-role stats [--role NAME] [--host HOST] [--days 7] [--json]
+
+    reports percentiles per role and per role and host over the last
+    --days days, and flags regressions: medians more than --tolerance
+    slower than in the --days days before.  every query goes through an
+    index on the start time (and the role or host it filters on), so
+    stats stay fast on large histories.  --no-history (or
+    $ANSIBLE_ROLE_HISTORY=0) turns recording off.
+"""
+import os
+import time
+
+HISTORY_FILE = 'history.sqlite'
+HISTORY_ENV = 'ANSIBLE_ROLE_HISTORY'
+
+DEFAULT_DAYS = 7
+DEFAULT_TOLERANCE = 0.25
+PERCENTILES = (50, 90, 99)
+
+# counters from the recap that are kept per host
+RECAP_COUNTERS = ('ok', 'changed', 'failed', 'unreachable', 'skipped')
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        started REAL NOT NULL,
+        role TEXT NOT NULL,
+        version TEXT,
+        ansible_role_version TEXT,
+        exit_code INTEGER,
+        seconds REAL,
+        phases TEXT,
+        cache_hits INTEGER,
+        cache_misses INTEGER,
+        host_count INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS host_runs (
+        run_id INTEGER NOT NULL REFERENCES runs (id),
+        started REAL NOT NULL,
+        role TEXT NOT NULL,
+        host TEXT NOT NULL,
+        seconds REAL,
+        ok INTEGER,
+        changed INTEGER,
+        failed INTEGER,
+        unreachable INTEGER,
+        skipped INTEGER)""",
+    # one row per role of a run, which is what stats group by
+    """CREATE TABLE IF NOT EXISTS run_roles (
+        run_id INTEGER NOT NULL REFERENCES runs (id),
+        started REAL NOT NULL,
+        role TEXT NOT NULL,
+        PRIMARY KEY (run_id, role))""",
+    "CREATE INDEX IF NOT EXISTS runs_started ON runs (started)",
+    "CREATE INDEX IF NOT EXISTS run_roles_started ON run_roles (started)",
+    "CREATE INDEX IF NOT EXISTS run_roles_role ON run_roles (role, started)",
+    "CREATE INDEX IF NOT EXISTS host_runs_started ON host_runs (started)",
+    "CREATE INDEX IF NOT EXISTS host_runs_host ON host_runs (host, started)",
+    "CREATE INDEX IF NOT EXISTS host_runs_run ON host_runs (run_id)",
+]
+
+
+def enabled():
+    return os.environ.get(HISTORY_ENV, '1').lower() not in (
+        '0', 'no', 'false', 'off')
+
+
+def get_history_path(cache_dir=None):
+    from ansible_role.cache import cache_subdir
+    return cache_subdir(cache_dir, HISTORY_FILE)
+
+
+def percentile(ordered, pct):
+    """ nearest-rank percentile of the sorted list `ordered` """
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def version_string(role_versions):
+    """ one version column for the versions of all roles of a run """
+    versions = [role_versions[name] or '' for name in sorted(role_versions)]
+    if not any(versions):
+        return None
+    return ','.join(versions)
+
+
+class History(object):
+    """ the run history in `path` """
+
+    def __init__(self, path=None, cache_dir=None):
+        self.path = path or get_history_path(cache_dir)
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            import sqlite3
+            from ansible_role.util import ensure_dir
+            ensure_dir(os.path.dirname(self.path))
+            # parallel runs append at the same time
+            self._db = sqlite3.connect(self.path, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                self._db.execute(statement)
+            self._db.commit()
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def record(self, roles, report, exit_code, ansible_role_version=None):
+        """ appends a run, given the metrics' JSON `report` (which holds
+            the phases, counters, recap and role_versions) and its exit
+            code.  returns the id of the run.
+        """
+        import json
+        from ansible_role.util import split_role_spec
+        phases = dict((name, phase['seconds'])
+                      for name, phase in report['phases'].items()
+                      if phase['count'])
+        counters = report['counters']
+        recap = report.get('recap', {})
+        role = ', '.join(roles)
+        started = report['started']
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (started, role, version, '
+                'ansible_role_version, exit_code, seconds, phases, '
+                'cache_hits, cache_misses, host_count) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (started, role,
+                 version_string(report.get('role_versions', {})),
+                 ansible_role_version, exit_code, phases.get('total'),
+                 json.dumps(phases, sort_keys=True),
+                 counters.get('cache_hits', 0),
+                 counters.get('cache_misses', 0), len(recap)))
+            run_id = cursor.lastrowid
+            names = set(split_role_spec(x)[0] for x in roles)
+            self.db.executemany(
+                'INSERT INTO run_roles (run_id, started, role) '
+                'VALUES (?, ?, ?)',
+                [(run_id, started, name) for name in sorted(names)])
+            rows = []
+            for host, counts in sorted(recap.items()):
+                row = [run_id, started, role, host, counts.get('seconds')]
+                rows.append(row + [counts.get(x, 0) for x in RECAP_COUNTERS])
+            self.db.executemany(
+                'INSERT INTO host_runs (run_id, started, role, host, '
+                'seconds, ok, changed, failed, unreachable, skipped) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return run_id
+
+    def _groups(self, query, args):
+        """ {group: sorted seconds} for (group..., seconds) rows """
+        groups = {}
+        for row in self.db.execute(query, args):
+            groups.setdefault(tuple(row[:-1]), []).append(row[-1])
+        return groups
+
+    def durations(self, since, until, role=None, host=None):
+        """ ({role: seconds}, {(role, host): seconds}) of the runs
+            started in [since, until), each list sorted
+        """
+        where = ['x.started >= ?', 'x.started < ?']
+        args = [since, until]
+        if role:
+            where.append('x.role = ?')
+            args.append(role)
+        runs = {}
+        if not host:
+            runs = self._groups(
+                'SELECT x.role, runs.seconds FROM run_roles x '
+                'JOIN runs ON runs.id = x.run_id WHERE {0} '
+                'AND runs.seconds IS NOT NULL '
+                'ORDER BY x.role, runs.seconds'.format(' AND '.join(where)),
+                args)
+        # the same times, so that either index can be used
+        where += ['h.started >= ?', 'h.started < ?']
+        args += [since, until]
+        if host:
+            where.append('h.host = ?')
+            args.append(host)
+        hosts = self._groups(
+            'SELECT x.role, h.host, h.seconds FROM host_runs h '
+            'JOIN run_roles x ON x.run_id = h.run_id WHERE {0} '
+            'AND h.seconds IS NOT NULL '
+            'ORDER BY x.role, h.host, h.seconds'.format(' AND '.join(where)),
+            args)
+        return (dict((k[0], v) for k, v in runs.items()), hosts)
+
+    def failures(self, since, until, role=None):
+        """ {role: number of failed runs} in [since, until) """
+        query = 'SELECT x.role, COUNT(*) FROM run_roles x ' \
+            'JOIN runs ON runs.id = x.run_id WHERE x.started >= ? ' \
+            'AND x.started < ? AND runs.exit_code != 0'
+        args = [since, until]
+        if role:
+            query += ' AND x.role = ?'
+            args.append(role)
+        return dict(self.db.execute(query + ' GROUP BY x.role', args))
+
+
+def summarize(seconds):
+    ordered = sorted(seconds)
+    summary = dict(runs=len(ordered))
+    for pct in PERCENTILES:
+        summary['p{0}'.format(pct)] = percentile(ordered, pct)
+    return summary
+
+
+def get_stats(history, days=DEFAULT_DAYS, role=None, host=None,
+              tolerance=DEFAULT_TOLERANCE, now=None):
+    """ percentiles per role and per (role, host) over the last `days`
+        days, with the medians of the `days` days before them, and the
+        regressions: medians more than `tolerance` (a fraction) slower
+    """
+    now = now or time.time()
+    since = now - days * 86400
+    current = history.durations(since, now, role=role, host=host)
+    before = history.durations(since - days * 86400, since,
+                               role=role, host=host)
+    failures = history.failures(since, now, role=role)
+    stats = dict(days=days, roles=[], hosts=[], regressions=[])
+    for kind, key_names, groups, previous in (
+            ('roles', ('role',), current[0], before[0]),
+            ('hosts', ('role', 'host'), current[1], before[1])):
+        for key in sorted(groups):
+            keys = key if isinstance(key, tuple) else (key,)
+            entry = dict(zip(key_names, keys))
+            entry.update(summarize(groups[key]))
+            if kind == 'roles':
+                entry['failed'] = failures.get(key, 0)
+            old = previous.get(key)
+            entry['previous_p50'] = percentile(old, 50) if old else None
+            if old and entry['p50'] > entry['previous_p50'] * (1 + tolerance):
+                stats['regressions'].append(dict(
+                    entry, change=entry['p50'] / entry['previous_p50'] - 1))
+            stats[kind].append(entry)
+    return stats
+
+
+def format_stats(stats):
+    lines = []
+
+    def line(name, entry):
+        text = '{0:40} {1:6d} runs  p50 {2:7.2f}s  p90 {3:7.2f}s  ' \
+            'p99 {4:7.2f}s'.format(
+                name, entry['runs'], entry['p50'], entry['p90'],
+                entry['p99'])
+        if entry.get('failed'):
+            text += '  {0} failed'.format(entry['failed'])
+        return text
+    lines.append('last {0} days, per role:'.format(stats['days']))
+    lines += [line(x['role'], x) for x in stats['roles']]
+    lines.append('per role and host:')
+    lines += [line('{0} @ {1}'.format(x['role'], x['host']), x)
+              for x in stats['hosts']]
+    for x in stats['regressions']:
+        name = x['role'] + (' @ ' + x['host'] if 'host' in x else '')
+        lines.append('REGRESSION {0}: p50 {1:.2f}s -> {2:.2f}s '
+                     '(+{3:.0%})'.format(
+                         name, x['previous_p50'], x['p50'], x['change']))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.index
+
+    persisted index of the roles installed in a role-dir.
+
+    the index lives next to the roles, in `.ansible-role-index.json`,
+    and maps each role name to its version, install time, content hash
+    and a "stamp" (size and mtime of a few key files).  a role counts as
+    installed when it has an index entry whose stamp still matches, so
+    lookups cost a couple of stats instead of a listing of the whole
+    role-dir, and roles that were only partially extracted (which never
+    get an entry) or were damaged afterwards are told apart from good
+    ones without walking their trees.
+"""
+import os
+import json
+import time
+import hashlib
+
+from ansible_role.locks import FileLock
+
+INDEX_FILE = '.ansible-role-index.json'
+
+# files whose size and mtime identify an installed role
+STAMP_FILES = (
+    'meta/.galaxy_install_info', 'meta/main.yml', 'tasks/main.yml',
+    'meta/main.yaml', 'tasks/main.yaml',
+)
+
+# a directory without any of these is not a role (yet), e.g. a
+# partly extracted one
+ROLE_FILES = tuple(
+    '{0}/main.{1}'.format(part, ext)
+    for part in ('tasks', 'meta', 'handlers', 'defaults', 'vars')
+    for ext in ('yml', 'yaml'))
+
+# results of RoleIndex.check()
+INSTALLED = 'installed'
+MISSING = 'missing'
+UNINDEXED = 'unindexed'
+INCOMPLETE = 'incomplete'
+CORRUPT = 'corrupt'
+
+# index-file -> ((inode, mtime, size), data), so repeated lookups in one process
+# (e.g. the daemon) only parse the index when it changed
+_loaded = {}
+
+
+def get_installed_version(role_path):
+    """ version recorded by ansible-galaxy for an installed role, if any """
+    info_file = os.path.join(role_path, 'meta', '.galaxy_install_info')
+    if not os.path.exists(info_file):
+        return None
+    with open(info_file) as fhandle:
+        for line in fhandle:
+            key, _, val = line.partition(':')
+            if key.strip() == 'version':
+                return val.strip().strip('\'"') or None
+    return None
+
+
+def hash_tree(path):
+    """ sha256 over the relative paths and contents of every file
+        below `path`, in a stable order
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for fname in sorted(files):
+            fpath = os.path.join(root, fname)
+            rel_path = os.path.relpath(fpath, path)
+            digest.update(rel_path.encode('utf-8') + b'\0')
+            if os.path.islink(fpath) and not os.path.exists(fpath):
+                continue
+            with open(fpath, 'rb') as fhandle:
+                for chunk in iter(lambda: fhandle.read(65536), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def looks_complete(role_path):
+    return any(os.path.exists(os.path.join(role_path, rel_path))
+               for rel_path in ROLE_FILES)
+
+
+def get_stamp(role_path):
+    """ [relative-path, size, mtime] for each of the stamp files present """
+    stamp = []
+    for rel_path in STAMP_FILES:
+        try:
+            stat = os.stat(os.path.join(role_path, rel_path))
+        except OSError:
+            continue
+        stamp.append([rel_path, stat.st_size, int(stat.st_mtime)])
+    return stamp
+
+
+class RoleIndex(object):
+    """ the index of one role-dir """
+
+    def __init__(self, role_dir):
+        self.role_dir = role_dir
+        self.path = os.path.join(role_dir, INDEX_FILE)
+
+    def load(self):
+        """ {role-name: entry} as currently stored on disk """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return {}
+        key = (stat.st_ino, stat.st_mtime, stat.st_size)
+        cached = _loaded.get(self.path)
+        if cached and cached[0] == key:
+            return cached[1]
+        try:
+            with open(self.path) as fhandle:
+                data = json.load(fhandle)
+        except (IOError, ValueError):
+            # a damaged index only costs a re-scan of the roles
+            data = {}
+        _loaded[self.path] = (key, data)
+        return data
+
+    def get(self, name):
+        return self.load().get(name)
+
+    def check(self, name):
+        """ one of INSTALLED, MISSING, UNINDEXED (on disk, but installed
+            by something else), INCOMPLETE (on disk and unindexed, but
+            without any of the ROLE_FILES) or CORRUPT (indexed, but
+            changed since)
+        """
+        role_path = os.path.join(self.role_dir, name)
+        entry = self.get(name)
+        if entry is None:
+            if not os.path.isdir(role_path):
+                return MISSING
+            return UNINDEXED if looks_complete(role_path) else INCOMPLETE
+        if not os.path.isdir(role_path):
+            return MISSING
+        if get_stamp(role_path) != entry.get('stamp'):
+            return CORRUPT
+        return INSTALLED
+
+    def verify(self, name):
+        """ full check of the role's content against the indexed hash """
+        entry = self.get(name)
+        role_path = os.path.join(self.role_dir, name)
+        return bool(entry) and os.path.isdir(role_path) and \
+            hash_tree(role_path) == entry.get('hash')
+
+    def record(self, name, version=None, source='local'):
+        """ (re)indexes the role called `name`, which must be complete.
+            `source` is 'galaxy' for roles that ansible-role installed
+            itself, and 'local' for roles it found on disk.
+        """
+        role_path = os.path.join(self.role_dir, name)
+        entry = dict(
+            source=source,
+            version=version or get_installed_version(role_path),
+            installed=time.time(),
+            hash=hash_tree(role_path),
+            stamp=get_stamp(role_path))
+        self.update({name: entry})
+        return entry
+
+    def update(self, entries):
+        """ merges {role-name: entry} into the index on disk """
+        self._write(lambda data: data.update(entries))
+
+    def remove(self, name):
+        self._write(lambda data: data.pop(name, None))
+
+    def _write(self, change):
+        with FileLock(self.path + '.lock'):
+            data = dict(self.load())
+            change(data)
+            tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as fhandle:
+                json.dump(data, fhandle, indent=1, sort_keys=True)
+            os.rename(tmp_path, self.path)
+        _loaded.pop(self.path, None)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.inprocess
+
+    the "inprocess" engine: runs plays through ansible's python API
+    (TaskQueueManager) inside the ansible-role process, instead of
+    writing a playbook file and forking ansible-playbook.  this saves an
+    interpreter start and a full plugin load on every role application,
+    which is what dominates repeated runs of small roles.
+"""
+import os
+import threading
+
+# ansible's CLI arguments and display are process-global,
+# so in-process runs are serialized
+_lock = threading.Lock()
+_plugins_loaded = []
+
+# stands in for the playbook file that ansible-playbook's
+# argument parser insists on; it is never opened
+INLINE_PLAYBOOK = '<ansible-role>'
+
+
+def run_play(play_source, ansible_args=[], env=None, stream=None):
+    """ runs one play, given as the dict that would appear in a
+        playbook.  `ansible_args` are ansible-playbook's command line
+        options, and `env` holds ANSIBLE_* settings for this run only.
+        ansible's output goes to `stream` (default: sys.stdout).
+        returns (success, exit_code).
+    """
+    import sys
+    with _lock:
+        restore = _override_settings(env or {})
+        restore_process = _save_process_state()
+        old_stdout = sys.stdout
+        sys.stdout = stream or old_stdout
+        try:
+            return _run_play(play_source, list(ansible_args))
+        finally:
+            sys.stdout = old_stdout
+            restore_process()
+            restore()
+
+
+def _override_settings(env):
+    """ puts `env` into os.environ, and re-reads the ansible settings
+        that come from those variables, since ansible.constants only
+        reads them once per process.  returns a function undoing both.
+    """
+    if not env:
+        return lambda: None
+    from ansible import constants
+    old_env = dict(os.environ)
+    os.environ.update(env)
+    names = [
+        name for name, definition in
+        constants.config.get_configuration_definitions().items()
+        if any(x.get('name') in env for x in definition.get('env') or [])]
+    old_values = dict((name, getattr(constants, name, None))
+                      for name in names)
+    for name in names:
+        setattr(constants, name, constants.config.get_config_value(name))
+
+    def restore():
+        os.environ.clear()
+        os.environ.update(old_env)
+        for name, value in old_values.items():
+            setattr(constants, name, value)
+    return restore
+
+
+def _save_process_state():
+    """ TaskQueueManager makes stdin/stdout/stderr non-inheritable and
+        installs its own SIGINT/SIGTERM handlers, which is fine for
+        ansible-playbook but breaks anything this process runs later:
+        child processes start without stdio.  returns a function
+        putting both back.
+    """
+    restore_stdio = _save_stdio()
+    restore_handlers = _save_signal_handlers()
+
+    def restore():
+        restore_stdio()
+        restore_handlers()
+    return restore
+
+
+def _save_stdio():
+    """ returns a function restoring whether fds 0-2 are inherited """
+    try:
+        fds = dict((fd, os.get_inheritable(fd)) for fd in (0, 1, 2))
+    except (AttributeError, OSError):
+        # python 2, or closed stdio
+        return lambda: None
+
+    def restore():
+        for fd, inheritable in fds.items():
+            try:
+                os.set_inheritable(fd, inheritable)
+            except OSError:
+                pass
+    return restore
+
+
+def _save_signal_handlers():
+    """ returns a function restoring the SIGINT/SIGTERM handlers """
+    import signal
+    handlers = dict((signum, signal.getsignal(signum))
+                    for signum in (signal.SIGINT, signal.SIGTERM))
+
+    def restore():
+        for signum, handler in handlers.items():
+            try:
+                signal.signal(signum, handler)
+            except ValueError:
+                # only the main thread may set handlers
+                pass
+    return restore
+
+
+def _init_plugin_loader(context):
+    """ ansible >= 2.15 wants the plugin loader set up exactly once,
+        after the command line has been parsed
+    """
+    if _plugins_loaded:
+        return
+    try:
+        from ansible.plugins.loader import init_plugin_loader
+    except ImportError:
+        pass
+    else:
+        collections_path = context.CLIARGS.get('collections_path') or []
+        if not isinstance(collections_path, (list, tuple)):
+            collections_path = [collections_path]
+        init_plugin_loader(list(collections_path))
+    _plugins_loaded.append(True)
+
+
+def _add_callback_paths():
+    """ callback plugin paths set for this run only (e.g. by --profile),
+        which the plugin loader set up by an earlier run doesn't know
+    """
+    from ansible import constants
+    from ansible.plugins.loader import callback_loader
+    for path in constants.DEFAULT_CALLBACK_PLUGIN_PATH or []:
+        callback_loader.add_directory(path)
+
+
+def _reset_vault_secrets():
+    """ newer ansible refuses to set up vault secrets twice per process,
+        which every run after the first one needs to do
+    """
+    try:
+        from ansible.parsing.vault import VaultSecretsContext
+    except ImportError:
+        return
+    VaultSecretsContext._current = None
+
+
+def _trusted(value):
+    """ newer ansible only renders templates in strings that are marked as
+        trusted, which strings loaded from a playbook file are
+    """
+    try:
+        from ansible.template import trust_as_template
+    except ImportError:
+        return value
+    if isinstance(value, dict):
+        return dict((key, _trusted(val)) for key, val in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_trusted(x) for x in value]
+    if isinstance(value, str):
+        return trust_as_template(value)
+    return value
+
+
+def _post_validate(play, loader, variable_manager):
+    """ templates the play's keywords, like a `hosts` coming from an
+        extra-var, which ansible-playbook's PlaybookExecutor does
+    """
+    try:
+        from ansible._internal._templating._engine import \
+            TemplateEngine as Templar
+    except ImportError:
+        from ansible.template import Templar
+    templar = Templar(
+        loader=loader, variables=variable_manager.get_vars(play=play))
+    play.post_validate(templar)
+
+
+def _reset_cli_args():
+    """ ansible keeps the first parsed command line, and the extra-vars
+        and option vars loaded from it, for the rest of the process, so
+        every run after the first one would see its arguments
+    """
+    from ansible.utils import vars as ansible_vars
+    for func, attr in ((ansible_vars.load_extra_vars, 'extra_vars'),
+                       (ansible_vars.load_options_vars, 'options_vars')):
+        if hasattr(func, attr):
+            delattr(func, attr)
+    try:
+        from ansible.utils.context_objects import GlobalCLIArgs
+    except ImportError:
+        return
+    GlobalCLIArgs._Singleton__instance = None
+
+
+def _run_play(play_source, ansible_args):
+    from ansible import context
+    from ansible.cli import CLI
+    from ansible.cli.playbook import PlaybookCLI
+    from ansible.errors import AnsibleError
+    from ansible.playbook.play import Play
+    from ansible.utils.display import Display
+    from ansible.executor.task_queue_manager import TaskQueueManager
+
+    _reset_vault_secrets()
+    _reset_cli_args()
+    cli = PlaybookCLI(['ansible-playbook', INLINE_PLAYBOOK] + ansible_args)
+    cli.parse()
+    _init_plugin_loader(context)
+    _add_callback_paths()
+    passwords = {}
+    try:
+        no_passwords = any(context.CLIARGS.get(x) for x in (
+            'listhosts', 'listtasks', 'listtags', 'syntax'))
+        if not no_passwords:
+            sshpass, becomepass = cli.ask_passwords()
+            passwords = dict(conn_pass=sshpass, become_pass=becomepass)
+        loader, inventory, variable_manager = cli._play_prereqs()
+        # applies --limit, and fails like ansible-playbook when
+        # the limit doesn't match anything
+        CLI.get_host_list(inventory, context.CLIARGS['subset'])
+        play = Play().load(
+            _trusted(play_source),
+            variable_manager=variable_manager, loader=loader)
+        _post_validate(play, loader, variable_manager)
+    except AnsibleError as exc:
+        Display().error(exc)
+        return False, 1
+    tqm = TaskQueueManager(
+        inventory=inventory,
+        variable_manager=variable_manager,
+        loader=loader,
+        passwords=passwords)
+    try:
+        exit_code = tqm.run(play)
+        # ansible-playbook's recap, which TaskQueueManager leaves
+        # to the PlaybookExecutor
+        tqm.send_callback('v2_playbook_on_stats', tqm._stats)
+    except AnsibleError as exc:
+        Display().error(exc)
+        exit_code = 1
+    finally:
+        tqm.cleanup()
+        loader.cleanup_all_tmp_files()
+    return exit_code == 0, exit_code
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.locks
+
+    advisory file locks, used to coordinate concurrent ansible-role
+    processes that share the same cache or module-path
+"""
+import os
+import fcntl
+
+from ansible_role.util import ensure_dir
+
+# per-role locks, inside the role-dir
+LOCKS_DIR = '.locks'
+
+
+class FileLock(object):
+    """ context manager around flock(2).  a shared lock can be held by
+        many processes at once, an exclusive lock by exactly one.  the
+        lock is released when the block exits or the process dies.
+    """
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self._fd = None
+
+    def acquire(self):
+        ensure_dir(os.path.dirname(os.path.abspath(self.path)))
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        fcntl.flock(self._fd, mode)
+        return self
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc, value, tb):
+        self.release()
+
+
+def role_lock(role_dir, name):
+    """ exclusive lock for installing or removing the role `name` in
+        `role_dir`, held by one process at a time
+    """
+    return FileLock(os.path.join(role_dir, LOCKS_DIR, name + '.lock'))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.metrics
+
+    per-phase timings and counters for one ansible-role run, written out
+    with --report-json PATH (JSON) or --report-metrics PATH (OpenMetrics
+    text), for dashboards that track where runs spend their time.
+
+    phases:
+      role_dir  creating/locating the role-dir
+      cache     fetching roles from the role cache
+      bundle    extracting an offline bundle
+      require   checking for (and downloading) the roles
+      render    building the playbook, or the play for inprocess runs
+      apply     running the play (once per host for multi-host runs)
+      total     the whole run
+
+    counters: cache_hits, cache_misses, roles_downloaded, download_bytes,
+      hosts_skipped (by --skip-unchanged)
+
+    recap: each host's counters from the PLAY RECAP (ok, changed, failed,
+      ...), plus the seconds of the play run that covered it
+"""
+import time
+import functools
+import threading
+
+# time.monotonic is python 3 only
+clock = getattr(time, 'monotonic', time.time)
+
+PHASES = ('role_dir', 'cache', 'bundle', 'require', 'render', 'apply', 'total')
+COUNTERS = ('cache_hits', 'cache_misses', 'roles_downloaded', 'download_bytes',
+            'hosts_skipped')
+
+# OpenMetrics names are prefixed with this
+NAMESPACE = 'ansible_role'
+
+
+class Metrics(object):
+    """ timings and counters collected during a run.  safe to use
+        from the fleet's worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.timings = dict((name, []) for name in PHASES)
+        self.counters = dict((name, 0) for name in COUNTERS)
+        self.recap = {}
+        self.extra = {}
+
+    def record(self, phase, duration):
+        with self._lock:
+            self.timings.setdefault(phase, []).append(duration)
+
+    def add(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def add_recap(self, hosts, seconds):
+        """ the recap counters of `hosts` ({host: counters}), from a play
+            run that took `seconds`
+        """
+        with self._lock:
+            for host, counts in hosts.items():
+                self.recap[host] = dict(counts, seconds=seconds)
+
+    def set(self, key, value):
+        """ adds `key` to the JSON report, e.g. the waves of a rollout """
+        with self._lock:
+            self.extra[key] = value
+
+    def phase(self, name):
+        """ context manager timing its block as one run of phase `name` """
+        return _Timer(self, name)
+
+    def as_dict(self):
+        """ the JSON report """
+        with self._lock:
+            phases = dict(
+                (name, dict(
+                    count=len(durations),
+                    seconds=sum(durations),
+                    max=max(durations) if durations else 0.0,
+                    durations=list(durations)))
+                for name, durations in self.timings.items())
+            report = dict(self.extra)
+            report.update(started=self.started, phases=phases,
+                          counters=dict(self.counters),
+                          recap=dict(self.recap))
+            return report
+
+    def as_openmetrics(self):
+        """ the OpenMetrics text exposition of the report """
+        report = self.as_dict()
+        name = NAMESPACE + '_phase_seconds'
+        lines = [
+            '# TYPE {0} summary'.format(name),
+            '# UNIT {0} seconds'.format(name),
+            '# HELP {0} time spent in each phase of the run'.format(name)]
+        for phase in sorted(report['phases']):
+            stats = report['phases'][phase]
+            lines += [
+                '{0}_count{{phase="{1}"}} {2}'.format(
+                    name, phase, stats['count']),
+                '{0}_sum{{phase="{1}"}} {2:.6f}'.format(
+                    name, phase, stats['seconds'])]
+        for counter in sorted(report['counters']):
+            name = '{0}_{1}'.format(NAMESPACE, counter)
+            lines += [
+                '# TYPE {0} counter'.format(name),
+                '{0}_total {1}'.format(name, report['counters'][counter])]
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path, **extra):
+        """ writes the JSON report to `path`, with `extra` fields
+            (e.g. roles, hosts, exit_code) added at the top level
+        """
+        import json
+        data = self.as_dict()
+        data.update(extra)
+        with open(path, 'w') as fhandle:
+            json.dump(data, fhandle, indent=1, sort_keys=True)
+
+    def write_openmetrics(self, path):
+        with open(path, 'w') as fhandle:
+            fhandle.write(self.as_openmetrics())
+
+
+class _Timer(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, exc, value, tb):
+        self.duration = clock() - self.start
+        self.metrics.record(self.name, self.duration)
+
+
+# the metrics of the current run; entry() resets them,
+# so each daemon request is reported on its own
+current = Metrics()
+
+
+def reset():
+    global current
+    current = Metrics()
+    return current
+
+
+def phase(name):
+    return current.phase(name)
+
+
+def add(counter, value=1):
+    current.add(counter, value)
+
+
+def timed(name):
+    """ decorator timing every call of the function as phase `name` """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kargs):
+            with current.phase(name):
+                return func(*args, **kargs)
+        return wrapper
+    return decorator
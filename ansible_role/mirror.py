@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.mirror
+
+    `ansible-role mirror`: a local caching proxy in front of galaxy.
+    responses are kept on disk in $cache_dir/mirror and revalidated
+    upstream with If-None-Match, so an unchanged answer costs a 304
+    instead of a download, and whatever was fetched once can still be
+    served while galaxy (or the network) is down.  the `download_url`s
+    in galaxy's answers are rewritten so role archives come through the
+    mirror as well.
+
+      ansible-role mirror [--port 8765] [--upstream URL] [--config FILE]
+      ANSIBLE_GALAXY_SERVER=http://127.0.0.1:8765/ ansible-role role.name
+"""
+import os
+import json
+import time
+import hashlib
+
+from ansible_role.util import ensure_dir
+from ansible_role.console import DEBUG, report as base_report
+
+DEFAULT_UPSTREAM = 'https://galaxy.ansible.com'
+DEFAULT_BIND = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# answers younger than this many seconds are served without asking
+# upstream whether they changed
+DEFAULT_MAX_AGE = 60
+
+MIRROR_DIR = 'mirror'
+ARCHIVE_PATH = '/_mirror/archive/'
+TIMEOUT = 60
+
+report = lambda *args, **kargs: base_report(
+    'ansible-role', *args, **kargs)
+
+
+def get_mirror_dir(cache_dir=None):
+    from ansible_role.cache import cache_subdir
+    return cache_subdir(cache_dir, MIRROR_DIR)
+
+
+def get_mirror_env(url):
+    """ the ansible settings pointing ansible-galaxy at the mirror """
+    return dict(ANSIBLE_GALAXY_SERVER=url)
+
+
+def write_config(path, url):
+    """ writes an ansible.cfg pointing ansible-galaxy at the mirror,
+        for use with $ANSIBLE_CONFIG
+    """
+    with open(path, 'w') as fhandle:
+        fhandle.write('[galaxy]\nserver = {0}\n'.format(url))
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _write_atomic(path, data):
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as fhandle:
+        fhandle.write(data)
+    os.rename(tmp_path, path)
+
+
+class MirrorStore(object):
+    """ upstream answers on disk: <key>.json holds the url, ETag,
+        content-type and when it was last checked, <key>.body the body.
+        <token>.link maps the mirror's archive urls back to upstream.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, url, suffix):
+        return os.path.join(self.path, _digest(url) + suffix)
+
+    def get(self, url):
+        """ (meta, body) stored for `url`, or (None, None) """
+        try:
+            with open(self._file(url, '.json')) as fhandle:
+                meta = json.load(fhandle)
+            with open(self._file(url, '.body'), 'rb') as fhandle:
+                body = fhandle.read()
+        except (IOError, OSError, ValueError):
+            return None, None
+        return meta, body
+
+    def put(self, url, headers, body):
+        ensure_dir(self.path)
+        meta = dict(
+            url=url, etag=headers.get('etag'),
+            content_type=headers.get('content-type'), checked=time.time())
+        # the body first, so a meta file always has a complete body
+        _write_atomic(self._file(url, '.body'), body)
+        _write_atomic(
+            self._file(url, '.json'), json.dumps(meta).encode('utf-8'))
+        return meta
+
+    def touch(self, url, meta):
+        """ records that `url` was just revalidated """
+        meta = dict(meta, checked=time.time())
+        _write_atomic(
+            self._file(url, '.json'), json.dumps(meta).encode('utf-8'))
+        return meta
+
+    def link(self, url):
+        """ token for `url`, which the mirror serves under ARCHIVE_PATH """
+        ensure_dir(self.path)
+        token = _digest(url)[:32]
+        path = os.path.join(self.path, token + '.link')
+        if not os.path.exists(path):
+            _write_atomic(path, url.encode('utf-8'))
+        return token
+
+    def resolve(self, token):
+        """ the upstream url for a token from link(), or None """
+        if not token.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.path, token + '.link'), 'rb') as fh:
+                return fh.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+
+
+def http_get(url, headers=None):
+    """ (status, {lowercase-header: value}, body) for a GET of `url`.
+        HTTP errors are returned, not raised; network errors raise.
+    """
+    try:
+        from urllib.request import Request, urlopen
+        from urllib.error import HTTPError
+    except ImportError:
+        from urllib2 import Request, urlopen, HTTPError
+    request = Request(url, headers=headers or {})
+    try:
+        response = urlopen(request, timeout=TIMEOUT)
+    except HTTPError as exc:
+        response = exc
+    try:
+        status = response.getcode()
+        resp_headers = dict(
+            (key.lower(), val) for key, val in response.info().items())
+        return status, resp_headers, response.read()
+    finally:
+        response.close()
+
+
+def rewrite(data, link):
+    """ points the archive downloads in a galaxy API answer at the
+        mirror.  `link(url)` is the mirror's url for an upstream one.
+    """
+    results = data.get('results') if isinstance(data, dict) else None
+    for item in results or []:
+        if isinstance(item, dict) and item.get('download_url'):
+            item['download_url'] = link(item['download_url'])
+    return data
+
+
+class Mirror(object):
+    """ answers GETs for galaxy urls from the store, revalidating them
+        upstream once they are older than `max_age` seconds
+    """
+
+    def __init__(self, store, upstream=DEFAULT_UPSTREAM,
+                 max_age=DEFAULT_MAX_AGE, report=report):
+        self.store = store
+        self.upstream = upstream.rstrip('/')
+        self.max_age = max_age
+        self.report = report
+
+    def fetch(self, url):
+        """ (status, content-type, body) for `url` """
+        meta, body = self.store.get(url)
+        if meta and time.time() - meta['checked'] < self.max_age:
+            return 200, meta['content_type'], body
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        try:
+            status, resp_headers, data = http_get(url, headers)
+        except (IOError, OSError) as exc:
+            if meta is None:
+                msg = "mirror: {0} unavailable: {1}"
+                self.report(msg.format(url, exc))
+                return 502, 'text/plain', str(exc).encode('utf-8')
+            msg = "mirror: {0} unavailable, serving the stored copy"
+            self.report(msg.format(url))
+            return 200, meta['content_type'], body
+        if status == 304 and meta:
+            self.store.touch(url, meta)
+            self.report("mirror: {0} not modified".format(url), level=DEBUG)
+            return 200, meta['content_type'], body
+        if status != 200:
+            return status, resp_headers.get('content-type'), data
+        self.report("mirror: fetched {0}".format(url), level=DEBUG)
+        meta = self.store.put(url, resp_headers, data)
+        return 200, meta['content_type'], data
+
+    def answer(self, path, base_url):
+        """ (status, content-type, body) for a request to the mirror's
+            `path`, with urls in the body pointing at `base_url`
+        """
+        if path.startswith(ARCHIVE_PATH):
+            url = self.store.resolve(path[len(ARCHIVE_PATH):])
+            if url is None:
+                return 404, 'text/plain', b'unknown archive'
+            return self.fetch(url)
+        status, content_type, body = self.fetch(self.upstream + path)
+        if status == 200 and 'json' in (content_type or ''):
+            try:
+                data = json.loads(body.decode('utf-8'))
+            except ValueError:
+                return status, content_type, body
+            data = rewrite(data, lambda url: '{0}{1}{2}'.format(
+                base_url, ARCHIVE_PATH, self.store.link(url)))
+            body = json.dumps(data).encode('utf-8')
+        return status, content_type, body
+
+
+def make_server(mirror, bind=DEFAULT_BIND, port=DEFAULT_PORT):
+    """ a threaded HTTP server answering with `mirror`.  port 0 picks a
+        free port; see server.server_address.
+    """
+    try:
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from socketserver import ThreadingMixIn
+    except ImportError:
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        from SocketServer import ThreadingMixIn
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            base_url = 'http://' + (
+                self.headers.get('Host') or '{0}:{1}'.format(
+                    *self.server.server_address[:2]))
+            status, content_type, body = mirror.answer(self.path, base_url)
+            etag = '"{0}"'.format(hashlib.sha256(body).hexdigest()[:32])
+            if status == 200 and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header('Content-Type', content_type or 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            if status == 200:
+                self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            mirror.report('mirror: ' + fmt % args, level=DEBUG)
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    return Server((bind, port), Handler)
+
+
+def serve(cache_dir=None, upstream=DEFAULT_UPSTREAM, bind=DEFAULT_BIND,
+          port=DEFAULT_PORT, max_age=DEFAULT_MAX_AGE, config=None):
+    """ runs the mirror until interrupted """
+    store = MirrorStore(get_mirror_dir(cache_dir))
+    server = make_server(
+        Mirror(store, upstream, max_age=max_age), bind=bind, port=port)
+    url = 'http://{0}:{1}/'.format(*server.server_address[:2])
+    if config:
+        write_config(config, url)
+        report("wrote {0}, use it with ANSIBLE_CONFIG={0}".format(config))
+    msg = "mirroring {0} at {1}, storing into {2}"
+    report(msg.format(upstream, url, store.path))
+    for key, val in get_mirror_env(url).items():
+        report("export {0}={1}".format(key, val))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.plan
+
+    `ansible-role --plan ...` shows what a run would do without doing
+    any of it: where each role (and each dependency that can be known
+    without galaxy) would come from, the playbook, and the command
+    line.  nothing is created, downloaded or run.
+"""
+import os
+
+from ansible_role.util import split_role_spec
+
+# where a role would come from
+DISK = 'disk'
+CACHE = 'cache'
+BUNDLE = 'bundle'
+DOWNLOAD = 'download'
+
+# stands in for the directories a real run creates
+TEMP_MODULE_PATH = '<tmpdir>'
+TEMP_PLAYBOOK = '<playbook.yml>'
+
+
+def role_source(name, role_dir, cache=None, bundled={}):
+    """ (source, path) for the role called `name`, where path is the
+        directory its dependencies can be read from, if any
+    """
+    from ansible_role import index
+    if os.path.isdir(role_dir):
+        role_index = index.RoleIndex(role_dir)
+        status = role_index.check(name)
+        if status not in (index.MISSING, index.INCOMPLETE):
+            return DISK, os.path.join(role_dir, name)
+    if name in bundled:
+        return BUNDLE, None
+    if cache is not None:
+        entry = cache.lookup(name)
+        if entry:
+            return CACHE, os.path.join(entry, 'roles', name)
+    return DOWNLOAD, None
+
+
+def resolve(role_specs, role_dir, cache=None, bundled={}):
+    """ [(role-spec, source, required-by)] for `role_specs` and the
+        dependencies of the ones that are available locally.  `bundled`
+        is the roles section of a bundle's manifest.
+    """
+    from ansible_role.deps import read_dependencies
+    resolved = []
+    seen = set()
+    pending = [(spec, None) for spec in role_specs]
+    while pending:
+        spec, required_by = pending.pop(0)
+        name = split_role_spec(spec)[0]
+        if name in seen:
+            continue
+        seen.add(name)
+        source, path = role_source(name, role_dir, cache, bundled)
+        resolved.append((spec, source, required_by))
+        if path:
+            dependencies = read_dependencies(path)
+        elif source == BUNDLE:
+            dependencies = bundled[name].get('dependencies', [])
+        else:
+            dependencies = []
+        pending += [(dep, name) for dep in dependencies]
+    return resolved
+
+
+def check_quoting(argv, quoted):
+    """ True when the shell would split the quoted command line back
+        into exactly `argv`
+    """
+    import shlex
+    return shlex.split(' '.join(quoted)) == list(argv)
+
+
+def format_plan(plan):
+    """ the plan, as shown to the user """
+    lines = ['role-dir: {0}{1}'.format(
+        plan['role_dir'], '' if plan['role_dir_exists'] else ' (new)')]
+    lines.append('roles:')
+    for spec, source, required_by in plan['roles']:
+        line = '  {0:<30} {1}'.format(spec, source)
+        if required_by:
+            line += ' (needed by {0})'.format(required_by)
+        lines.append(line)
+    lines.append('playbook:')
+    lines += ['  ' + line for line in plan['playbook'].splitlines()]
+    if plan['env']:
+        lines.append('environment:')
+        lines += ['  {0}={1}'.format(key, val)
+                  for key, val in sorted(plan['env'].items())]
+    lines.append('commands:')
+    lines += ['  ' + ' '.join(cmd) for cmd in plan['quoted']]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.playbooks
+
+    rendered playbooks, memoized.  plays are rendered once per (role
+    paths, host pattern, play options) and kept in a small in-memory LRU,
+    and the subprocess engine's playbook files live in $cache_dir/playbooks,
+    named by the sha256 of their content: the same play always reuses the
+    same file, instead of writing a new temporary one for every run.  only
+    the MAX_FILES most recently used files are kept.
+
+    play options: become, gather_facts, serial and vars, e.g.
+
+      ansible-role role.name host --play-become --play-gather-facts no \\
+          --play-serial 25% --play-var http_port=8080
+"""
+import os
+import threading
+
+from ansible_role.util import ensure_dir
+
+PLAYBOOKS_DIR = 'playbooks'
+
+# in the order they are rendered, between `hosts` and `roles`
+PLAY_OPTIONS = ('become', 'gather_facts', 'serial', 'vars')
+
+# rendered plays kept in memory, and playbook files kept on disk
+MEMORY_SIZE = 128
+MAX_FILES = 256
+
+# files used this recently are never evicted, since another run may be
+# about to hand them to ansible-playbook
+MIN_AGE = 600
+
+
+class LRU(object):
+    """ a dict of at most `size` items, dropping the least recently used.
+        safe to use from the fleet's worker threads.
+    """
+
+    def __init__(self, size=MEMORY_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._items = {}
+        self._order = []
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._order.remove(key)
+            self._order.append(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._items:
+                self._order.remove(key)
+            self._items[key] = value
+            self._order.append(key)
+            while len(self._order) > self.size:
+                del self._items[self._order.pop(0)]
+
+    def __len__(self):
+        return len(self._items)
+
+
+_rendered = LRU()
+
+
+def check_options(options):
+    """ `options` without the unset ones; raises ValueError for
+        anything that isn't a play option
+    """
+    options = dict((k, v) for k, v in (options or {}).items()
+                   if v is not None)
+    unknown = sorted(set(options) - set(PLAY_OPTIONS))
+    if unknown:
+        raise ValueError('unknown play options: ' + ', '.join(unknown))
+    if not isinstance(options.get('vars', {}), dict):
+        raise ValueError('play vars must be a dict')
+    return options
+
+
+def options_key(options):
+    """ a hashable, order-independent form of `options` """
+    import json
+    return tuple(
+        (name, json.dumps(value, sort_keys=True))
+        for name, value in sorted(check_options(options).items()))
+
+
+def render(role_paths, hosts, options=None):
+    """ the playbook applying `role_paths` in order to `hosts` """
+    key = (tuple(role_paths), hosts, options_key(options))
+    playbook = _rendered.get(key)
+    if playbook is None:
+        from ansible_role import yaml_scalar
+        # JSON is valid YAML, and doesn't need a YAML library
+        lines = ["- hosts: " + yaml_scalar(hosts)]
+        lines += ["  {0}: {1}".format(name, value)
+                  for name, value in key[2]]
+        lines += ["  roles:"]
+        lines += ["  - {role: " + path + "}" for path in role_paths]
+        playbook = '\n'.join(lines)
+        _rendered.put(key, playbook)
+    return playbook
+
+
+def get_playbooks_dir(cache_dir=None):
+    from ansible_role.cache import cache_subdir
+    return cache_subdir(cache_dir, PLAYBOOKS_DIR)
+
+
+class PlaybookStore(object):
+    """ content-addressed playbook files, shared by all processes
+        using the same cache dir
+    """
+
+    def __init__(self, cache_dir=None, max_files=MAX_FILES,
+                 min_age=MIN_AGE):
+        self.playbooks_dir = get_playbooks_dir(cache_dir)
+        self.max_files = max_files
+        self.min_age = min_age
+
+    def path(self, playbook):
+        """ the file holding `playbook`, written if it isn't there yet """
+        import hashlib
+        digest = hashlib.sha256(playbook.encode('utf-8')).hexdigest()
+        path = os.path.join(self.playbooks_dir, digest + '.yml')
+        try:
+            # marks the file as used, and tells whether it's there
+            os.utime(path, None)
+            return path
+        except OSError:
+            pass
+        ensure_dir(self.playbooks_dir)
+        tmp_path = '{0}.{1}.{2}.tmp'.format(
+            path, os.getpid(), threading.current_thread().ident)
+        with open(tmp_path, 'w') as fhandle:
+            fhandle.write(playbook)
+        os.rename(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """ removes the least recently used files beyond `max_files` """
+        import time
+        try:
+            names = os.listdir(self.playbooks_dir)
+        except OSError:
+            return []
+        if len(names) <= self.max_files:
+            return []
+        used = sorted(self._last_used(names))
+        cutoff = time.time() - self.min_age
+        evicted = []
+        for mtime, path in used[:max(0, len(used) - self.max_files)]:
+            if mtime > cutoff:
+                break
+            try:
+                os.remove(path)
+                evicted.append(path)
+            except OSError:
+                pass
+        return evicted
+
+    def _last_used(self, names):
+        """ [(mtime, path)] for the playbook files called `names` """
+        used = []
+        for name in names:
+            path = os.path.join(self.playbooks_dir, name)
+            try:
+                used.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+        return used
+
+
+_stores = {}
+
+
+def get_store(cache_dir=None):
+    """ the PlaybookStore for `cache_dir`, one per process """
+    playbooks_dir = get_playbooks_dir(cache_dir)
+    if playbooks_dir not in _stores:
+        _stores[playbooks_dir] = PlaybookStore(cache_dir)
+    return _stores[playbooks_dir]
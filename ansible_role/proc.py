@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.proc
+
+    runs ansible's command line tools directly (argv lists, no shell),
+    streaming their output line by line as it is produced
+"""
+import os
+import sys
+
+
+class ProcessResult(object):
+    """ the parts of a finished process that callers care about """
+
+    def __init__(self, cmd, return_code):
+        self.cmd = cmd
+        self.return_code = return_code
+
+    @property
+    def succeeded(self):
+        return self.return_code == 0
+
+    @property
+    def failed(self):
+        return not self.succeeded
+
+
+def run(cmd, env=None, stream=None, cwd=None):
+    """ runs `cmd` (an argv list) and copies its combined stdout/stderr
+        to `stream` (default: sys.stdout) one line at a time, without
+        buffering the output in memory.  returns a ProcessResult.
+    """
+    import subprocess
+    stream = stream or sys.stdout
+    proc_env = dict(os.environ)
+    proc_env.update(env or {})
+    if getattr(stream, 'isatty', lambda: False)():
+        # ansible turns colors off when writing to a pipe
+        proc_env.setdefault('ANSIBLE_FORCE_COLOR', 'true')
+    proc_env.setdefault('PYTHONUNBUFFERED', '1')
+    try:
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            env=proc_env, cwd=cwd)
+    except OSError as exc:
+        stream.write("{0}: {1}\n".format(cmd[0], exc))
+        stream.flush()
+        return ProcessResult(cmd, 127)
+    for line in iter(proc.stdout.readline, b''):
+        if str is not bytes:
+            # python 3 streams take text, python 2 streams take bytes
+            line = line.decode('utf-8', 'replace')
+        stream.write(line)
+        stream.flush()
+    proc.stdout.close()
+    return ProcessResult(cmd, proc.wait())
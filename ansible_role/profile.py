@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.profile
+
+    --profile: runs get the bundled `ansible_role_profile` callback
+    plugin, which records the wall time of every task and handler per
+    host.  afterwards the slowest tasks are reported, and all timings are
+    written as folded stacks (host;play;role;task milliseconds), the
+    input format of flamegraph.pl and speedscope.
+
+      ansible-role --profile role.name web1,web2 [--profile-top 10] \\
+          [--profile-output ansible-role.folded]
+"""
+import os
+
+# must match the callback plugin, which ansible loads by path
+PROFILE_ENV = 'ANSIBLE_ROLE_PROFILE_FILE'
+CALLBACK_NAME = 'ansible_role_profile'
+CALLBACK_DIR = os.path.join(os.path.dirname(__file__), 'callback_plugins')
+DEFAULT_TOP = 10
+DEFAULT_OUTPUT = 'ansible-role.folded'
+
+
+def _append(var, value, sep):
+    """ `value` added to the list in $var """
+    current = os.environ.get(var)
+    return sep.join([current, value]) if current else value
+
+
+def get_profile_env(records_path):
+    """ the ansible settings enabling the profile callback, which writes
+        its timings to `records_path`
+    """
+    enabled = _append('ANSIBLE_CALLBACKS_ENABLED', CALLBACK_NAME, ',')
+    return {
+        'ANSIBLE_CALLBACK_PLUGINS': _append(
+            'ANSIBLE_CALLBACK_PLUGINS', CALLBACK_DIR, os.pathsep),
+        'ANSIBLE_CALLBACKS_ENABLED': enabled,
+        # the name before ansible 2.11
+        'ANSIBLE_CALLBACK_WHITELIST': _append(
+            'ANSIBLE_CALLBACK_WHITELIST', CALLBACK_NAME, ','),
+        PROFILE_ENV: records_path,
+    }
+
+
+def load(records_path):
+    """ the timings the callback wrote, as dicts """
+    import json
+    records = []
+    try:
+        with open(records_path) as fhandle:
+            for line in fhandle:
+                if line.strip():
+                    records.append(json.loads(line))
+    except (IOError, OSError):
+        pass
+    return records
+
+
+def _frame(text):
+    # ';' separates the frames of a folded stack
+    return (text or '-').replace(';', ',')
+
+
+def folded(records):
+    """ folded-stack lines for `records`, with milliseconds as counts.
+        repeated (host, play, role, task) stacks are added up.
+    """
+    totals = {}
+    for record in records:
+        stack = ';'.join(_frame(record.get(key)) for key in
+                         ('host', 'play', 'role', 'task'))
+        if record.get('kind') == 'handler':
+            stack += ' (handler)'
+        totals[stack] = totals.get(stack, 0) + record['duration']
+    return ['{0} {1}'.format(stack, int(round(total * 1000)))
+            for stack, total in sorted(totals.items())]
+
+
+def slowest(records, top=DEFAULT_TOP):
+    return sorted(records, key=lambda x: -x['duration'])[:top]
+
+
+def format_record(record):
+    name = record['task']
+    if record.get('role'):
+        name = '{0} : {1}'.format(record['role'], name)
+    if record.get('kind') == 'handler':
+        name += ' (handler)'
+    return '{0:8.2f}s  {1}  [{2}, {3}]'.format(
+        record['duration'], name, record['host'], record['status'])
+
+
+def report_profile(records_path, top=DEFAULT_TOP, output=DEFAULT_OUTPUT,
+                   report=None):
+    """ reports the `top` slowest tasks from the callback's timings in
+        `records_path`, which is removed, and writes them all to `output`
+        as folded stacks
+    """
+    report = report or (lambda msg: None)
+    records = load(records_path)
+    if os.path.exists(records_path):
+        os.remove(records_path)
+    if not records:
+        report("profile: no tasks were timed")
+        return records
+    msg = "profile: {0} slowest of {1} task runs"
+    report(msg.format(min(top, len(records)), len(records)))
+    for record in slowest(records, top):
+        report(format_record(record))
+    with open(output, 'w') as fhandle:
+        fhandle.write(''.join(line + '\n' for line in folded(records)))
+    report("profile: folded stacks written to {0}".format(output))
+    return records
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.recap
+
+    per-host results from the PLAY RECAP that ansible-playbook prints at
+    the end of a run, which is the only place they show up when ansible
+    runs as a separate process:
+
+      PLAY RECAP ****************************************************
+      web1    : ok=3    changed=1    unreachable=0    failed=0    ...
+"""
+import re
+import sys
+
+RECAP_HEADER = 'PLAY RECAP'
+ANSI_ESCAPE = re.compile('\x1b\\[[0-9;]*m')
+RECAP_LINE = re.compile(r'^(?P<host>\S+)\s+:\s+(?P<counts>(\w+=\d+\s*)+)$')
+
+
+def parse_recap_line(line):
+    """ (host, {counter: value}) for a line of the recap, else None """
+    match = RECAP_LINE.match(ANSI_ESCAPE.sub('', line).strip())
+    if not match:
+        return None
+    counts = dict(
+        (key, int(val)) for key, val in
+        (pair.split('=') for pair in match.group('counts').split()))
+    return match.group('host'), counts
+
+
+def host_failed(counts):
+    return bool(counts.get('failed') or counts.get('unreachable'))
+
+
+class RecapTee(object):
+    """ file-like object passing output on to `stream`, while collecting
+        the counters of every host in the recap(s) it sees
+    """
+
+    def __init__(self, stream=None):
+        # bound now, since the inprocess engine swaps sys.stdout for us
+        self.stream = stream or sys.stdout
+        self.hosts = {}
+        self._in_recap = False
+        self._partial = ''
+
+    def write(self, data):
+        self.stream.write(data)
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._parse(line)
+
+    def _parse(self, line):
+        if RECAP_HEADER in line:
+            self._in_recap = True
+            return
+        if not self._in_recap:
+            return
+        parsed = parse_recap_line(line)
+        if parsed:
+            host, counts = parsed
+            self.hosts[host] = counts
+        elif line.strip():
+            self._in_recap = False
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return getattr(self.stream, 'isatty', lambda: False)()
+
+    def __getattr__(self, name):
+        # the rest of the file interface (buffer, encoding, reconfigure,
+        # which ansible's display uses) is the stream's
+        if name == 'stream':
+            raise AttributeError(name)
+        return getattr(self.stream, name)
+
+    def failed_hosts(self):
+        return sorted(
+            host for host, counts in self.hosts.items()
+            if host_failed(counts))
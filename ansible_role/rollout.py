@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.rollout
+
+    rolling rollouts: hosts are split into waves of --wave-size hosts
+    (a number, or a percentage of all hosts), up to --wave-concurrency
+    waves run at once, and once more than --max-failures hosts (again a
+    number or a percentage) have failed, no further waves are started.
+
+      ansible-role role.name web1,..,web40 --wave-size 25% \\
+          --wave-concurrency 2 --max-failures 1
+"""
+import time
+import threading
+
+from ansible_role.console import WARNING
+
+
+class WaveResult(object):
+    """ outcome of one wave.  waves that never started because the
+        failure budget ran out are `skipped`.
+    """
+
+    def __init__(self, number, hosts, success=False, exit_code=None,
+                 duration=0.0, failed_hosts=(), error=None, skipped=False):
+        self.number = number
+        self.hosts = hosts
+        self.success = success
+        self.exit_code = exit_code
+        self.duration = duration
+        self.failed_hosts = list(failed_hosts)
+        self.error = error
+        self.skipped = skipped
+
+    def as_dict(self):
+        return dict(
+            wave=self.number, hosts=list(self.hosts), success=self.success,
+            exit_code=self.exit_code, duration=self.duration,
+            failed_hosts=self.failed_hosts, skipped=self.skipped,
+            error=str(self.error) if self.error else None)
+
+
+def parse_count(spec, total):
+    """ `spec` is a number of hosts, or a percentage of `total` like
+        '10%'.  percentages round up, so '10%' of 5 hosts is 1 host.
+    """
+    spec = str(spec).strip()
+    if spec.endswith('%'):
+        percent = float(spec[:-1])
+        if not 0 <= percent <= 100:
+            raise ValueError("bad percentage: " + spec)
+        import math
+        return int(math.ceil(total * percent / 100.0))
+    count = int(spec)
+    if count < 0:
+        raise ValueError("bad count: " + spec)
+    return count
+
+
+def make_waves(hosts, wave_size):
+    """ `hosts` split into waves of `wave_size` (see parse_count) """
+    size = max(1, parse_count(wave_size, len(hosts)))
+    return [hosts[i:i + size] for i in range(0, len(hosts), size)]
+
+
+class Rollout(object):
+    """ runs `apply(number, hosts)` for each wave, which returns
+        (success, exit_code, failed_hosts), with at most `concurrency` waves in
+        flight.  once more than `max_failures` hosts failed, the waves
+        that haven't started are skipped.
+    """
+
+    def __init__(self, wave_size, concurrency=1, max_failures=0,
+                 report=None):
+        self.wave_size = wave_size
+        self.concurrency = max(1, concurrency)
+        self.max_failures = max_failures
+        self.report = report or (lambda msg, **kargs: None)
+
+    def run(self, hosts, apply):
+        waves = make_waves(list(hosts), self.wave_size)
+        results = [WaveResult(number, wave, skipped=True)
+                   for number, wave in enumerate(waves, 1)]
+        state = dict(running=0, failed=0, aborted=False,
+                     budget=parse_count(self.max_failures, len(hosts)))
+        condition = threading.Condition()
+
+        def run_wave(result):
+            self._run_wave(result, apply, state, condition)
+
+        concurrency = min(self.concurrency, len(waves))
+        pool = None
+        if concurrency > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(concurrency)
+        try:
+            for result in results:
+                with condition:
+                    while state['running'] >= concurrency and \
+                            not state['aborted']:
+                        condition.wait()
+                    if state['aborted']:
+                        break
+                    state['running'] += 1
+                result.skipped = False
+                if pool is None:
+                    run_wave(result)
+                else:
+                    pool.apply_async(run_wave, (result,))
+            with condition:
+                while state['running']:
+                    condition.wait()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return results
+
+    def _run_wave(self, result, apply, state, condition):
+        """ applies one wave, and counts its failures against the budget
+            in `state`
+        """
+        start = time.time()
+        try:
+            result.success, result.exit_code, failed = \
+                apply(result.number, result.hosts)
+            result.failed_hosts = list(failed)
+        except Exception as exc:
+            result.success, result.exit_code = False, 1
+            result.failed_hosts = list(result.hosts)
+            result.error = exc
+        result.duration = time.time() - start
+        with condition:
+            state['running'] -= 1
+            state['failed'] += len(result.failed_hosts)
+            if state['failed'] > state['budget'] and not state['aborted']:
+                state['aborted'] = True
+                msg = "{0} hosts failed, over the budget of {1}: " \
+                    "no more waves will be started"
+                self.report(msg.format(state['failed'], state['budget']),
+                            level=WARNING)
+            condition.notify_all()
+
+
+def aggregate_exit_code(results):
+    """ 0 when every wave ran and succeeded, else the highest exit code
+        (or 1 when waves were skipped)
+    """
+    codes = [x.exit_code or 1 for x in results
+             if not x.skipped and not x.success]
+    if codes:
+        return max(codes)
+    return 1 if any(x.skipped for x in results) else 0
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.ssh
+
+    persistent SSH connections shared by consecutive ansible-role runs.
+    with --ssh-persist, ansible's ssh connections go through
+    ControlMaster sockets in the ansible-role cache dir, which stay up
+    for --ssh-persist-time seconds after their last use, and modules are
+    pipelined instead of copied.  the next run against the same host
+    skips the handshake.
+
+      ansible-role --ssh-persist role.name hostname
+      ansible-role --connections status
+      ansible-role --connections close
+"""
+import os
+
+from ansible_role import proc
+from ansible_role.util import ensure_dir
+
+CONTROL_DIR = 'cp'
+
+# seconds an idle master connection is kept
+DEFAULT_PERSIST = 600
+
+# socket names show the host, see ssh_config(5) for the tokens
+CONTROL_PATH = '%(directory)s/%%h-%%p-%%r'
+
+
+def get_control_dir(cache_dir=None):
+    from ansible_role.cache import cache_subdir
+    return cache_subdir(cache_dir, CONTROL_DIR)
+
+
+def get_ssh_env(cache_dir=None, persist=DEFAULT_PERSIST, create=True):
+    """ the ansible settings for persistent, pipelined ssh connections.
+        options already in $ANSIBLE_SSH_ARGS come first, so they win.
+        the socket directory is created (or made private) unless
+        `create` is False (e.g. for --plan).
+    """
+    control_dir = get_control_dir(cache_dir)
+    if create:
+        ensure_dir(control_dir)
+        os.chmod(control_dir, 0o700)
+    ssh_args = [
+        os.environ.get('ANSIBLE_SSH_ARGS', ''),
+        '-o ControlMaster=auto',
+        '-o ControlPersist={0}s'.format(int(persist))]
+    return dict(
+        ANSIBLE_SSH_ARGS=' '.join(x for x in ssh_args if x),
+        ANSIBLE_SSH_CONTROL_PATH_DIR=control_dir,
+        ANSIBLE_SSH_CONTROL_PATH=CONTROL_PATH,
+        ANSIBLE_PIPELINING='True')
+
+
+class _Output(object):
+    """ collects a command's output instead of streaming it """
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        self.lines.append(line.strip())
+
+    def flush(self):
+        pass
+
+
+def control_command(socket_path, command):
+    """ runs `ssh -O command` against a master socket.
+        returns (success, output)
+    """
+    output = _Output()
+    # the host is required, but ssh only talks to the socket
+    cmd = ['ssh', '-O', command, '-o', 'ControlPath=' + socket_path,
+           'ansible-role']
+    result = proc.run(cmd, stream=output)
+    return result.succeeded, ' '.join(x for x in output.lines if x)
+
+
+def connections(cache_dir=None):
+    """ the master sockets in the control dir """
+    control_dir = get_control_dir(cache_dir)
+    if not os.path.isdir(control_dir):
+        return []
+    return [os.path.join(control_dir, name)
+            for name in sorted(os.listdir(control_dir))]
+
+
+def manage_connections(command, cache_dir=None, report=None):
+    """ `status` reports every master connection, `close` shuts them
+        down.  sockets whose master is gone are removed either way.
+        returns an exit code.
+    """
+    report = report or (lambda msg: None)
+    sockets = connections(cache_dir)
+    if not sockets:
+        report("no persistent connections in {0}".format(
+            get_control_dir(cache_dir)))
+    for socket_path in sockets:
+        name = os.path.basename(socket_path)
+        alive, output = control_command(socket_path, 'check')
+        if not alive:
+            report("{0}: stale, removing".format(name))
+            os.unlink(socket_path)
+        elif command == 'close':
+            closed, output = control_command(socket_path, 'exit')
+            report("{0}: {1}".format(name, 'closed' if closed else output))
+        else:
+            report("{0}: {1}".format(name, output))
+    return 0
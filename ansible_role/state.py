@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.state
+
+    the state store behind --skip-unchanged: after a successful run,
+    the fingerprint of what was applied (role content, host and
+    ansible-playbook arguments) is stored per host.  a later run with
+    the same fingerprint within the TTL is skipped, since it could only
+    re-apply what is already there.
+
+    the store is one small JSON file per host, in $cache_dir/state,
+    plus a snapshot of the applied roles per host for --changed-only.
+"""
+import os
+import time
+
+from ansible_role.util import ensure_dir
+
+STATE_DIR = 'state'
+
+# per-host snapshots of the role-dir, for --changed-only
+SNAPSHOT_SUFFIX = '.files.json'
+
+# seconds after which a host is converged again even if nothing changed,
+# to catch drift made outside of ansible-role
+DEFAULT_TTL = 86400
+
+# arguments that make ansible-playbook change nothing
+NO_CHANGE_ARGS = ('--check', '-C', '--syntax-check', '--list-tasks',
+                  '--list-hosts', '--list-tags')
+
+
+def content_hashes(role_dir, role_names):
+    """ [role-name, content-hash] for the roles in `role_names` and the
+        dependencies they pull in.  roles that ansible-role installed
+        itself use the hash in the role-dir's index, as long as their
+        stamp matches; roles found on disk (which are the ones people
+        edit) are hashed in full.
+    """
+    from ansible_role import index
+    from ansible_role.deps import role_closure
+    role_index = index.RoleIndex(role_dir)
+    hashes = []
+    for name in role_closure(role_dir, role_names):
+        entry = role_index.get(name) or {}
+        if entry.get('source') == 'galaxy' and \
+                role_index.check(name) == index.INSTALLED:
+            hashes.append([name, entry['hash']])
+        else:
+            hashes.append(
+                [name, index.hash_tree(os.path.join(role_dir, name))])
+    return hashes
+
+
+def options_list(play_options):
+    """ the play options (see ansible_role.playbooks) in the form they
+        are stored in, for comparisons with stored ones
+    """
+    from ansible_role.playbooks import options_key
+    return [list(x) for x in options_key(play_options)]
+
+
+def fingerprint(content, role_names, host, ansible_args, play_options=None):
+    """ sha256 over the roles applied, their content_hashes, the host,
+        the ansible-playbook arguments as they'd be quoted for the shell
+        and the play options
+    """
+    import json
+    import hashlib
+    from ansible_role import escape_args
+    data = dict(
+        roles=list(role_names), content=content, host=host,
+        args=' '.join(escape_args(ansible_args)))
+    options = options_list(play_options)
+    if options:
+        # without options, fingerprints stay what they were before
+        data['options'] = options
+    data = json.dumps(data, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def changes_nothing(ansible_args):
+    """ True for runs that can't converge a host """
+    return any(arg in NO_CHANGE_ARGS for arg in ansible_args)
+
+
+class StateStore(object):
+    """ the last successful fingerprint of each host """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL):
+        from ansible_role.cache import cache_subdir
+        self.state_dir = cache_subdir(cache_dir, STATE_DIR)
+        self.ttl = ttl
+        self._content = {}
+        self._files = {}
+
+    def fingerprint(self, role_dir, role_names, host, ansible_args,
+                    play_options=None):
+        """ like fingerprint(), hashing the roles once per store """
+        key = (role_dir, tuple(role_names))
+        if key not in self._content:
+            self._content[key] = content_hashes(role_dir, role_names)
+        return fingerprint(
+            self._content[key], role_names, host, ansible_args,
+            play_options)
+
+    def role_files(self, role_dir, role_names):
+        """ changes.file_hashes, computed once per store """
+        key = (role_dir, tuple(role_names))
+        if key not in self._files:
+            from ansible_role.changes import file_hashes
+            self._files[key] = file_hashes(role_dir, role_names)
+        return self._files[key]
+
+    def path(self, host, suffix='.json'):
+        import hashlib
+        digest = hashlib.sha256(host.encode('utf-8')).hexdigest()[:16]
+        safe_host = ''.join(x if x.isalnum() or x in '.-' else '_'
+                            for x in host)[:64]
+        return os.path.join(
+            self.state_dir, '{0}-{1}{2}'.format(safe_host, digest, suffix))
+
+    def get(self, host, suffix='.json'):
+        """ {fingerprint, applied} for `host`, or None """
+        import json
+        try:
+            with open(self.path(host, suffix)) as fhandle:
+                return json.load(fhandle)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _put(self, host, data, suffix='.json'):
+        import json
+        ensure_dir(self.state_dir)
+        path = self.path(host, suffix)
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as fhandle:
+            json.dump(data, fhandle)
+        os.rename(tmp_path, path)
+
+    def unchanged(self, host, fingerprint):
+        """ the time `host` was last converged with `fingerprint`, if that
+            was within the TTL, else None
+        """
+        state = self.get(host)
+        if not state or state.get('fingerprint') != fingerprint:
+            return None
+        if time.time() - state.get('applied', 0) > self.ttl:
+            return None
+        return state['applied']
+
+    def record(self, host, fingerprint):
+        self._put(host, dict(
+            host=host, fingerprint=fingerprint, applied=time.time()))
+
+    def snapshot(self, host):
+        """ {files, args, options, applied} of the last successful run
+            on `host`
+            (see ansible_role.changes), or None
+        """
+        return self.get(host, SNAPSHOT_SUFFIX)
+
+    def record_snapshot(self, host, files, ansible_args, play_options=None):
+        self._put(host, dict(
+            host=host, files=files, args=list(ansible_args),
+            options=options_list(play_options),
+            applied=time.time()), SNAPSHOT_SUFFIX)
+
+    def forget(self, host):
+        try:
+            os.unlink(self.path(host))
+        except OSError:
+            pass
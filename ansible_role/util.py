@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+""" ansible_role.util
+
+    small filesystem helpers shared by the cache and role-dir code
+"""
+import os
+import errno
+
+# temporary directories that installs are staged in, next to their target
+STAGING_PREFIX = '.staging-'
+
+
+def ensure_dir(path):
+    """ `mkdir -p`, without the race against other processes
+        creating the same directory at the same time
+    """
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+    return path
+
+
+def move_into_place(src, dst):
+    """ renames the finished directory `src` to `dst`, so that other
+        processes see either no `dst` or a complete one.  an existing
+        `dst` is replaced.  both must be on the same filesystem.
+    """
+    old = None
+    if os.path.lexists(dst):
+        old = src + '.old'
+        os.rename(dst, old)
+    os.rename(src, dst)
+    if old is None:
+        return
+    if os.path.isdir(old) and not os.path.islink(old):
+        import shutil
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.remove(old)
+
+
+def is_scm_source(src):
+    """ True for role sources that ansible-galaxy fetches from a url or
+        an scm repository, e.g. 'git+https://github.com/user/repo.git'
+    """
+    return '://' in src or src.startswith('git@')
+
+
+def split_role_spec(role_spec):
+    """ splits a galaxy role spec like 'user.role,v1.0' into
+        ('user.role', 'v1.0').  version is None when not pinned.  specs
+        in ansible-galaxy's 'src,version,name' form give the name the
+        role is installed as; for urls without one, that's the name of
+        the repository (or archive).
+    """
+    parts = [x.strip() for x in role_spec.split(',')]
+    name = parts[0]
+    version = parts[1] if len(parts) > 1 and parts[1] else None
+    if len(parts) > 2 and parts[2]:
+        name = parts[2]
+    elif is_scm_source(name):
+        name = name.rstrip('/').split('/')[-1].split(':')[-1]
+        for suffix in ('.git', '.tar.gz'):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+    return name, version
+
+
+def read_list_file(path):
+    """ reads a file with one item per line.  blank lines are skipped
+        and '#' starts a comment.
+    """
+    with open(path) as fhandle:
+        lines = [line.split('#')[0].strip() for line in fhandle]
+    return [line for line in lines if line]
+
+
+def tree_size(path):
+    """ total size in bytes of the regular files below `path` """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for fname in files:
+            fpath = os.path.join(root, fname)
+            if not os.path.islink(fpath):
+                total += os.path.getsize(fpath)
+    return total
+
+
+def link_tree(src, dst):
+    """ recreate the directory tree at `src` under `dst`, hardlinking
+        the files.  falls back to copying when `src` and `dst` are on
+        different filesystems.
+    """
+    ensure_dir(dst)
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.islink(src_path):
+            os.symlink(os.readlink(src_path), dst_path)
+        elif os.path.isdir(src_path):
+            link_tree(src_path, dst_path)
+        else:
+            try:
+                os.link(src_path, dst_path)
+            except OSError:
+                import shutil
+                shutil.copy2(src_path, dst_path)
@@ -34,14 +34,13 @@ setup(
     author_email='$author@gmail',
     url=base_url,
     download_url=base_url + '/tarball/master',
-    packages=['ansible_role'],
+    packages=['ansible_role', 'ansible_role.callback_plugins'],
     keywords=['ansible', 'role', 'devops'],
     entry_points={
         'console_scripts':
         ['ansible-role = ansible_role:entry', ]},
     install_requires=[
         'shellescape==3.4.1',
-        "Fabric",
     ],
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -52,6 +51,7 @@ setup(
         'Natural Language :: English',
         'Operating System :: POSIX',
         'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
         'Topic :: System :: Installation/Setup',
         'Topic :: System :: Systems Administration',
         'Topic :: Utilities',
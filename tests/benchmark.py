@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+""" tests.benchmark
+
+    benchmarks for applying roles end to end, with synthetic local roles,
+    hosts that use the `local` connection, and no galaxy:
+
+      role_apply            one role on one host, through role_apply
+      role_apply_inprocess  the same, with --engine=inprocess
+      raw_playbook          the same play, straight from ansible-playbook
+      roles_throughput      --roles roles applied by one role_apply
+      hosts_throughput      one role on --hosts hosts, --workers at once
+
+    role_apply results include the time of each ansible-role phase, and
+    the overhead of ansible-role over raw_playbook.  results are written
+    as JSON, and compared against a baseline from an earlier run:
+
+      python -m tests.benchmark --output now.json --save-baseline base.json
+      python -m tests.benchmark --baseline base.json [--tolerance 0.25]
+
+    exits with 1 when a benchmark got slower than the baseline allows.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+
+from .backports import TemporaryDirectory
+
+BENCHMARKS = (
+    'role_apply', 'role_apply_inprocess', 'raw_playbook',
+    'roles_throughput', 'hosts_throughput',
+)
+DEFAULT_REPEAT = 3
+DEFAULT_ROLES = 5
+DEFAULT_HOSTS = 5
+DEFAULT_WORKERS = 5
+
+# how much slower than the baseline a benchmark may get
+DEFAULT_TOLERANCE = 0.25
+
+
+def make_roles(module_path, count, tasks=3):
+    """ `count` roles of `tasks` debug tasks each, named local.bench<N> """
+    names = []
+    for number in range(count):
+        name = 'local.bench{0}'.format(number)
+        role_tasks = os.path.join(module_path, 'roles', name, 'tasks')
+        os.makedirs(role_tasks)
+        with open(os.path.join(role_tasks, 'main.yml'), 'w') as fhandle:
+            for task in range(tasks):
+                fhandle.write('- name: task {0}\n  debug: msg={1}\n'.format(
+                    task, name))
+        names.append(name)
+    return names
+
+
+def make_inventory(path, count):
+    """ an inventory of `count` hosts that all run locally """
+    hosts = ['bench-host-{0}'.format(number) for number in range(count)]
+    with open(path, 'w') as fhandle:
+        for host in hosts:
+            fhandle.write(
+                '{0} ansible_connection=local '
+                'ansible_python_interpreter={1}\n'.format(
+                    host, sys.executable))
+    return hosts
+
+
+def timed(func, repeat):
+    """ runs `func` `repeat` times; returns timing stats and the last
+        result of `func`
+    """
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        samples.append(time.time() - start)
+    ordered = sorted(samples)
+    stats = dict(
+        samples=samples, min=ordered[0],
+        median=ordered[len(ordered) // 2],
+        mean=sum(samples) / len(samples))
+    return stats, result
+
+
+class Bench(object):
+    """ the fixtures shared by all benchmarks, in `work_dir` """
+
+    def __init__(self, work_dir, roles=DEFAULT_ROLES, hosts=DEFAULT_HOSTS,
+                 workers=DEFAULT_WORKERS):
+        self.module_path = os.path.join(work_dir, 'module-path')
+        self.roles = make_roles(self.module_path, max(1, roles))
+        self.inventory = os.path.join(work_dir, 'inventory.ini')
+        self.hosts = make_inventory(self.inventory, max(1, hosts))
+        self.workers = workers
+        self.work_dir = work_dir
+
+    def apply(self, role_name, hosts, engine='subprocess'):
+        """ role_apply like `ansible-role` runs it; returns the phases """
+        import ansible_role
+        from ansible_role import metrics
+        run_metrics = metrics.reset()
+        with run_metrics.phase('total'):
+            success, exit_code = ansible_role.role_apply(
+                role_name=role_name, hosts=hosts,
+                module_path=self.module_path,
+                extra_ansible_args=['-i', self.inventory],
+                workers=self.workers, engine=engine)
+        assert exit_code == 0, "benchmark run failed"
+        return dict(
+            (name, phase['seconds'])
+            for name, phase in run_metrics.as_dict()['phases'].items())
+
+    def run(self, name, repeat):
+        return getattr(self, 'bench_' + name)(repeat)
+
+    def _latency(self, repeat, engine):
+        stats, phases = timed(
+            lambda: self.apply(self.roles[0], self.hosts[0], engine), repeat)
+        stats['phases'] = phases
+        stats['overhead'] = phases['total'] - phases.get('apply', 0.0)
+        return stats
+
+    def bench_role_apply(self, repeat):
+        return self._latency(repeat, 'subprocess')
+
+    def bench_role_apply_inprocess(self, repeat):
+        return self._latency(repeat, 'inprocess')
+
+    def bench_raw_playbook(self, repeat):
+        import ansible_role
+        role_dir = os.path.join(self.module_path, 'roles')
+        playbook = os.path.join(self.work_dir, 'raw.yml')
+        with open(playbook, 'w') as fhandle:
+            fhandle.write(ansible_role.get_playbook_for_role(
+                self.roles[0], role_dir, hosts=self.hosts[0],
+                report=lambda msg, **kargs: None))
+        cmd = ['ansible-playbook', playbook, '-i', self.inventory]
+        stats, _ = timed(lambda: subprocess.check_call(cmd), repeat)
+        return stats
+
+    def bench_roles_throughput(self, repeat):
+        stats, _ = timed(
+            lambda: self.apply(self.roles, self.hosts[0]), repeat)
+        stats['per_second'] = len(self.roles) / stats['median']
+        return stats
+
+    def bench_hosts_throughput(self, repeat):
+        stats, _ = timed(
+            lambda: self.apply(self.roles[0], self.hosts), repeat)
+        stats['per_second'] = len(self.hosts) / stats['median']
+        return stats
+
+
+def run_benchmarks(names=BENCHMARKS, repeat=DEFAULT_REPEAT,
+                   roles=DEFAULT_ROLES, hosts=DEFAULT_HOSTS,
+                   workers=DEFAULT_WORKERS):
+    """ the results of the benchmarks in `names`, as a JSON-able dict """
+    from ansible_role.version import __version__
+    results = {}
+    with TemporaryDirectory() as work_dir:
+        bench = Bench(work_dir, roles=roles, hosts=hosts, workers=workers)
+        for name in names:
+            results[name] = bench.run(name, repeat)
+    if 'role_apply' in results and 'raw_playbook' in results:
+        results['role_apply']['overhead_vs_raw'] = \
+            results['role_apply']['median'] - \
+            results['raw_playbook']['median']
+    return dict(
+        version=str(__version__), python=platform.python_version(),
+        platform=platform.platform(), started=time.time(),
+        params=dict(repeat=repeat, roles=roles, hosts=hosts,
+                    workers=workers),
+        results=results)
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ [(benchmark, baseline-median, current-median)] for benchmarks
+        more than `tolerance` (a fraction) slower than in `baseline`
+    """
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        if result['median'] > old['median'] * (1 + tolerance):
+            regressions.append((name, old['median'], result['median']))
+    return regressions
+
+
+def format_results(current):
+    lines = []
+    for name, result in sorted(current['results'].items()):
+        line = '{0:22} median {1:7.3f}s  min {2:7.3f}s'.format(
+            name, result['median'], result['min'])
+        if 'per_second' in result:
+            line += '  {0:6.2f}/s'.format(result['per_second'])
+        if 'overhead' in result:
+            line += '  ansible-role overhead {0:.3f}s'.format(
+                result['overhead'])
+        lines.append(line)
+    return lines
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m tests.benchmark')
+    parser.add_argument('names', nargs='*',)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,)
+    parser.add_argument('--roles', type=int, default=DEFAULT_ROLES,)
+    parser.add_argument('--hosts', type=int, default=DEFAULT_HOSTS,)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,)
+    parser.add_argument('--output',)
+    parser.add_argument('--baseline',)
+    parser.add_argument('--save-baseline',)
+    parser.add_argument(
+        '--tolerance', type=float, default=DEFAULT_TOLERANCE,)
+    return parser
+
+
+def main(args=None):
+    parser = get_parser()
+    prog_args = parser.parse_args(args)
+    unknown = [x for x in prog_args.names if x not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmarks: ' + ', '.join(unknown))
+    current = run_benchmarks(
+        names=prog_args.names or BENCHMARKS, repeat=prog_args.repeat,
+        roles=prog_args.roles, hosts=prog_args.hosts,
+        workers=prog_args.workers)
+    for line in format_results(current):
+        print(line)
+    for path in (prog_args.output, prog_args.save_baseline):
+        if path:
+            with open(path, 'w') as fhandle:
+                json.dump(current, fhandle, indent=2, sort_keys=True)
+    if not prog_args.baseline:
+        return 0
+    with open(prog_args.baseline) as fhandle:
+        baseline = json.load(fhandle)
+    regressions = compare(current, baseline, prog_args.tolerance)
+    for name, old, new in regressions:
+        print('REGRESSION {0}: {1:.3f}s -> {2:.3f}s'.format(name, old, new))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
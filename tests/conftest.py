@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+""" tests.conftest
+"""
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    """ keeps the tests (and the processes they start) out of the real
+        cache dir, and their runs out of its history
+    """
+    monkeypatch.setenv('ANSIBLE_ROLE_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setenv('ANSIBLE_ROLE_HISTORY', '0')
+    return str(tmpdir.join('cache'))
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+""" tests.galaxy
+
+    a stand-in galaxy server answering the requests `ansible-galaxy
+    install` makes for roles, from canned role content, so downloads can
+    be tested and timed offline:
+
+        with CannedGalaxy({'user.role': '- debug: msg=hi\\n'}) as galaxy:
+            env = dict(ANSIBLE_GALAXY_SERVER=galaxy.url)
+"""
+import io
+import json
+import tarfile
+import hashlib
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+VERSION = '1.0.0'
+
+
+def make_archive(name, tasks, version=VERSION):
+    """ a role tarball like the ones github serves for galaxy roles """
+    user, role = name.split('.', 1)
+    files = {
+        'meta/main.yml': 'galaxy_info:\n  author: {0}\ndependencies: []\n'
+                         .format(user),
+        'tasks/main.yml': tasks,
+    }
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as archive:
+        for path, content in sorted(files.items()):
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo('{0}-{1}/{2}'.format(role, version, path))
+            info.size = len(data)
+            info.mtime = 0
+            archive.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class CannedGalaxy(object):
+    """ serves `roles` ({user.role: tasks-yaml}) on a free local port.
+        `requests` lists (path, status) for everything it answered.
+    """
+
+    def __init__(self, roles):
+        self.roles = sorted(roles.items())
+        self.requests = []
+        self.server = None
+        self.url = None
+
+    def answer(self, path, base_url):
+        parsed = urlparse(path)
+        query = parse_qs(parsed.query)
+        parts = [x for x in parsed.path.split('/') if x]
+        if parts == ['api']:
+            return json.dumps(dict(available_versions={'v1': 'v1/'}))
+        if parts == ['api', 'v1', 'roles']:
+            name = '{0}.{1}'.format(
+                query.get('owner__username', [''])[0],
+                query.get('name', [''])[0])
+            results = [
+                dict(id=number, name=role_name.split('.', 1)[1],
+                     github_user=role_name.split('.', 1)[0],
+                     github_repo=role_name.split('.', 1)[1])
+                for number, (role_name, _) in enumerate(self.roles, 1)
+                if role_name == name]
+            return json.dumps(dict(results=results))
+        if parts[:3] == ['api', 'v1', 'roles'] and parts[4:] == ['versions']:
+            number = int(parts[3])
+            if not 0 < number <= len(self.roles):
+                return None
+            download_url = '{0}/archives/{1}'.format(
+                base_url, self.roles[number - 1][0])
+            return json.dumps(dict(
+                results=[dict(name=VERSION, download_url=download_url)],
+                next_link=None))
+        if parts[:1] == ['archives'] and len(parts) == 2:
+            tasks = dict(self.roles).get(parts[1])
+            if tasks is not None:
+                return make_archive(parts[1], tasks)
+        return None
+
+    def __enter__(self):
+        galaxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                base_url = 'http://' + self.headers.get('Host')
+                body = galaxy.answer(self.path, base_url)
+                if body is None:
+                    galaxy.requests.append((self.path, 404))
+                    self.send_error(404)
+                    return
+                if not isinstance(body, bytes):
+                    body = body.encode('utf-8')
+                etag = '"{0}"'.format(hashlib.sha256(body).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    galaxy.requests.append((self.path, 304))
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                galaxy.requests.append((self.path, 200))
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Type', 'application/json'
+                                 if body[:1] == b'{' else
+                                 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, exc, value, tb):
+        self.server.shutdown()
+        self.server.server_close()
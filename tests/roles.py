@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+""" tests.roles
+
+    roles written to disk for the tests
+"""
+
+import os
+
+TASKS = '- debug: msg=hello\n'
+
+
+def make_role(role_dir, name, tasks=TASKS, files=None, version=None):
+    """ writes the role `name` into `role_dir`, with `tasks` as its
+        tasks/main.yml and `files` ({relative-path: content}) next to
+        it.  a `version` is recorded the way ansible-galaxy does.
+        returns the path of the role.
+    """
+    role_path = os.path.join(role_dir, name)
+    files = dict(files or {})
+    files.setdefault('tasks/main.yml', tasks)
+    if version:
+        files['meta/.galaxy_install_info'] = \
+            'install_date: today\nversion: {0}\n'.format(version)
+    for rel_path, content in files.items():
+        path = os.path.join(role_path, *rel_path.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fhandle:
+            fhandle.write(content)
+    return role_path
@@ -6,13 +6,15 @@ import os
 import mock
 import pytest
 
-from fabric import api
 from argparse import ArgumentParser
 
 from .backports import TemporaryDirectory
+from .roles import make_role
 from ansible_role import (
     role_apply, entry, report, get_parser,
-    require_ansible_role,)
+    require_ansible_role, split_positionals,
+    get_playbook_for_role, apply_ansible_role_to_stream,
+    galaxy_install, playbooks, proc,)
 
 
 def test_get_parser():
@@ -20,15 +22,72 @@ def test_get_parser():
     assert type(parser) == ArgumentParser
 
 
+def fake_galaxy(cmd):
+    make_role(cmd[4], cmd[-1])
+    return mock.Mock(succeeded=True)
+
+
 def test_require_ansible_role_good_val():
     role_name = 'role.name'
-    with mock.patch("fabric.api.local") as fake:
+    with mock.patch("ansible_role.proc.run",
+                    side_effect=fake_galaxy) as fake:
         with TemporaryDirectory() as tmp_dir:
             require_ansible_role(
                 role_name, tmp_dir, report=report)
-        cmd = 'ansible-galaxy install -p {0} {1}'
-        cmd = cmd.format(tmp_dir, role_name)
-        fake.assert_called_with(cmd)
+        cmd = fake.call_args[0][0]
+        assert cmd[:4] == ['ansible-galaxy', 'install', '--no-deps', '-p']
+        assert cmd[5:] == [role_name]
+        # roles are downloaded next to the role-dir, then moved into it
+        assert os.path.dirname(cmd[4]) == tmp_dir
+        assert os.path.basename(cmd[4]).startswith('.staging-')
+
+
+def test_concurrent_galaxy_installs():
+    import time
+    import threading
+    downloads = []
+
+    def fake_galaxy(cmd):
+        downloads.append(cmd[-1])
+        tasks = os.path.join(cmd[4], cmd[-1], 'tasks')
+        os.makedirs(tasks)
+        time.sleep(0.2)
+        with open(os.path.join(tasks, 'main.yml'), 'w') as fh:
+            fh.write('- debug: msg=hello\n')
+        return mock.Mock(succeeded=True)
+    with TemporaryDirectory() as role_dir:
+        seen = []
+
+        def watch():
+            # the role only ever shows up complete
+            for _ in range(40):
+                path = os.path.join(role_dir, 'user.role')
+                if os.path.isdir(path):
+                    seen.append(os.listdir(os.path.join(path, 'tasks')))
+                time.sleep(0.01)
+        with mock.patch("ansible_role.proc.run", side_effect=fake_galaxy):
+            threads = [threading.Thread(target=watch)] + [
+                threading.Thread(target=galaxy_install,
+                                 args=('user.role', role_dir))
+                for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert downloads == ['user.role']
+        assert seen and all(x == ['main.yml'] for x in seen)
+        assert sorted(os.listdir(role_dir)) == [
+            '.ansible-role-index.json', '.ansible-role-index.json.lock',
+            '.locks', 'user.role']
+
+
+def test_galaxy_install_without_the_role():
+    with mock.patch("ansible_role.proc.run") as fake:
+        fake.return_value = mock.Mock(succeeded=True)
+        with TemporaryDirectory() as role_dir:
+            with pytest.raises(RuntimeError):
+                galaxy_install('user.role', role_dir)
+            assert not os.path.exists(os.path.join(role_dir, 'user.role'))
 
 
 @mock.patch("ansible_role.apply_ansible_role")
@@ -47,4 +106,75 @@ def test_help(aar):
         os.path.join(tmp_dir, 'roles'),
         ansible_args=ansible_args,
         hosts='localhost',
+        galaxy_workers=4,
+        engine='subprocess',
+        env=None,
+        state=None,
+        snapshots=None,
+        play_options=None,
+        playbook_store=playbooks.get_store(),
         report=report)
+
+
+@mock.patch("ansible_role.proc.run")
+def test_failed_install_exits_1(run):
+    run.return_value = proc.ProcessResult(['ansible-galaxy'], 1)
+    with TemporaryDirectory() as tmp_dir:
+        with pytest.raises(SystemExit) as exc:
+            entry(['user.missing', '--module-path', tmp_dir,
+                   '--no-history'])
+    assert exc.value.code == 1
+
+
+def test_split_positionals():
+    assert split_positionals(['role.a']) == (['role.a'], None)
+    assert split_positionals(['role.a', 'host']) == (['role.a'], 'host')
+    assert split_positionals(['role.a', 'role.b', 'host']) == \
+        (['role.a', 'role.b'], 'host')
+    with TemporaryDirectory() as tmp_dir:
+        roles_file = os.path.join(tmp_dir, 'roles')
+        with open(roles_file, 'w') as fhandle:
+            fhandle.write('role.a\nrole.b,v1  # pinned\n')
+        assert split_positionals([], roles_file) == \
+            (['role.a', 'role.b,v1'], None)
+        assert split_positionals(['role.c', 'host'], roles_file) == \
+            (['role.a', 'role.b,v1', 'role.c'], 'host')
+
+
+def test_get_playbook_for_roles():
+    playbook = get_playbook_for_role(
+        ['role.a', 'role.b,v1'], '/roles', hosts='web')
+    assert playbook.splitlines() == [
+        '- hosts: web',
+        '  roles:',
+        '  - {role: /roles/role.a}',
+        '  - {role: /roles/role.b}',
+    ]
+
+
+def test_get_playbook_quotes_host_templates():
+    playbook = get_playbook_for_role(
+        'role.a', '/roles', hosts='{{ target }}')
+    assert playbook.splitlines()[0] == '- hosts: "{{ target }}"'
+
+
+@mock.patch("ansible_role.run_ansible_playbook")
+def test_apply_to_stream(rap):
+    inventories = []
+
+    def fake_run(playbook, ansible_args, **kargs):
+        with open(ansible_args[ansible_args.index('-i') + 1]) as fh:
+            inventories.append(fh.read().split())
+        return True, 0
+    rap.side_effect = fake_run
+    hosts = ('host{0}'.format(i) for i in range(5))
+    with TemporaryDirectory() as tmp_dir:
+        make_role(tmp_dir, 'role.name')
+        assert apply_ansible_role_to_stream(
+            'role.name', tmp_dir, hosts, batch_size=2,
+            report=lambda msg, **kargs: None) == (True, 0)
+    assert inventories == [
+        ['[ansible_role_batch]', 'host0', 'host1'],
+        ['[ansible_role_batch]', 'host2', 'host3'],
+        ['[ansible_role_batch]', 'host4']]
+    assert rap.call_args[0][1][-2:] == ['--forks', '1']
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+""" tests.test_benchmark
+"""
+
+import pytest
+
+from . import benchmark
+
+
+def result(median, **kargs):
+    kargs.update(median=median, min=median)
+    return kargs
+
+
+def test_compare_and_format():
+    baseline = dict(results=dict(
+        role_apply=result(1.0), raw_playbook=result(1.0)))
+    current = dict(results=dict(
+        role_apply=result(1.2, overhead=0.1),
+        raw_playbook=result(1.5),
+        hosts_throughput=result(2.0, per_second=2.5)))
+    assert benchmark.compare(current, baseline) == [
+        ('raw_playbook', 1.0, 1.5)]
+    assert benchmark.compare(current, baseline, tolerance=0.1) == [
+        ('raw_playbook', 1.0, 1.5), ('role_apply', 1.0, 1.2)]
+    lines = benchmark.format_results(current)
+    assert lines[0].split()[-1] == '2.50/s'
+    assert lines[2].split()[-1] == '0.100s'
+
+
+def test_unknown_benchmark():
+    with pytest.raises(SystemExit):
+        benchmark.main(['no_such_benchmark'])
+
+
+def has_playbook():
+    try:
+        from shutil import which
+    except ImportError:
+        from distutils.spawn import find_executable as which
+    return which('ansible-playbook') is not None
+
+
+@pytest.mark.skipif(not has_playbook(), reason="needs ansible-playbook")
+def test_role_apply_benchmark():
+    current = benchmark.run_benchmarks(
+        ['role_apply_inprocess'], repeat=1, roles=1, hosts=1)
+    stats = current['results']['role_apply_inprocess']
+    assert stats['samples'] and stats['median'] > 0
+    assert stats['phases']['apply'] <= stats['phases']['total']
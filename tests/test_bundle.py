@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+""" tests.test_bundle
+"""
+
+import os
+import io
+import tarfile
+
+import pytest
+
+from .backports import TemporaryDirectory
+from .roles import make_role
+from ansible_role import bundle, index
+
+
+def fake_install(role_spec, role_dir):
+    """ stands in for install_ansible_role: one role with one dependency """
+    graph = {role_spec: ['dep.role'], 'dep.role': []}
+    for name in graph:
+        make_role(role_dir, name, '- debug: msg={0}\n'.format(name))
+        index.RoleIndex(role_dir).record(name, source='galaxy')
+    return graph
+
+
+def test_bundle_roundtrip():
+    with TemporaryDirectory() as tmp_dir:
+        output = os.path.join(tmp_dir, 'roles.tar.gz')
+        bundle.create_bundle(['some.role'], output, install=fake_install)
+        manifest = bundle.read_manifest(output)
+        assert manifest['requested'] == ['some.role']
+        assert manifest['roles']['some.role']['dependencies'] == \
+            ['dep.role']
+        assert bundle.requested_roles(manifest) == ['some.role']
+        role_dir = os.path.join(tmp_dir, 'roles')
+        os.makedirs(role_dir)
+        bundle.extract_bundle(output, role_dir)
+        role_index = index.RoleIndex(role_dir)
+        for name in ('some.role', 'dep.role'):
+            assert role_index.check(name) == index.INSTALLED
+            assert role_index.verify(name)
+            assert role_index.get(name)['source'] == 'galaxy'
+
+
+def test_bundle_format():
+    with pytest.raises(bundle.BundleError):
+        bundle.get_compression('roles.zip')
+    assert bundle.get_compression('roles.tgz') == 'gz'
+    assert bundle.get_compression('roles.tar') == ''
+
+
+def test_extract_refuses_traversal():
+    with TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'evil.tar')
+        with tarfile.open(path, 'w') as archive:
+            for name, data in [(bundle.MANIFEST, b'{"roles": {}}'),
+                               ('roles/../../escaped', b'')]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        role_dir = os.path.join(tmp_dir, 'roles')
+        os.makedirs(role_dir)
+        with pytest.raises(bundle.BundleError):
+            bundle.extract_bundle(path, role_dir)
+        assert not os.path.exists(os.path.join(tmp_dir, 'escaped'))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+""" tests.test_cache
+"""
+
+import os
+import json
+import time
+import fcntl
+
+from .backports import TemporaryDirectory
+from ansible_role.cache import RoleCache, split_role_spec
+
+
+def fake_install(role_spec, role_dir):
+    name, version = split_role_spec(role_spec)
+    os.makedirs(os.path.join(role_dir, name, 'tasks'))
+    with open(os.path.join(role_dir, name, 'tasks', 'main.yml'), 'w') as fh:
+        fh.write('- debug: msg={0}\n'.format(version))
+
+
+def test_split_role_spec():
+    assert split_role_spec('user.role') == ('user.role', None)
+    assert split_role_spec('user.role,v1.0') == ('user.role', 'v1.0')
+
+
+def test_fetch_miss_then_hit():
+    calls = []
+
+    def install(role_spec, role_dir):
+        calls.append(role_spec)
+        fake_install(role_spec, role_dir)
+    with TemporaryDirectory() as cache_dir:
+        cache = RoleCache(cache_dir=cache_dir, report=lambda msg: None)
+        for attempt in range(2):
+            with TemporaryDirectory() as role_dir:
+                hit = cache.fetch('user.role', role_dir, install)
+                assert hit == bool(attempt)
+                assert os.path.exists(
+                    os.path.join(role_dir, 'user.role', 'tasks', 'main.yml'))
+        assert calls == ['user.role']
+
+
+def test_installs_dont_hold_the_cache_lock():
+    locked = []
+
+    def install(role_spec, role_dir):
+        fd = os.open(cache.lock_path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            locked.append(role_spec)
+        finally:
+            os.close(fd)
+        fake_install(role_spec, role_dir)
+    with TemporaryDirectory() as cache_dir:
+        cache = RoleCache(cache_dir=cache_dir, max_age=60,
+                          report=lambda msg: None)
+        with TemporaryDirectory() as role_dir:
+            cache.fetch('user.role', role_dir, install)
+            # the per-entry locks are no cache entry to evict
+            cache.evict()
+            assert os.path.isdir(os.path.join(cache.entries_dir, '.locks'))
+        assert locked == []
+        assert cache.lookup('user.role') is not None
+
+
+def test_versions_are_cached_separately():
+    with TemporaryDirectory() as cache_dir:
+        cache = RoleCache(cache_dir=cache_dir, report=lambda msg: None)
+        assert cache.key('user.role') != cache.key('user.role,v1.0')
+
+
+def test_evict_by_size_and_age():
+    with TemporaryDirectory() as cache_dir:
+        cache = RoleCache(cache_dir=cache_dir, max_size=1,
+                          report=lambda msg: None)
+        with TemporaryDirectory() as role_dir:
+            cache.fetch('user.one', role_dir, fake_install)
+            old = cache.lookup('user.one')
+            stale = time.time() - 60
+            os.utime(os.path.join(old, 'entry.json'), (stale, stale))
+            cache.fetch('user.two', role_dir, fake_install)
+        assert cache.lookup('user.one') is None
+        assert cache.lookup('user.two') is not None
+
+
+def test_unpinned_entries_expire_while_in_use():
+    with TemporaryDirectory() as cache_dir:
+        cache = RoleCache(cache_dir=cache_dir, max_age=60,
+                          report=lambda msg: None)
+        with TemporaryDirectory() as role_dir:
+            for role_spec in ('user.role', 'user.role,v1.0'):
+                cache.fetch(role_spec, role_dir, fake_install)
+                entry_file = os.path.join(
+                    cache.lookup(role_spec), 'entry.json')
+                with open(entry_file) as fh:
+                    metadata = json.load(fh)
+                metadata['created'] -= 120
+                with open(entry_file, 'w') as fh:
+                    json.dump(metadata, fh)
+        # recently used, but only the pinned version is still good
+        assert cache.lookup('user.role') is None
+        assert cache.lookup('user.role,v1.0') is not None
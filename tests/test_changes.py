@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+""" tests.test_changes
+"""
+
+from .backports import TemporaryDirectory
+from .roles import make_role
+from ansible_role import changes
+
+MAIN = """
+- name: first
+  debug: msg=one
+- import_tasks: imported.yml
+- name: include
+  include_tasks: included.yml
+- name: render
+  template: src=greeting.j2 dest=/tmp/greeting
+- debug: msg=unnamed
+"""
+
+
+FILES = {
+    'tasks/imported.yml': '- name: imported\n  debug: msg=two\n',
+    'tasks/included.yml': '- name: included\n  debug: msg=three\n',
+    'templates/greeting.j2': 'hi\n',
+    'defaults/main.yml': 'x: 1\n',
+}
+
+
+def test_diff():
+    with TemporaryDirectory() as tmp_dir:
+        make_role(tmp_dir, 'some.role', MAIN, FILES)
+        old = changes.file_hashes(tmp_dir, ['some.role'])
+        make_role(tmp_dir, 'some.role', MAIN, {
+            'templates/greeting.j2': 'hello\n', 'files/new': ''})
+        new = changes.file_hashes(tmp_dir, ['some.role'])
+        assert changes.diff(old, new) == [
+            'some.role/files/new', 'some.role/templates/greeting.j2']
+
+
+def test_file_hashes_cover_dependencies_only():
+    with TemporaryDirectory() as tmp_dir:
+        make_role(tmp_dir, 'some.role', files={
+            'meta/main.yml': 'dependencies: [dep.role]\n'})
+        make_role(tmp_dir, 'dep.role')
+        make_role(tmp_dir, 'other.role')
+        hashes = changes.file_hashes(tmp_dir, ['some.role'])
+        assert sorted(hashes) == [
+            'dep.role/tasks/main.yml', 'some.role/meta/main.yml',
+            'some.role/tasks/main.yml']
+
+
+def test_start_task():
+    with TemporaryDirectory() as tmp_dir:
+        make_role(tmp_dir, 'some.role', MAIN, FILES)
+
+        def start(*changed):
+            return changes.start_task(
+                ['some.role/' + x for x in changed], tmp_dir, ['some.role'])
+        assert start('tasks/imported.yml') == 'imported'
+        # tasks in dynamic includes only exist once the play runs
+        assert start('tasks/included.yml') == 'include'
+        assert start('templates/greeting.j2') == 'render'
+        assert start('templates/greeting.j2', 'tasks/main.yml') == 'first'
+        # changes the play can't be started at need a full run
+        assert start('defaults/main.yml') is None
+        assert start('templates/unused.j2') is None
+        assert changes.start_task(
+            ['dep.role/tasks/main.yml'], tmp_dir, ['some.role']) is None
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+""" tests.test_console
+"""
+
+import io
+import json
+import threading
+
+import mock
+
+from ansible_role import console
+
+
+def test_reporters_are_cached_and_filtered():
+    assert console.get_reporter('x') is console.get_reporter('x')
+    stderr = io.StringIO()
+    with mock.patch('sys.stderr', stderr):
+        console.configure(level='warning')
+        try:
+            console.report('x', u'hidden')
+            console.report('x', u'shown', level=console.ERROR)
+        finally:
+            console.configure(level='info')
+    assert 'hidden' not in stderr.getvalue()
+    assert 'shown' in stderr.getvalue()
+
+
+def test_json_sink():
+    stderr = io.StringIO()
+    with mock.patch('sys.stderr', stderr):
+        console.configure(fmt='json')
+        try:
+            console.report('ansible-role', console.cyan(u'hello'))
+        finally:
+            console.configure(fmt='text')
+    record = json.loads(stderr.getvalue())
+    assert record['title'] == 'ansible-role'
+    assert record['level'] == 'info'
+    assert record['msg'] == 'hello'
+
+
+def test_tagged_writers_keep_lines_whole():
+    stream = io.StringIO()
+
+    def work(tag):
+        writer = console.TaggedWriter(tag, stream=stream)
+        for i in range(200):
+            writer.write(u'line ')
+            writer.write(u'{0}\nline '.format(i))
+            writer.write(u'done\n')
+        writer.write(u'trailing')
+        writer.close()
+    threads = [threading.Thread(target=work, args=(tag,))
+               for tag in ('a', 'b', 'c')]
+    [x.start() for x in threads]
+    [x.join() for x in threads]
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 3 * 401
+    for line in lines:
+        tag, _, text = line.partition(' ')
+        assert tag in ('[a]', '[b]', '[c]')
+        assert text == 'trailing' or text == 'line done' or \
+            (text.startswith('line ') and text[5:].isdigit())
+
+
+@mock.patch('ansible_role.proc.run')
+def test_entry_levels(run):
+    from ansible_role import entry, proc
+    from .backports import TemporaryDirectory
+    run.return_value = proc.ProcessResult(['ansible-galaxy'], 1)
+    stderr = io.StringIO()
+    with TemporaryDirectory() as tmp_dir:
+        with mock.patch('sys.stderr', stderr):
+            try:
+                entry(['user.missing', '--module-path', tmp_dir,
+                       '--no-history', '--log-level', 'error'])
+            except SystemExit:
+                pass
+            finally:
+                console.configure(level='info')
+    # the version line is already subject to --log-level, failures aren't
+    assert 'version' not in stderr.getvalue()
+    assert 'not found' not in stderr.getvalue()
+    assert 'user.missing' in stderr.getvalue()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+""" tests.test_daemon
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+from .backports import TemporaryDirectory
+from ansible_role import daemon
+
+
+class Stream(object):
+
+    def __init__(self):
+        self.data = ''
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        pass
+
+
+def test_split_args():
+    mode, socket_path, args = daemon.split_args(
+        ['--daemon', 'role.name', '--socket', '/tmp/x.sock', '--become'])
+    assert (mode, socket_path, args) == \
+        ('client', '/tmp/x.sock', ['role.name', '--become'])
+    mode, socket_path, args = daemon.split_args(['--serve', '--socket=/s'])
+    assert (mode, socket_path, args) == ('serve', '/s', [])
+    assert daemon.split_args(['role.name'])[0] is None
+
+
+def test_default_engine():
+    assert daemon.default_engine(['role.name', 'web1']) == 'inprocess'
+    assert daemon.default_engine(['role.name']) == 'inprocess'
+    assert daemon.default_engine(['role.name', 'web1,web2']) == 'subprocess'
+    assert daemon.default_engine(
+        ['role.name', '--hosts-file', 'hosts']) == 'subprocess'
+    assert daemon.default_engine(
+        ['role.name', '--inventory-stream=-']) == 'subprocess'
+    assert daemon.default_engine(
+        ['role.name', 'web1,web2', '--workers', '1']) == 'inprocess'
+    assert daemon.default_engine(['--wave-concurrency=2']) == 'subprocess'
+    assert daemon.default_engine(['--workers', 'x']) == 'inprocess'
+
+
+def test_subcommands_get_no_engine():
+    seen = []
+    assert daemon.handle_request(
+        None, dict(argv=['stats', '--json']), seen.append) == 0
+    assert daemon.handle_request(
+        None, dict(argv=['role.name', 'web1']), seen.append) == 0
+    assert seen == [['stats', '--json'],
+                    ['role.name', 'web1', '--engine=inprocess']]
+
+
+def test_forward_to_daemon():
+    with TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, 'daemon.sock')
+        assert daemon.forward(socket_path, ['--help']) is None
+        server = subprocess.Popen(
+            [sys.executable, '-c',
+             'from ansible_role import entry; entry()',
+             '--serve', '--socket', socket_path],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            for _ in range(100):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.1)
+            old_streams = sys.stdout, sys.stderr
+            sys.stdout, sys.stderr = Stream(), Stream()
+            try:
+                help_code = daemon.forward(socket_path, ['--help'])
+                help_output = sys.stdout.data
+                error_code = daemon.forward(socket_path, [])
+            finally:
+                sys.stdout, sys.stderr = old_streams
+        finally:
+            server.terminate()
+            server.wait()
+    assert help_code == 0
+    assert 'Usage: ansible-role' in help_output
+    assert error_code == 2
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+""" tests.test_deps
+"""
+
+import os
+import time
+import threading
+
+import pytest
+
+from .backports import TemporaryDirectory
+from ansible_role.deps import DependencyResolver, dependency_spec
+from ansible_role.util import split_role_spec
+
+# role -> dependencies, as found in each role's meta/main.yml
+TREE = {
+    'user.app': ['user.web', 'user.db,v2'],
+    'user.web': ['user.common'],
+    'user.db': ['user.common', 'local_role'],
+    'user.common': [],
+}
+
+
+def fake_install(role_spec, role_dir):
+    name = role_spec.split(',')[0]
+    if name not in TREE:
+        raise RuntimeError('no such role')
+    time.sleep(0.05)
+    os.makedirs(os.path.join(role_dir, name, 'meta'))
+    with open(os.path.join(role_dir, name, 'meta', 'main.yml'), 'w') as fh:
+        fh.write('dependencies:\n')
+        for dep in TREE[name]:
+            fh.write('  - {{role: "{0}"}}\n'.format(dep))
+
+
+def test_dependency_spec():
+    assert dependency_spec('user.role') == 'user.role'
+    assert dependency_spec({'role': 'user.role', 'version': 'v1'}) == \
+        'user.role,v1'
+    assert dependency_spec({'src': 'user.role'}) == 'user.role'
+    assert dependency_spec('local_role') is None
+    assert dependency_spec({'role': '../roles/thing.x'}) is None
+    # urls and scm sources go to ansible-galaxy as they are
+    assert dependency_spec('git+https://github.com/user/repo.git') == \
+        'git+https://github.com/user/repo.git'
+    assert dependency_spec({
+        'src': 'https://github.com/user/repo.git', 'version': 'v1',
+        'name': 'user.repo'}) == \
+        'https://github.com/user/repo.git,v1,user.repo'
+
+
+def test_split_scm_role_spec():
+    assert split_role_spec('git+https://github.com/user/repo.git,v1') == \
+        ('repo', 'v1')
+    assert split_role_spec('git@github.com:user/repo.git') == ('repo', None)
+    assert split_role_spec('https://host/repo.git,v1,user.repo') == \
+        ('user.repo', 'v1')
+
+
+def test_resolve_installs_tree_concurrently():
+    lock = threading.Lock()
+    state = dict(running=0, peak=0, installed=[])
+
+    def install(role_spec, role_dir):
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+            state['installed'].append(role_spec)
+        try:
+            fake_install(role_spec, role_dir)
+        finally:
+            with lock:
+                state['running'] -= 1
+    with TemporaryDirectory() as role_dir:
+        graph = DependencyResolver(
+            role_dir, install, workers=2).resolve(['user.app'])
+    assert graph == {
+        'user.app': ['user.web', 'user.db'],
+        'user.web': ['user.common'],
+        'user.db': ['user.common'],
+        'user.common': [],
+    }
+    assert sorted(state['installed']) == sorted(
+        ['user.app', 'user.web', 'user.db,v2', 'user.common'])
+    assert state['peak'] == 2
+
+
+def test_resolve_skips_installed_and_reports_failures():
+    with TemporaryDirectory() as role_dir:
+        fake_install('user.common', role_dir)
+        with pytest.raises(RuntimeError) as exc:
+            DependencyResolver(role_dir, fake_install).resolve(
+                ['user.web', 'user.missing'])
+    assert 'user.missing' in str(exc.value)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+""" tests.test_facts
+"""
+
+import os
+import io
+
+import mock
+import pytest
+
+from .backports import TemporaryDirectory
+from ansible_role import entry, facts
+
+
+def test_fact_cache_env():
+    with TemporaryDirectory() as tmp_dir:
+        env = facts.get_fact_cache_env(tmp_dir, ttl=60)
+        assert os.path.isdir(env['ANSIBLE_CACHE_PLUGIN_CONNECTION'])
+    assert env['ANSIBLE_CACHE_PLUGIN'] == 'jsonfile'
+    assert env['ANSIBLE_CACHE_PLUGIN_TIMEOUT'] == '60'
+    assert env['ANSIBLE_GATHERING'] == 'smart'
+
+
+def test_summary_stream_hides_facts():
+    out = io.StringIO()
+    stream = facts.SummaryStream(out)
+    for line in [u'[WARNING]: careful\n', u'web1 | SUCCESS => {\n',
+                 u'    "ansible_facts": {}\n', u'}\n',
+                 u'web2 | UNREACHABLE! => {\n', u'    "msg": "no"\n', u'}\n']:
+        stream.write(line)
+    assert out.getvalue().splitlines() == [
+        '[WARNING]: careful', 'web1 | SUCCESS', 'web2 | UNREACHABLE!']
+
+
+@mock.patch("ansible_role.role_apply")
+def test_entry_fact_cache(role_apply):
+    role_apply.return_value = True, 0
+    with TemporaryDirectory() as tmp_dir:
+        with pytest.raises(SystemExit):
+            entry(['role.name', 'host', '--fact-cache',
+                   '--fact-cache-ttl', '10', '--cache-dir', tmp_dir])
+    env = role_apply.call_args[1]['env']
+    assert env['ANSIBLE_CACHE_PLUGIN_CONNECTION'] == \
+        os.path.join(tmp_dir, facts.FACTS_DIR)
+    assert env['ANSIBLE_CACHE_PLUGIN_TIMEOUT'] == '10'
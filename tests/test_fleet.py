@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+""" tests.test_fleet
+"""
+
+import os
+import threading
+
+from .backports import TemporaryDirectory
+from ansible_role import fleet
+
+
+def test_parse_hosts():
+    with TemporaryDirectory() as tmp_dir:
+        hosts_file = os.path.join(tmp_dir, 'hosts')
+        with open(hosts_file, 'w') as fhandle:
+            fhandle.write('# web tier\nweb1\nweb2  # canary\n\nhost1\n')
+        hosts = fleet.parse_hosts('host1,host2', hosts_file)
+    assert hosts == ['host1', 'host2', 'web1', 'web2']
+
+
+def test_run_parallel_is_bounded_and_ordered():
+    lock = threading.Lock()
+    state = dict(running=0, peak=0)
+    overlapped = threading.Event()
+
+    def job(item):
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+            if state['running'] == 2:
+                overlapped.set()
+        # jobs stay open until two of them ran at once
+        overlapped.wait(5)
+        with lock:
+            state['running'] -= 1
+        if item == 'bad':
+            raise ValueError(item)
+        return item != 'failed', 2 if item == 'failed' else 0
+    items = ['a', 'failed', 'b', 'bad', 'c']
+    results = fleet.run_parallel(job, items, workers=2)
+    assert [x.item for x in results] == items
+    assert state['peak'] == 2
+    assert [x.exit_code for x in results] == [0, 2, 0, 1, 0]
+    assert isinstance(results[3].error, ValueError)
+    assert fleet.aggregate_exit_code(results) == 2
+    assert fleet.aggregate_exit_code(results[:1]) == 0
+
+
+def test_stream_hosts_in_batches():
+    def forever():
+        count = 0
+        while True:
+            count += 1
+            yield 'host{0}'.format(count)
+    batches = fleet.batches(forever(), 3)
+    assert next(batches) == ['host1', 'host2', 'host3']
+    assert next(batches) == ['host4', 'host5', 'host6']
+    with TemporaryDirectory() as tmp_dir:
+        hosts_file = os.path.join(tmp_dir, 'hosts')
+        with open(hosts_file, 'w') as fhandle:
+            fhandle.write('# web tier\nweb1,web2\n\nweb3  # canary\n')
+        assert list(fleet.batches(fleet.stream_hosts(hosts_file), 2)) == \
+            [['web1', 'web2'], ['web3']]
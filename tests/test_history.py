@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+""" tests.test_history
+"""
+
+import os
+import time
+
+import pytest
+
+from .backports import TemporaryDirectory
+from .roles import make_role
+from ansible_role import entry, history
+
+
+def fake_report(started, seconds, recap={}, versions={}):
+    return dict(
+        started=started,
+        phases=dict(total=dict(count=1, seconds=seconds),
+                    bundle=dict(count=0, seconds=0)),
+        counters=dict(cache_hits=1, cache_misses=0),
+        recap=recap, role_versions=versions)
+
+
+def test_stats_and_regressions():
+    now = time.time()
+    day = 86400
+    with TemporaryDirectory() as tmp_dir:
+        store = history.History(cache_dir=tmp_dir)
+        for seconds in (1.0, 1.0, 2.0):
+            store.record(['role.a'], fake_report(
+                now - 8 * day, seconds, dict(web1=dict(ok=2, seconds=0.5))),
+                0)
+        for seconds in (2.0, 3.0, 10.0):
+            store.record(['role.a'], fake_report(
+                now - day, seconds, dict(web1=dict(ok=2, seconds=0.5)),
+                dict(role_a='v1')), 2)
+        # too old for either window
+        store.record(['role.b'], fake_report(now - 30 * day, 5.0), 0)
+        stats = history.get_stats(store, now=now)
+        assert store.db.execute(
+            'SELECT COUNT(*) FROM runs WHERE version = ?', ('v1',)
+        ).fetchone()[0] == 3
+        store.close()
+    assert [(x['role'], x['runs'], x['p50'], x['p99'], x['failed'])
+            for x in stats['roles']] == [('role.a', 3, 3.0, 10.0, 3)]
+    assert [(x['role'], x['host'], x['runs'], x['p50'])
+            for x in stats['hosts']] == [('role.a', 'web1', 3, 0.5)]
+    assert [(x.get('host'), x['previous_p50'], x['p50'])
+            for x in stats['regressions']] == [(None, 1.0, 3.0)]
+    assert 'REGRESSION role.a: p50 1.00s -> 3.00s' in \
+        history.format_stats(stats)
+
+
+def test_percentile():
+    assert history.percentile([], 50) is None
+    assert history.percentile([1, 2, 3, 4], 50) == 2
+    assert history.percentile([1, 2, 3, 4], 99) == 4
+    assert history.percentile([7], 90) == 7
+
+
+def test_runs_are_recorded(monkeypatch):
+    pytest.importorskip('ansible')
+    monkeypatch.setenv(history.HISTORY_ENV, '1')
+    with TemporaryDirectory() as tmp_dir:
+        make_role(os.path.join(tmp_dir, 'roles'), 'local.role')
+        with pytest.raises(SystemExit) as exc:
+            entry(['local.role', '-M', tmp_dir, '--cache-dir', tmp_dir,
+                   '--engine', 'inprocess', '-c', 'local'])
+        assert exc.value.code == 0
+        store = history.History(cache_dir=tmp_dir)
+        rows = store.db.execute(
+            'SELECT role, host, ok, failed FROM host_runs').fetchall()
+        store.close()
+        assert rows == [('local.role', 'localhost', 2, 0)]
+        with pytest.raises(SystemExit) as exc:
+            entry(['stats', '--cache-dir', tmp_dir, '--json'])
+        assert exc.value.code == 0
+
+
+def test_runs_of_several_roles_count_for_each():
+    now = time.time()
+    with TemporaryDirectory() as tmp_dir:
+        store = history.History(cache_dir=tmp_dir)
+        store.record(['role.a', 'role.b,v1'], fake_report(
+            now - 60, 4.0, dict(web1=dict(ok=2, seconds=3.0))), 0)
+        store.record(['role.b'], fake_report(now - 60, 2.0), 1)
+        stats = history.get_stats(store, role='role.b', now=now)
+        hosts = history.get_stats(store, host='web1', now=now)['hosts']
+        store.close()
+    assert [(x['role'], x['runs'], x['p99'], x['failed'])
+            for x in stats['roles']] == [('role.b', 2, 4.0, 1)]
+    assert [(x['role'], x['host'], x['p50']) for x in stats['hosts']] == \
+        [('role.b', 'web1', 3.0)]
+    assert [x['role'] for x in hosts] == ['role.a', 'role.b']
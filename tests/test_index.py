@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+""" tests.test_index
+"""
+
+import os
+import time
+
+from .backports import TemporaryDirectory
+from .roles import make_role
+from ansible_role import console, index, is_role_installed
+
+
+def damage(role_path):
+    tasks = os.path.join(role_path, 'tasks', 'main.yml')
+    with open(tasks, 'w') as fh:
+        fh.write('')
+    stale = time.time() - 60
+    os.utime(tasks, (stale, stale))
+
+
+def test_check_and_record():
+    with TemporaryDirectory() as role_dir:
+        role_index = index.RoleIndex(role_dir)
+        assert role_index.check('user.role') == index.MISSING
+        role_path = make_role(role_dir, 'user.role', version='v1.2')
+        assert role_index.check('user.role') == index.UNINDEXED
+        entry = role_index.record('user.role', source='galaxy')
+        assert entry['version'] == 'v1.2'
+        assert role_index.check('user.role') == index.INSTALLED
+        assert role_index.verify('user.role')
+        # a fresh instance reads what the first one wrote
+        assert index.RoleIndex(role_dir).get('user.role') == entry
+        damage(role_path)
+        assert role_index.check('user.role') == index.CORRUPT
+        assert not role_index.verify('user.role')
+
+
+def test_is_role_installed():
+    with TemporaryDirectory() as role_dir:
+        assert not is_role_installed(role_dir, 'user.galaxy')
+        galaxy_role = make_role(role_dir, 'user.galaxy', version='v1')
+        index.RoleIndex(role_dir).record('user.galaxy', source='galaxy')
+        local_role = make_role(role_dir, 'user.local')
+        assert is_role_installed(role_dir, 'user.local')
+        assert is_role_installed(role_dir, 'user.galaxy')
+        # edits are never thrown away, galaxy role or not
+        damage(local_role)
+        damage(galaxy_role)
+        messages = []
+        assert is_role_installed(role_dir, 'user.local')
+        assert is_role_installed(
+            role_dir, 'user.galaxy',
+            report=lambda msg, **kargs: messages.append((msg, kargs)))
+        assert 'changed since it was installed' in messages[0][0]
+        assert messages[0][1] == dict(level=console.WARNING)
+        assert os.path.exists(galaxy_role) and os.path.exists(local_role)
+        assert index.RoleIndex(role_dir).check('user.galaxy') == \
+            index.INSTALLED
+        # a partly extracted role is not adopted
+        os.makedirs(os.path.join(role_dir, 'user.partial', 'files'))
+        assert index.RoleIndex(role_dir).check('user.partial') == \
+            index.INCOMPLETE
+        assert not is_role_installed(role_dir, 'user.partial')
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+""" tests.test_inprocess
+"""
+
+import os
+
+import pytest
+
+from .backports import TemporaryDirectory
+from .roles import make_role
+from ansible_role import get_play_for_role, role_apply
+
+ansible = pytest.importorskip('ansible')
+
+
+def test_get_play_for_role():
+    play = get_play_for_role(['role.a', 'role.b,v1'], '/roles', hosts='web')
+    assert play == dict(
+        hosts='web',
+        roles=[dict(role='/roles/role.a'), dict(role='/roles/role.b')])
+
+
+def test_repeated_inprocess_runs():
+    with TemporaryDirectory() as module_path:
+        role_dir = os.path.join(module_path, 'roles')
+        make_role(role_dir, 'local.ok')
+        make_role(role_dir, 'local.fail', '- fail: msg=nope\n')
+        for role_name, expected in [
+                ('local.ok', 0), ('local.fail', 2), ('local.ok', 0)]:
+            success, exit_code = role_apply(
+                role_name, module_path=module_path,
+                extra_ansible_args=[], engine='inprocess')
+            assert exit_code == expected
+            assert success == (expected == 0)
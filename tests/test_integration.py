@@ -5,7 +5,6 @@
 import os
 import mock
 import pytest
-from fabric import api
 from ansible_role import entry
 
 TMPDIR = os.path.join(os.path.dirname(__file__), 'tmp')
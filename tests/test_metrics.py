@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+""" tests.test_metrics
+"""
+
+import os
+import json
+
+import mock
+
+from .backports import TemporaryDirectory
+from .roles import make_role
+from ansible_role import metrics, role_apply
+
+
+def test_phases_and_counters():
+    run = metrics.Metrics()
+    with run.phase('render'):
+        pass
+    with run.phase('render'):
+        pass
+    run.add('cache_hits')
+    run.add('download_bytes', 100)
+    report = run.as_dict()
+    assert report['phases']['render']['count'] == 2
+    assert report['phases']['apply']['count'] == 0
+    assert report['counters'] == dict(
+        cache_hits=1, cache_misses=0, roles_downloaded=0,
+        download_bytes=100, hosts_skipped=0)
+    text = run.as_openmetrics()
+    assert 'ansible_role_phase_seconds_count{phase="render"} 2' in text
+    assert 'ansible_role_download_bytes_total 100' in text
+    assert text.endswith('# EOF\n')
+
+
+@mock.patch("ansible_role.run_ansible_playbook")
+def test_role_apply_is_instrumented(rap):
+    rap.return_value = True, 0
+    run = metrics.reset()
+    with TemporaryDirectory() as tmp_dir:
+        make_role(os.path.join(tmp_dir, 'roles'), 'role.name')
+        role_apply('role.name', module_path=tmp_dir, extra_ansible_args=[])
+        path = os.path.join(tmp_dir, 'report.json')
+        run.write_json(path, exit_code=0)
+        with open(path) as fh:
+            report = json.load(fh)
+    assert report['exit_code'] == 0
+    for phase in ('role_dir', 'require', 'render', 'apply'):
+        assert report['phases'][phase]['count'] == 1, phase
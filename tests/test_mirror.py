@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+""" tests.test_mirror
+"""
+
+import os
+import json
+import threading
+
+import mock
+import pytest
+
+from .backports import TemporaryDirectory
+from .galaxy import CannedGalaxy
+from ansible_role import mirror, galaxy_install
+
+ROLES = {'user.role': '- debug: msg=hello\n'}
+
+
+class running_mirror(object):
+    """ a mirror of `upstream`, storing into `path`, on a free port """
+
+    def __init__(self, upstream, path, max_age=0):
+        self.mirror = mirror.Mirror(
+            mirror.MirrorStore(path), upstream, max_age=max_age,
+            report=lambda msg, **kargs: None)
+
+    def __enter__(self):
+        self.server = mirror.make_server(self.mirror, port=0)
+        self.url = 'http://127.0.0.1:{0}'.format(
+            self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, exc, value, tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def get(url, etag=None):
+    return mirror.http_get(url, {'If-None-Match': etag} if etag else {})
+
+
+def test_revalidation_and_offline():
+    lookup = '/api/v1/roles/?owner__username=user&name=role'
+    with TemporaryDirectory() as tmp_dir:
+        with CannedGalaxy(ROLES) as galaxy:
+            with running_mirror(galaxy.url, tmp_dir) as proxy:
+                status, headers, first = get(proxy.url + lookup)
+                assert status == 200
+                assert json.loads(first.decode('utf-8'))['results']
+                # upstream is only asked whether it changed
+                assert get(proxy.url + lookup)[2] == first
+                assert [x[1] for x in galaxy.requests] == [200, 304]
+                # and so is the mirror, by its clients
+                assert get(proxy.url + lookup, headers['etag'])[0] == 304
+                upstream = galaxy.url
+        # galaxy is gone, the stored answer is still served
+        with running_mirror(upstream, tmp_dir) as proxy:
+            assert get(proxy.url + lookup)[2] == first
+            status, _, _ = get(proxy.url + '/api/v1/roles/?name=other')
+            assert status == 502
+
+
+def test_archives_go_through_the_mirror():
+    with TemporaryDirectory() as tmp_dir:
+        with CannedGalaxy(ROLES) as galaxy:
+            with running_mirror(galaxy.url, tmp_dir, max_age=60) as proxy:
+                _, _, body = get(proxy.url + '/api/v1/roles/1/versions/')
+                version = json.loads(body.decode('utf-8'))['results'][0]
+                url = version['download_url']
+                assert url.startswith(proxy.url + mirror.ARCHIVE_PATH)
+                status, _, archive = get(url)
+                assert status == 200 and archive[:2] == b'\x1f\x8b'
+                # fresh answers don't reach galaxy at all
+                get(url)
+                assert len(galaxy.requests) == 2
+                assert get(proxy.url + mirror.ARCHIVE_PATH + 'bad')[0] == 404
+
+
+def has_galaxy():
+    try:
+        from shutil import which
+    except ImportError:
+        from distutils.spawn import find_executable as which
+    return which('ansible-galaxy') is not None
+
+
+@pytest.mark.skipif(not has_galaxy(), reason="needs ansible-galaxy")
+def test_galaxy_install_through_mirror():
+    with TemporaryDirectory() as tmp_dir:
+        role_dir = os.path.join(tmp_dir, 'roles')
+        os.mkdir(role_dir)
+        with CannedGalaxy(ROLES) as galaxy:
+            with running_mirror(galaxy.url, tmp_dir + '/mirror') as proxy:
+                env = mirror.get_mirror_env(proxy.url)
+                with mock.patch.dict(os.environ, env):
+                    galaxy_install('user.role', role_dir)
+        tasks = os.path.join(role_dir, 'user.role', 'tasks', 'main.yml')
+        with open(tasks) as fh:
+            assert fh.read() == ROLES['user.role']
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+""" tests.test_plan
+"""
+
+import os
+
+import pytest
+
+from .backports import TemporaryDirectory
+from ansible_role import entry, escape_args, plan, role_plan
+
+
+def test_plan_has_no_side_effects():
+    with TemporaryDirectory() as tmp_dir:
+        role_dir = os.path.join(tmp_dir, 'roles')
+        meta = os.path.join(role_dir, 'local.role', 'meta')
+        os.makedirs(meta)
+        with open(os.path.join(meta, 'main.yml'), 'w') as fh:
+            fh.write('dependencies:\n- other.role\n')
+        before = sorted(os.listdir(role_dir))
+        result = role_plan(
+            ['local.role', 'missing.role'], hosts=['web1', 'web2'],
+            module_path=tmp_dir, extra_ansible_args=['-e', 'x=1'])
+        assert sorted(os.listdir(role_dir)) == before
+    assert result['roles'] == [
+        ('local.role', plan.DISK, None),
+        ('missing.role', plan.DOWNLOAD, None),
+        ('other.role', plan.DOWNLOAD, 'local.role')]
+    assert result['commands'][1] == [
+        'ansible-playbook', plan.TEMP_PLAYBOOK, '-e', 'x=1',
+        '--module-path', tmp_dir, '-e', 'ansible_role_target=web2']
+    assert result['quoting_ok']
+    assert 'missing.role' in plan.format_plan(result)
+
+
+def test_plan_creates_no_cache_dirs(capsys):
+    with TemporaryDirectory() as tmp_dir:
+        os.makedirs(os.path.join(tmp_dir, 'roles', 'local.role', 'tasks'))
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        with pytest.raises(SystemExit) as exc:
+            entry(['local.role', '-M', tmp_dir, '--cache-dir', cache_dir,
+                   '--plan', '--fact-cache', '--ssh-persist'])
+        assert exc.value.code == 0
+        assert not os.path.exists(cache_dir)
+    assert os.path.join(cache_dir, 'facts') in capsys.readouterr().out
+
+
+def test_escape_args_roundtrip():
+    argv = ['-e', 'a="b"', '-e', "c='d e'", '--limit', 'web*', '']
+    assert plan.check_quoting(argv, escape_args(argv))
+    assert escape_args(['plain', '--flag']) == ['plain', '--flag']
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+""" tests.test_playbooks
+"""
+
+import os
+import time
+
+import mock
+import pytest
+
+from .backports import TemporaryDirectory
+from ansible_role import (
+    playbooks, get_parser, get_play_options, get_play_for_role,
+    get_playbook_for_role, role_apply,)
+
+
+def test_play_options():
+    prog_args, _ = get_parser().parse_known_args([
+        'role.a', '--play-become', '--play-gather-facts', 'no',
+        '--play-serial', '2', '--play-var', 'port=80'])
+    options = get_play_options(prog_args)
+    playbook = get_playbook_for_role('role.a', '/roles', options=options)
+    assert playbook.splitlines() == [
+        '- hosts: localhost',
+        '  become: true',
+        '  gather_facts: false',
+        '  serial: 2',
+        '  vars: {"port": "80"}',
+        '  roles:',
+        '  - {role: /roles/role.a}',
+    ]
+    # the same play, however the options were given
+    assert get_playbook_for_role(
+        'role.a', '/roles', options=dict(
+            vars={'port': '80'}, serial=2, gather_facts=False,
+            become=True, )) is playbook
+    assert get_play_for_role('role.a', '/roles', options=options)[
+        'vars'] == {'port': '80'}
+    with pytest.raises(ValueError):
+        playbooks.check_options(dict(hosts='all'))
+    prog_args.play_var = ['port']
+    with pytest.raises(ValueError):
+        get_play_options(prog_args)
+
+
+def test_lru():
+    lru = playbooks.LRU(size=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    assert lru.get('a') == 1
+    lru.put('c', 3)
+    assert lru.get('b') is None
+    assert (lru.get('a'), lru.get('c'), len(lru)) == (1, 3, 2)
+
+
+def test_playbook_store():
+    with TemporaryDirectory() as cache_dir:
+        store = playbooks.PlaybookStore(cache_dir, max_files=2, min_age=60)
+        path = store.path('- hosts: a')
+        assert store.path('- hosts: a') == path
+        with open(path) as fh:
+            assert fh.read() == '- hosts: a'
+        # recently used files survive eviction
+        store.path('- hosts: b')
+        store.path('- hosts: c')
+        assert len(os.listdir(store.playbooks_dir)) == 3
+        with mock.patch.object(time, 'time', return_value=time.time() + 61):
+            evicted = store.evict()
+        assert evicted == [path]
+        assert store.path('- hosts: a') == path and os.path.exists(path)
+
+
+def test_temporary_module_path_playbooks():
+    written = []
+
+    def apply(role_name, role_dir, playbook_store, **kargs):
+        written.append(playbook_store.path('- hosts: a'))
+        return True, 0
+    with mock.patch('ansible_role.apply_ansible_role', side_effect=apply):
+        with mock.patch('ansible_role.cache.RoleCache.fetch'):
+            assert role_apply('role.name') == (True, 0)
+    # the roles' paths change every run, so the file isn't kept
+    assert not os.path.exists(written[0])
+    assert not os.path.exists(playbooks.get_store().playbooks_dir)
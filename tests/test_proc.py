@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+""" tests.test_proc
+"""
+
+import sys
+
+from ansible_role import proc
+
+
+class Stream(object):
+    """ records every write, to check output arrives line by line """
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def flush(self):
+        pass
+
+
+def test_run_streams_lines_without_shell():
+    stream = Stream()
+    script = 'import sys; print("one"); print("two $HOME"); sys.exit(3)'
+    result = proc.run([sys.executable, '-c', script], stream=stream)
+    assert result.return_code == 3
+    assert result.failed
+    assert stream.writes == ['one\n', 'two $HOME\n']
+
+
+def test_run_missing_command():
+    stream = Stream()
+    result = proc.run(['ansible-role-no-such-command'], stream=stream)
+    assert result.return_code == 127
+    assert not result.succeeded
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+""" tests.test_profile
+"""
+
+import os
+import json
+
+import mock
+import pytest
+
+from .backports import TemporaryDirectory
+from .roles import make_role
+from ansible_role import profile, role_apply
+
+RECORDS = [
+    dict(host='web1', play='all', role='user.role', task='install',
+         kind='task', status='ok', duration=2.0),
+    dict(host='web1', play='all', role='user.role', task='restart',
+         kind='handler', status='ok', duration=0.5),
+    dict(host='web2', play='all', role='user.role', task='install',
+         kind='task', status='failed', duration=3.25),
+    dict(host='web1', play='all', role='user.role', task='install',
+         kind='task', status='ok', duration=1.0),
+]
+
+
+def test_profile_report():
+    with TemporaryDirectory() as tmp_dir:
+        records_path = os.path.join(tmp_dir, 'records.jsonl')
+        with open(records_path, 'w') as fh:
+            fh.write(''.join(json.dumps(x) + '\n' for x in RECORDS))
+        output = os.path.join(tmp_dir, 'out.folded')
+        messages = []
+        profile.report_profile(
+            records_path, top=2, output=output, report=messages.append)
+        assert not os.path.exists(records_path)
+        assert messages[1].split() == [
+            '3.25s', 'user.role', ':', 'install', '[web2,', 'failed]']
+        assert len(messages) == 4
+        with open(output) as fh:
+            assert fh.read().splitlines() == [
+                'web1;all;user.role;install 3000',
+                'web1;all;user.role;restart (handler) 500',
+                'web2;all;user.role;install 3250']
+
+
+def test_profile_env():
+    with mock.patch.dict(os.environ, {'ANSIBLE_CALLBACKS_ENABLED': 'timer'}):
+        env = profile.get_profile_env('/tmp/records')
+    assert env['ANSIBLE_CALLBACKS_ENABLED'] == 'timer,ansible_role_profile'
+    assert os.path.exists(os.path.join(
+        env['ANSIBLE_CALLBACK_PLUGINS'], 'ansible_role_profile.py'))
+
+
+def test_profile_callback():
+    pytest.importorskip('ansible')
+    with TemporaryDirectory() as module_path:
+        make_role(os.path.join(module_path, 'roles'), 'local.role',
+                  '- name: hello\n  debug: msg=hello\n')
+        records_path = os.path.join(module_path, 'records.jsonl')
+        role_apply('local.role', module_path=module_path,
+                   extra_ansible_args=['-c', 'local'], engine='inprocess',
+                   env=profile.get_profile_env(records_path))
+        records = profile.load(records_path)
+    assert [(x['role'], x['task']) for x in records] == [
+        ('', 'Gathering Facts'), ('local.role', 'hello')]
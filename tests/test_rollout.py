@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+""" tests.test_rollout
+"""
+
+import threading
+
+from ansible_role import rollout
+from ansible_role.recap import RecapTee
+
+RECAP = (
+    "PLAY RECAP *********************************************************\n"
+    "\x1b[0;32mweb1\x1b[0m                       : \x1b[0;32mok=2\x1b[0m    "
+    "changed=0    unreachable=0    failed=0    skipped=0\n"
+    "\x1b[0;31mweb2\x1b[0m                       : ok=1    changed=0    "
+    "unreachable=0    \x1b[0;31mfailed=1\x1b[0m    skipped=0\n"
+    "web3                       : ok=0    changed=0    unreachable=1    "
+    "failed=0    skipped=0\n\n")
+
+
+class Sink(object):
+    def __init__(self):
+        self.data = ''
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        pass
+
+
+def test_waves():
+    hosts = ['web{0}'.format(i) for i in range(10)]
+    assert rollout.parse_count('25%', 10) == 3
+    assert rollout.parse_count('2', 10) == 2
+    assert [len(x) for x in rollout.make_waves(hosts, '25%')] == [3, 3, 3, 1]
+    assert rollout.make_waves(hosts, '0') == [[x] for x in hosts]
+
+
+def test_recap():
+    sink = Sink()
+    tee = RecapTee(sink)
+    # output arrives in arbitrary chunks
+    for i in range(0, len(RECAP), 7):
+        tee.write(RECAP[i:i + 7])
+    assert sink.data == RECAP
+    assert sorted(tee.hosts) == ['web1', 'web2', 'web3']
+    assert tee.hosts['web1']['ok'] == 2
+    assert tee.failed_hosts() == ['web2', 'web3']
+    # the rest of the file interface is the wrapped stream's
+    sink.encoding = 'utf-8'
+    assert tee.encoding == 'utf-8'
+    assert not hasattr(tee, 'reconfigure')
+
+
+def test_failure_budget():
+    hosts = ['web{0}'.format(i) for i in range(8)]
+    applied = []
+
+    def apply(number, wave):
+        applied.append(number)
+        failed = wave[:1] if number == 2 else []
+        return not failed, 2 if failed else 0, failed
+    results = rollout.Rollout('2', max_failures=0).run(hosts, apply)
+    assert applied == [1, 2]
+    assert [x.skipped for x in results] == [False, False, True, True]
+    assert results[1].failed_hosts == ['web2']
+    assert rollout.aggregate_exit_code(results) == 2
+    # within the budget, every wave runs
+    results = rollout.Rollout('25%', max_failures='20%').run(hosts, apply)
+    assert not any(x.skipped for x in results)
+    assert rollout.aggregate_exit_code(results) == 2
+
+
+def test_concurrency():
+    lock = threading.Lock()
+    state = dict(running=0, most=0)
+    event = threading.Event()
+
+    def apply(number, wave):
+        with lock:
+            state['running'] += 1
+            state['most'] = max(state['most'], state['running'])
+        event.wait(0.05)
+        with lock:
+            state['running'] -= 1
+        return True, 0, []
+    results = rollout.Rollout(1, concurrency=3).run(range(9), apply)
+    assert state['most'] == 3
+    assert [x.number for x in results] == list(range(1, 10))
+    assert rollout.aggregate_exit_code(results) == 0
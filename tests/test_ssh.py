@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+""" tests.test_ssh
+"""
+
+import os
+
+import pytest
+
+from .backports import TemporaryDirectory
+from .test_startup import has_command
+from ansible_role import ssh
+
+
+def test_ssh_env(monkeypatch):
+    monkeypatch.setenv('ANSIBLE_SSH_ARGS', '-o ControlPersist=5s')
+    with TemporaryDirectory() as tmp_dir:
+        env = ssh.get_ssh_env(tmp_dir, persist=30)
+        control_dir = env['ANSIBLE_SSH_CONTROL_PATH_DIR']
+        assert control_dir == os.path.join(tmp_dir, ssh.CONTROL_DIR)
+        assert os.stat(control_dir).st_mode & 0o777 == 0o700
+    # the user's own options come first, and take precedence in ssh
+    assert env['ANSIBLE_SSH_ARGS'] == (
+        '-o ControlPersist=5s -o ControlMaster=auto -o ControlPersist=30s')
+    assert env['ANSIBLE_PIPELINING'] == 'True'
+
+
+@pytest.mark.skipif(not has_command('ssh'), reason="needs ssh")
+def test_stale_connections_are_removed():
+    messages = []
+    with TemporaryDirectory() as tmp_dir:
+        control_dir = os.path.join(tmp_dir, ssh.CONTROL_DIR)
+        os.makedirs(control_dir)
+        stale = os.path.join(control_dir, 'web1-22-deploy')
+        open(stale, 'w').close()
+        assert ssh.connections(tmp_dir) == [stale]
+        assert ssh.manage_connections(
+            'status', tmp_dir, report=messages.append) == 0
+        assert not os.path.exists(stale)
+    assert messages == ['web1-22-deploy: stale, removing']
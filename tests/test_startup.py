@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+""" tests.test_startup
+
+    cold-start time budgets for the ansible-role command.  every
+    measurement runs in a fresh interpreter, best of a few attempts.
+    budgets are in seconds and can be overridden from the environment:
+
+      ANSIBLE_ROLE_STARTUP_BUDGET  `ansible-role --help` (default: 0.5)
+      ANSIBLE_ROLE_RUN_BUDGET      applying a cached local role, for
+                                   real and as a dry run (default: 15)
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+from .backports import TemporaryDirectory
+from .roles import make_role
+
+STARTUP_BUDGET = float(os.environ.get('ANSIBLE_ROLE_STARTUP_BUDGET', 0.5))
+RUN_BUDGET = float(os.environ.get('ANSIBLE_ROLE_RUN_BUDGET', 15))
+ATTEMPTS = 3
+
+# modules that only some code paths need, and that must not be
+# paid for by a bare `import ansible_role`
+LAZY_MODULES = [
+    'argparse', 'subprocess', 'multiprocessing', 'tempfile',
+    'shutil', 'json', 'hashlib', 'shellescape', 'fabric', 'ansible',
+    'sqlite3',
+]
+
+ENTRY = 'import sys; from ansible_role import entry; entry(sys.argv[1:])'
+
+
+def has_command(name):
+    return any(
+        os.access(os.path.join(path, name), os.X_OK)
+        for path in os.environ.get('PATH', '').split(os.pathsep))
+
+
+def cold_start(args, expected_code=0):
+    """ best wall-clock time for `ansible-role ARGS` in a new process """
+    best = None
+    for _ in range(ATTEMPTS):
+        start = time.time()
+        proc = subprocess.Popen(
+            [sys.executable, '-c', ENTRY] + args,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        elapsed = time.time() - start
+        assert proc.returncode == expected_code, output
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def test_import_is_lazy():
+    script = 'import sys, ansible_role; print(" ".join(sys.modules))'
+    output = subprocess.check_output([sys.executable, '-c', script])
+    loaded = set(output.decode('utf-8').split())
+    assert [x for x in LAZY_MODULES if x in loaded] == []
+
+
+def test_help_startup_budget():
+    elapsed = cold_start(['--help'])
+    print("ansible-role --help: {0:.3f}s".format(elapsed))
+    assert elapsed < STARTUP_BUDGET
+
+
+@pytest.mark.skipif(
+    not has_command('ansible-playbook'), reason='needs ansible-playbook')
+@pytest.mark.parametrize('extra_args', [[], ['--check']])
+def test_cached_role_run_budget(extra_args):
+    with TemporaryDirectory() as module_path:
+        # a role that needs no network and no privileges
+        role_name = 'local.noop'
+        make_role(os.path.join(module_path, 'roles'), role_name)
+        elapsed = cold_start(
+            [role_name, '--module-path', module_path] + extra_args)
+    print("ansible-role {0} {1}: {2:.3f}s".format(
+        role_name, ' '.join(extra_args), elapsed))
+    assert elapsed < RUN_BUDGET
+
+
+def test_plan_startup_budget():
+    with TemporaryDirectory() as module_path:
+        role_name = 'local.noop'
+        make_role(os.path.join(module_path, 'roles'), role_name)
+        elapsed = cold_start(
+            ['--plan', role_name, 'web1,web2', '--module-path', module_path])
+    print("ansible-role --plan {0}: {1:.3f}s".format(role_name, elapsed))
+    assert elapsed < STARTUP_BUDGET
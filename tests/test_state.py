@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+""" tests.test_state
+"""
+
+import os
+
+import mock
+
+from .backports import TemporaryDirectory
+from .roles import make_role
+from ansible_role import run_changed_only, skip_if_unchanged, state
+
+
+def make_role_dir(tmp_dir):
+    make_role(os.path.join(tmp_dir, 'roles'), 'some.role')
+    return os.path.join(tmp_dir, 'roles')
+
+
+def test_fingerprint_and_ttl():
+    with TemporaryDirectory() as tmp_dir:
+        role_dir = make_role_dir(tmp_dir)
+        store = state.StateStore(tmp_dir, ttl=60)
+        fingerprint = store.fingerprint(role_dir, ['some.role'], 'web1', [])
+        assert fingerprint != store.fingerprint(
+            role_dir, ['some.role'], 'web1', ['-e', 'x=1'])
+        assert fingerprint != store.fingerprint(
+            role_dir, ['some.role'], 'web2', [])
+        assert fingerprint != store.fingerprint(
+            role_dir, ['some.role'], 'web1', [],
+            dict(vars={'http_port': '8080'}))
+        assert fingerprint == store.fingerprint(
+            role_dir, ['some.role'], 'web1', [], dict(become=None))
+        assert store.unchanged('web1', fingerprint) is None
+        store.record('web1', fingerprint)
+        assert store.unchanged('web1', fingerprint)
+        with open(os.path.join(role_dir, 'some.role', 'extra.yml'), 'w'):
+            pass
+        assert state.StateStore(tmp_dir).fingerprint(
+            role_dir, ['some.role'], 'web1', []) != fingerprint
+        store.ttl = -1
+        assert store.unchanged('web1', fingerprint) is None
+
+
+def test_content_hashes_cover_dependencies():
+    from ansible_role import index
+    with TemporaryDirectory() as tmp_dir:
+        role_dir = make_role_dir(tmp_dir)
+        for name in ('user.dep', 'user.other'):
+            make_role(role_dir, name)
+        make_role(role_dir, 'some.role', files={
+            'meta/main.yml': 'dependencies:\n- user.dep\n'})
+        hashes = state.content_hashes(role_dir, ['some.role'])
+        assert [x[0] for x in hashes] == ['some.role', 'user.dep']
+        # galaxy roles use the indexed hash
+        index.RoleIndex(role_dir).record('user.dep', source='galaxy')
+        with mock.patch('ansible_role.index.hash_tree',
+                        return_value='tree') as hash_tree:
+            hashes = dict(state.content_hashes(role_dir, ['some.role']))
+        assert hash_tree.call_count == 1
+        assert hashes['some.role'] == 'tree'
+        assert hashes['user.dep'] != 'tree'
+
+
+def test_skip_if_unchanged():
+    with TemporaryDirectory() as tmp_dir:
+        role_dir = make_role_dir(tmp_dir)
+        store = state.StateStore(tmp_dir)
+        run_play = mock.Mock(return_value=(True, 0))
+        run = skip_if_unchanged(
+            run_play, store, ['some.role'], role_dir, 'web1',
+            report=lambda msg, **kargs: None)
+        assert run(['--check']) == (True, 0)
+        assert run([]) == (True, 0)
+        assert run([]) == (True, 0)
+        assert run_play.call_count == 2
+        run_play.return_value = (False, 2)
+        assert run(['-e', 'x=1']) == (False, 2)
+        assert store.get('web1') is None
+    assert skip_if_unchanged(run_play, None, [], '', 'web1') is run_play
+
+
+def test_changed_only_covers_play_options():
+    with TemporaryDirectory() as tmp_dir:
+        role_dir = make_role_dir(tmp_dir)
+        store = state.StateStore(tmp_dir)
+        run_play = mock.Mock(return_value=(True, 0))
+
+        def run(options):
+            return run_changed_only(
+                run_play, store, ['some.role'], role_dir, 'web1',
+                report=lambda msg, **kargs: None, play_options=options)([])
+        run(dict(vars={'http_port': '8080'}))
+        run(dict(vars={'http_port': '8080'}))
+        assert run_play.call_count == 1
+        run(dict(vars={'http_port': '9090'}))
+        assert run_play.call_count == 2